@@ -0,0 +1,224 @@
+import logging
+import math
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+
+class Overloaded(Exception):
+    """A request was shed; retry_after is the suggested wait in whole seconds."""
+    def __init__(self, retry_after):
+        super().__init__(f"Overloaded, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+
+def retry_after_estimate(waiting, service_time, workers):
+    """Seconds until the requests ahead have been served, at least one."""
+    return max(1, math.ceil((waiting + 1) * service_time / max(1, workers)))
+
+
+class RequestCoalescer:
+    """Concurrent calls with the same key share one computation.
+
+    The first caller for a key runs the function; callers arriving while it
+    runs wait for and return the same result (or exception). Nothing is
+    cached afterwards, so a later call computes afresh.
+    """
+    def __init__(self):
+        self.leaders = 0
+        self.coalesced = 0
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def run(self, key, fn, *args):
+        with self._lock:
+            future = self._calls.get(key)
+            if future is None:
+                future = self._calls[key] = Future()
+                self.leaders += 1
+                leader = True
+            else:
+                self.coalesced += 1
+                leader = False
+        if not leader:
+            return future.result()
+        try:
+            result = fn(*args)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+
+class SqliteRateLimitBackend:
+    """Token buckets in a SQLite file, so every worker on a host draws from the same buckets."""
+    def __init__(self, path, purge_every=1000):
+        self.path = str(path)
+        self.purge_every = purge_every
+        self._calls = 0
+        self._local = threading.local()
+        self._connection().execute(
+            "CREATE TABLE IF NOT EXISTS buckets (client TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)"
+        )
+
+    def _connection(self):
+        """Return the connection owned by the calling thread."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            # Autocommit mode, so BEGIN IMMEDIATE below controls the transaction
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def take(self, client, cost, rate, burst, now):
+        """Refill and draw from one bucket atomically; returns the seconds to wait, 0.0 if allowed."""
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT tokens, updated FROM buckets WHERE client = ?", (client,)).fetchone()
+            tokens, wait = refill_and_take(row, cost, rate, burst, now)
+            conn.execute("INSERT OR REPLACE INTO buckets (client, tokens, updated) VALUES (?, ?, ?)",
+                         (client, tokens, now))
+            self._calls += 1
+            if self._calls % self.purge_every == 0:
+                # A bucket idle long enough to be full again holds no state worth keeping;
+                # one in debt after a large batch takes longer to refill
+                conn.execute("DELETE FROM buckets WHERE updated + (? - tokens) / ? < ?", (burst, rate, now))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return wait
+
+
+def refill_and_take(state, cost, rate, burst, now):
+    """(tokens left, seconds to wait) for a bucket state of (tokens, updated) or None for a new client.
+
+    A cost above burst is allowed once the bucket is full and leaves it in
+    debt (negative tokens), so the client pays the full cost in waiting time.
+    """
+    tokens, updated = state if state is not None else (burst, now)
+    tokens = min(burst, tokens + max(0.0, now - updated) * rate)
+    needed = min(cost, burst)
+    if tokens >= needed:
+        return tokens - cost, 0.0
+    return tokens, (needed - tokens) / rate
+
+
+class RateLimiter:
+    """Token bucket per client: rate tokens per second, holding at most burst.
+
+    Each request takes cost tokens. A cost above burst gets through once the
+    bucket is full but is charged in full, leaving the bucket in debt until it
+    refills. Buckets live in an LRU of at
+    most max_clients entries, or in a shared backend such as
+    SqliteRateLimitBackend when several worker processes serve one host.
+    """
+    def __init__(self, rate, burst, max_clients=100000, backend=None):
+        if rate <= 0 or burst <= 0:
+            raise ValueError("rate and burst must be positive")
+        self.rate = rate
+        self.burst = burst
+        self.max_clients = max_clients
+        self.backend = backend
+        self.allowed = 0
+        self.limited = 0
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def acquire(self, client, cost=1):
+        """Take tokens for one request; returns 0.0 if allowed, else the seconds until it would be."""
+        if self.backend is not None:
+            try:
+                wait = self.backend.take(client, cost, self.rate, self.burst, time.time())
+            except sqlite3.Error as e:
+                # Fail open: a busy or broken backend shouldn't take the chat down
+                logger.error("Error updating rate limit for %s: %s", client, e)
+                wait = 0.0
+        else:
+            now = time.monotonic()
+            with self._lock:
+                tokens, wait = refill_and_take(self._buckets.pop(client, None), cost, self.rate, self.burst, now)
+                self._buckets[client] = (tokens, now)
+                if len(self._buckets) > self.max_clients:
+                    self._buckets.popitem(last=False)
+        with self._lock:
+            if wait:
+                self.limited += 1
+            else:
+                self.allowed += 1
+        return wait
+
+
+class AdmissionQueue:
+    """Caps requests in progress and sheds load once too many are waiting.
+
+    Up to max_active requests run at once; up to max_waiting more wait for a
+    slot, each for at most wait_timeout seconds. Past that, admission raises
+    Overloaded immediately, with a Retry-After hint from the average service
+    time, so an overloaded worker answers fast instead of queueing without bound.
+    """
+    def __init__(self, max_active=32, max_waiting=64, wait_timeout=5.0):
+        self.max_active = max_active
+        self.max_waiting = max_waiting
+        self.wait_timeout = wait_timeout
+        self.active = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.shed = 0
+        self._service_time = 0.05
+        self._condition = threading.Condition()
+
+    def acquire(self):
+        """Take a slot, waiting if needed; returns a ticket for release(). Raises Overloaded."""
+        with self._condition:
+            if self.active >= self.max_active:
+                if self.waiting >= self.max_waiting:
+                    self.shed += 1
+                    raise Overloaded(self.retry_after())
+                self.waiting += 1
+                try:
+                    deadline = time.monotonic() + self.wait_timeout
+                    while self.active >= self.max_active:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            self.shed += 1
+                            raise Overloaded(self.retry_after())
+                        self._condition.wait(remaining)
+                finally:
+                    self.waiting -= 1
+            self.active += 1
+            self.admitted += 1
+        return time.perf_counter()
+
+    def release(self, ticket):
+        """Free the slot taken by acquire()."""
+        elapsed = time.perf_counter() - ticket
+        with self._condition:
+            self.active -= 1
+            self._service_time = 0.9 * self._service_time + 0.1 * elapsed
+            self._condition.notify()
+
+    @contextmanager
+    def admit(self):
+        """Hold a slot for the duration of a with block."""
+        ticket = self.acquire()
+        try:
+            yield
+        finally:
+            self.release(ticket)
+
+    def retry_after(self):
+        return retry_after_estimate(self.waiting, self._service_time, self.max_active)
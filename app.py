@@ -1,27 +1,273 @@
 import os
+import hmac
+import math
+import uuid
+import atexit
 import logging
-from flask import Flask, render_template, request, jsonify
-from chatbot import AphatorChatbot
+from functools import wraps
+from flask import Flask, Response, render_template, request, jsonify, session
+from chatbot import AphatorChatbot, ConversationContext, DEFAULT_INDEX_ARTIFACT
+from session_store import SessionStore, SqliteSessionBackend
+from response_cache import ResponseCache
+from file_watcher import FileWatcher
+from scoring_pool import ScoringPool
+from metrics import Metrics
+from tenants import TenantRegistry, tenant_paths
+from streaming import SSE_PREAMBLE, sse_event, sse_response_events
+from structured_logging import configure_logging, parse_sample_rates
+from transcripts import TranscriptLog
+from admission import AdmissionQueue, Overloaded, RateLimiter, SqliteRateLimitBackend
 
-# Configure logging
-logging.basicConfig(level=logging.DEBUG)
+# Logs are written by a background thread; LOG_FORMAT=text for the one-line format and
+# LOG_SAMPLE_RATES (e.g. "DEBUG=0.01,INFO=0.1") to keep only a share of each level
+configure_logging(
+    level=os.environ.get("LOG_LEVEL", "INFO"),
+    log_format=os.environ.get("LOG_FORMAT", "json"),
+    sample_rates=parse_sample_rates(os.environ.get("LOG_SAMPLE_RATES")),
+    queue_size=int(os.environ.get("LOG_QUEUE_SIZE", "10000"))
+)
 logger = logging.getLogger(__name__)
 
 # Create Flask app
 app = Flask(__name__)
 app.secret_key = os.environ.get("SESSION_SECRET", "default-secret-key-for-dev")
 
+# Per-visitor conversation contexts; set SESSION_DB to share them across workers
+session_db = os.environ.get("SESSION_DB")
+session_store = SessionStore(
+    context_factory=lambda: ConversationContext(max_history=10),
+    context_loader=ConversationContext.from_dict,
+    max_sessions=int(os.environ.get("SESSION_MAX", "10000")),
+    ttl=int(os.environ.get("SESSION_TTL", "1800")),
+    backend=SqliteSessionBackend(session_db) if session_db else None
+)
+# Conversations replayed through /api/chat/batch are kept apart, in at most
+# BATCH_SESSION_MAX contexts, so a large replay can't evict visitors' sessions
+batch_session_store = SessionStore(
+    context_factory=lambda: ConversationContext(max_history=10),
+    context_loader=ConversationContext.from_dict,
+    max_sessions=int(os.environ.get("BATCH_SESSION_MAX", "1000")),
+    ttl=int(os.environ.get("SESSION_TTL", "1800")),
+    backend=SqliteSessionBackend(session_db) if session_db else None
+)
+
+# Learned-response cache; set LEARNED_CACHE_SNAPSHOT so fresh workers start warm
+learned_cache = ResponseCache(
+    max_size=int(os.environ.get("LEARNED_CACHE_SIZE", "5000")),
+    ttl=int(os.environ.get("LEARNED_CACHE_TTL", "86400")) or None,
+    policy=os.environ.get("LEARNED_CACHE_POLICY", "lru")
+)
+learned_cache_snapshot = os.environ.get("LEARNED_CACHE_SNAPSHOT")
+if learned_cache_snapshot:
+    learned_cache.load_snapshot(learned_cache_snapshot)
+    learned_cache.start_autosave(learned_cache_snapshot, int(os.environ.get("LEARNED_CACHE_SNAPSHOT_INTERVAL", "300")))
+    atexit.register(learned_cache.save_snapshot, learned_cache_snapshot)
+
+# Memoized decisions for repeated questions
+response_memo = ResponseCache(max_size=int(os.environ.get("RESPONSE_MEMO_SIZE", "10000")))
+
+# Per-stage latency histograms for /metrics; METRICS_ENABLED=0 turns instrumentation off
+metrics = Metrics() if os.environ.get("METRICS_ENABLED", "1") != "0" else None
+
+# Every exchange appended to rotating, gzipped JSONL segments in TRANSCRIPT_DIR for
+# analytics and knowledge-base mining; written by a background thread
+transcript_dir = os.environ.get("TRANSCRIPT_DIR")
+transcripts = TranscriptLog(
+    transcript_dir,
+    segment_bytes=int(float(os.environ.get("TRANSCRIPT_SEGMENT_MB", "64")) * 2 ** 20),
+    segment_seconds=int(os.environ.get("TRANSCRIPT_SEGMENT_SECONDS", "3600"))
+).start() if transcript_dir else None
+
 # Initialize chatbot
-chatbot = AphatorChatbot()
+chatbot = AphatorChatbot(
+    session_store=session_store,
+    learned_cache=learned_cache,
+    learn_base_responses=os.environ.get("LEARN_BASE_RESPONSES", "1") != "0",
+    response_memo=response_memo,
+    retrieval_index=os.environ.get("RETRIEVAL_INDEX", "auto"),
+    # 'dense' or 'hybrid' add embedding similarity to catch paraphrases TF-IDF misses
+    retrieval_mode=os.environ.get("RETRIEVAL_MODE", "tfidf"),
+    # A .txt/.md file or a documentation folder, chunked by section into the knowledge base
+    text_data_file=os.environ.get("TEXT_DATA_PATH") or None,
+    # Built with `python index_artifact.py`; ignored if missing or stale
+    index_artifact=os.environ.get("INDEX_ARTIFACT", str(DEFAULT_INDEX_ARTIFACT)),
+    metrics=metrics,
+    transcripts=transcripts,
+    # 'lazy' or 'background' defer numpy/scipy and the index build for faster cold starts
+    startup=os.environ.get("STARTUP_MODE", "eager")
+)
+
+
+# Analyze messages in worker processes so threaded workers are not serialized on the GIL
+scoring_processes = int(os.environ.get("SCORING_PROCESSES", "0"))
+if scoring_processes > 0:
+    chatbot.scoring_pool = ScoringPool(chatbot, processes=scoring_processes)
+
+# Apply company_data.json and documentation edits without a restart; set KB_WATCH_INTERVAL=0 to disable.
+# Admin API edits are written to company_data.json, so other workers only see them through this watcher
+kb_watch_interval = float(os.environ.get("KB_WATCH_INTERVAL", "5"))
+if kb_watch_interval > 0:
+    FileWatcher([chatbot.data_file], chatbot.reload_company_data, interval=kb_watch_interval).start()
+    FileWatcher([], chatbot.reload_documents, interval=kb_watch_interval, changed=chatbot.documents.changed).start()
+
+# Knowledge-base admin API is only enabled when ADMIN_TOKEN is set
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN")
+# /metrics reveals traffic, tenants and cache contents, so scrapers must send this bearer
+# token (ADMIN_TOKEN if unset); with neither set the endpoint is disabled
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN") or ADMIN_TOKEN
+
+# Several brands from one worker: each subdirectory of TENANTS_DIR with a company_data.json
+# is served at /api/<tenant>/chat, loaded on first use and evicted least recently used
+# beyond TENANT_MAX_LOADED tenants or TENANT_MEMORY_BUDGET_MB of estimated heap memory
+def make_tenant_chatbot(name, directory):
+    """Build one tenant's chatbot with its own, smaller caches and the shared settings."""
+    return AphatorChatbot(
+        session_store=SessionStore(
+            context_factory=lambda: ConversationContext(max_history=10),
+            context_loader=ConversationContext.from_dict,
+            max_sessions=int(os.environ.get("TENANT_SESSION_MAX", "1000")),
+            ttl=int(os.environ.get("SESSION_TTL", "1800")),
+            backend=SqliteSessionBackend(session_db) if session_db else None
+        ),
+        learned_cache=ResponseCache(max_size=int(os.environ.get("TENANT_LEARNED_CACHE_SIZE", "1000"))),
+        learn_base_responses=os.environ.get("LEARN_BASE_RESPONSES", "1") != "0",
+        response_memo=ResponseCache(max_size=int(os.environ.get("TENANT_RESPONSE_MEMO_SIZE", "1000"))),
+        retrieval_index=os.environ.get("RETRIEVAL_INDEX", "auto"),
+        retrieval_mode=os.environ.get("RETRIEVAL_MODE", "tfidf"),
+        metrics=metrics,
+        transcripts=transcripts,
+        **tenant_paths(directory)
+    )
+
+tenants_dir = os.environ.get("TENANTS_DIR")
+tenants = TenantRegistry(
+    tenants_dir,
+    chatbot_factory=make_tenant_chatbot,
+    max_loaded=int(os.environ.get("TENANT_MAX_LOADED", "0")) or None,
+    memory_budget=int(float(os.environ.get("TENANT_MEMORY_BUDGET_MB", "0")) * 2 ** 20) or None
+) if tenants_dir else None
+
+# Upper bound on messages accepted by /api/chat/batch
+BATCH_MAX_MESSAGES = int(os.environ.get("BATCH_MAX_MESSAGES", "1000"))
+
+# Per-client token buckets for the chat routes: RATE_LIMIT_PER_SECOND messages per second
+# with bursts of RATE_LIMIT_BURST (0 disables); RATE_LIMIT_DB shares the buckets across workers
+rate_limit = float(os.environ.get("RATE_LIMIT_PER_SECOND", "0"))
+rate_limit_db = os.environ.get("RATE_LIMIT_DB")
+rate_limiter = RateLimiter(
+    rate_limit,
+    float(os.environ.get("RATE_LIMIT_BURST", "20")),
+    backend=SqliteRateLimitBackend(rate_limit_db) if rate_limit_db else None
+) if rate_limit > 0 else None
+# Clients are identified by the first X-Forwarded-For address only behind a trusted proxy
+TRUST_PROXY_HEADERS = os.environ.get("TRUST_PROXY_HEADERS", "0") == "1"
+
+# Chat requests in progress per worker; beyond ADMISSION_MAX_WAITING queued ones, or after
+# ADMISSION_WAIT_TIMEOUT seconds in the queue, requests get a fast 503 with Retry-After
+admission = AdmissionQueue(
+    max_active=int(os.environ.get("ADMISSION_MAX_ACTIVE", "32")),
+    max_waiting=int(os.environ.get("ADMISSION_MAX_WAITING", "64")),
+    wait_timeout=float(os.environ.get("ADMISSION_WAIT_TIMEOUT", "5"))
+)
+
+# With CHAT_DEBUG=1, "debug": true in a chat request (or ?debug=true) adds the branch that fired
+# and the ranked retrieval candidates with their scores to the reply. The trace exposes
+# knowledge-base entries and scores, so it is off by default and, when ADMIN_TOKEN is set,
+# only returned to requests carrying that bearer token
+CHAT_DEBUG = os.environ.get("CHAT_DEBUG", "0") == "1"
+
+
+def debug_requested(value, authorization=''):
+    """Whether a debug flag from a request body or query string asks for the trace, and may have it."""
+    if not CHAT_DEBUG or not (value is True or str(value).lower() in ('1', 'true')):
+        return False
+    return not ADMIN_TOKEN or hmac.compare_digest(authorization or '', f"Bearer {ADMIN_TOKEN}")
+
+
+def get_session_id():
+    """Return the chat session id from the Flask session cookie, creating one if needed."""
+    if 'chat_session_id' not in session:
+        session['chat_session_id'] = uuid.uuid4().hex
+    return session['chat_session_id']
+
+def client_id():
+    """The address rate limits are counted against."""
+    if TRUST_PROXY_HEADERS and request.access_route:
+        return request.access_route[0]
+    return request.remote_addr or 'unknown'
+
+def busy_response(status, error, retry_after):
+    response = jsonify({'error': error})
+    response.status_code = status
+    response.headers['Retry-After'] = str(max(1, math.ceil(retry_after)))
+    return response
+
+def batch_cost():
+    """Rate limit tokens for a batch request: one per message."""
+    data = request.get_json(silent=True)
+    items = data.get('messages') if isinstance(data, dict) else None
+    return len(items) if isinstance(items, list) and items else 1
+
+def admission_controlled(cost=None, streaming=False):
+    """Rate limit a chat route per client and run it inside an admission queue slot.
+
+    cost returns the request's rate limit tokens (1 by default). A streaming
+    view holds its slot until the response is closed, not just until the
+    view returns.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if rate_limiter is not None:
+                wait = rate_limiter.acquire(client_id(), cost() if cost else 1)
+                if wait:
+                    return busy_response(429, 'Too many requests', wait)
+            try:
+                ticket = admission.acquire()
+            except Overloaded as e:
+                return busy_response(503, 'Server is busy, please retry', e.retry_after)
+            if not streaming:
+                try:
+                    return view(*args, **kwargs)
+                finally:
+                    admission.release(ticket)
+            try:
+                response = view(*args, **kwargs)
+            except Exception:
+                admission.release(ticket)
+                raise
+            response = app.make_response(response)
+            response.call_on_close(lambda: admission.release(ticket))
+            return response
+        return wrapper
+    return decorator
+
+def bearer_token_required(token, disabled_error):
+    """Require an Authorization bearer token; the route answers 404 when no token is configured."""
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if not token:
+                return jsonify({'error': disabled_error}), 404
+            supplied = request.headers.get('Authorization', '')
+            if not hmac.compare_digest(supplied, f"Bearer {token}"):
+                return jsonify({'error': 'Unauthorized'}), 401
+            return view(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+# Knowledge-base admin routes
+admin_required = bearer_token_required(ADMIN_TOKEN, 'Admin API is disabled')
+
 
 @app.route('/')
 def index():
     """Render the main chat interface."""
     return render_template('index.html')
 
-@app.route('/api/chat', methods=['POST'])
-def chat():
-    """Process user messages and return chatbot responses."""
+def answer_chat(bot, session_id):
+    """Answer the message in the request body with the given chatbot."""
     try:
         data = request.json
         user_message = data.get('message', '').strip()
@@ -29,14 +275,246 @@ def chat():
         if not user_message:
             return jsonify({'error': 'Empty message'}), 400
         
-        logger.debug(f"Received message: {user_message}")
+        logger.debug("Received message: %s", user_message)
         
         # Process user message through chatbot
-        response = chatbot.get_response(user_message)
+        debug = data.get('debug', request.args.get('debug'))
+        trace = {} if debug_requested(debug, request.headers.get('Authorization', '')) else None
+        response = bot.get_response(user_message, session_id=session_id, trace=trace)
         
+        if trace is not None:
+            return jsonify({'response': response, 'debug': trace})
         return jsonify({
             'response': response
         })
     except Exception as e:
-        logger.error(f"Error processing message: {str(e)}")
+        logger.error("Error processing message: %s", e)
         return jsonify({'error': 'Failed to process your message. Please try again.'}), 500
+
+@app.route('/api/chat', methods=['POST'])
+@admission_controlled()
+def chat():
+    """Process user messages and return chatbot responses."""
+    return answer_chat(chatbot, get_session_id())
+
+@app.route('/api/<tenant>/chat', methods=['POST'])
+@admission_controlled()
+def tenant_chat(tenant):
+    """Process user messages with one tenant's chatbot."""
+    if tenants is None or tenant not in tenants:
+        return jsonify({'error': 'Unknown tenant'}), 404
+    try:
+        bot = tenants.get(tenant)
+    except KeyError:
+        return jsonify({'error': 'Unknown tenant'}), 404
+    # Tenants may share a session backend, so their session ids must not collide
+    return answer_chat(bot, f"{tenant}:{get_session_id()}")
+
+@app.route('/api/chat/stream', methods=['POST'])
+@admission_controlled(streaming=True)
+def chat_stream():
+    """Send the chatbot response sentence by sentence as Server-Sent Events.
+
+    Events: "chunk" ({"text": ...}) per sentence, then "done" ({"response": ...})
+    with the full text, or "error" ({"error": ...}). The response is computed
+    whole before the first chunk, so this saves no time over /api/chat.
+    """
+    data = request.json or {}
+    user_message = str(data.get('message', '')).strip()
+    
+    if not user_message:
+        return jsonify({'error': 'Empty message'}), 400
+    
+    logger.debug("Received streamed message: %s", user_message)
+    # Resolve the session before streaming starts so its cookie goes out with the headers
+    session_id = get_session_id()
+    
+    def generate():
+        yield SSE_PREAMBLE
+        try:
+            response = chatbot.get_response(user_message, session_id=session_id)
+        except Exception as e:
+            logger.error("Error processing message: %s", e)
+            yield sse_event('error', {'error': 'Failed to process your message. Please try again.'})
+            return
+        yield from sse_response_events(response)
+    
+    return Response(generate(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/api/chat/batch', methods=['POST'])
+@admission_controlled(cost=batch_cost)
+def chat_batch():
+    """Process a batch of user messages in order and return one response per message.
+
+    Messages are plain strings, answered in the caller's session, or objects
+    with "message" and an optional "session_id" for replaying several
+    conversations at once. Replayed session ids are namespaced under the
+    caller's session, so a batch can never read or write anyone else's, and
+    their contexts live in batch_session_store.
+    """
+    try:
+        data = request.json or {}
+        items = data.get('messages')
+        
+        if not isinstance(items, list) or not items:
+            return jsonify({'error': 'Expected a non-empty list of messages'}), 400
+        if len(items) > BATCH_MAX_MESSAGES:
+            return jsonify({'error': f'Batch exceeds {BATCH_MAX_MESSAGES} messages'}), 413
+        
+        caller_session_id = get_session_id()
+        messages = []
+        session_ids = []
+        replayed = []
+        for item in items:
+            if isinstance(item, dict):
+                message = str(item.get('message', '')).strip()
+                session_id = item.get('session_id')
+            else:
+                message = str(item).strip()
+                session_id = None
+            if not message:
+                return jsonify({'error': 'Empty message'}), 400
+            messages.append(message)
+            session_ids.append(caller_session_id if session_id is None else f"batch:{caller_session_id}:{session_id}")
+            replayed.append(session_id is not None)
+        
+        logger.debug("Received batch of %s messages", len(messages))
+        
+        # Sessions never span the two groups, so answering them separately keeps each one's order
+        responses = [None] * len(messages)
+        for store, in_group in ((session_store, False), (batch_session_store, True)):
+            positions = [i for i, flag in enumerate(replayed) if flag == in_group]
+            if positions:
+                answers = chatbot.get_responses([messages[i] for i in positions],
+                                                session_ids=[session_ids[i] for i in positions], sessions=store)
+                for i, answer in zip(positions, answers):
+                    responses[i] = answer
+        
+        return jsonify({
+            'responses': responses
+        })
+    except Exception as e:
+        logger.error("Error processing batch: %s", e)
+        return jsonify({'error': 'Failed to process your messages. Please try again.'}), 500
+
+
+@app.route('/ready', methods=['GET'])
+def ready():
+    """Readiness probe: 503 while a background warm-up is building the index, 200 otherwise.
+
+    With STARTUP_MODE=lazy the index is built by the first message that needs
+    it, so the worker is ready before retrieval is.
+    """
+    index = chatbot.index
+    if index is None:
+        if chatbot.warming_up:
+            return jsonify({'ready': False, 'retrieval': False}), 503
+        return jsonify({'ready': True, 'retrieval': False})
+    return jsonify({'ready': True, 'retrieval': True, 'index_version': index.version, 'entries': len(index)})
+
+
+@app.route('/metrics', methods=['GET'])
+@bearer_token_required(METRICS_TOKEN, 'Metrics endpoint is disabled')
+def prometheus_metrics():
+    """Expose pipeline timings, answer branches and cache ratios in Prometheus text format."""
+    if metrics is None:
+        return jsonify({'error': 'Metrics are disabled'}), 404
+    rule_stats = chatbot.rules.stats()
+    gauges = {
+        'aphator_sessions': ('Conversation contexts held in memory.', len(chatbot.sessions)),
+        'aphator_knowledge_entries': ('Entries in the published knowledge base.',
+                                      len(chatbot.index) if chatbot.index is not None else 0),
+        'aphator_rules_version': ('Number of rule table loads.', rule_stats['version'])
+    }
+    counters = {
+        'aphator_rule_evaluations_total': ('Rules evaluated against messages.', rule_stats['evaluations'])
+    }
+    if tenants is not None:
+        tenant_report = tenants.report()
+        gauges['aphator_tenants_loaded'] = ('Tenant chatbots held in memory.', tenant_report['loaded'])
+        gauges['aphator_tenants_heap_bytes'] = ('Estimated heap memory of the loaded tenants.',
+                                                tenant_report['heap_bytes'])
+        counters['aphator_tenant_evictions_total'] = ('Tenants evicted to stay within limits.',
+                                                      tenant_report['evictions'])
+    gauges['aphator_admission_active'] = ('Chat requests in progress.', admission.active)
+    gauges['aphator_admission_waiting'] = ('Chat requests waiting for a slot.', admission.waiting)
+    counters['aphator_requests_shed_total'] = ('Chat requests answered 503 because the queue was full.', admission.shed)
+    counters['aphator_coalesced_decisions_total'] = ('Messages that shared a decision computed for an identical one.',
+                                                     chatbot.inflight.coalesced)
+    if rate_limiter is not None:
+        counters['aphator_rate_limited_total'] = ('Chat requests answered 429 by the per-client rate limit.',
+                                                  rate_limiter.limited)
+    if transcripts is not None:
+        counters['aphator_transcript_exchanges_total'] = ('Exchanges written to the transcript log.',
+                                                          transcripts.written)
+        counters['aphator_transcript_dropped_total'] = ('Exchanges dropped because the transcript queue was full.',
+                                                        transcripts.dropped)
+    body = metrics.render(
+        caches={
+            'learned': chatbot.learned_responses.stats(),
+            'response_memo': chatbot.response_memo.stats()
+        },
+        gauges=gauges,
+        counters=counters
+    )
+    return Response(body, mimetype='text/plain; version=0.0.4')
+
+
+@app.route('/api/admin/kb', methods=['GET'])
+@admin_required
+def kb_status():
+    """Report the published knowledge-base version and size."""
+    index = chatbot.ensure_index()
+    return jsonify({
+        'version': index.version,
+        'entries': len(index),
+        'terms': len(index.idf)
+    })
+
+
+@app.route('/api/admin/tenants', methods=['GET'])
+@admin_required
+def tenants_status():
+    """Report every tenant's loaded state and estimated memory."""
+    if tenants is None:
+        return jsonify({'error': 'Tenants are not configured'}), 404
+    return jsonify(tenants.report())
+
+
+@app.route('/api/admin/kb/entries', methods=['POST'])
+@admin_required
+def kb_update():
+    """Add, update or remove company_data.json entries and publish them as one new version.
+
+    The edit is saved to the data file, so it outlives restarts and reaches every worker.
+    Body: {"upsert": [{"kind": "faq", "question": ..., "answer": ...}, ...],
+           "remove": ["faq:<question>", "service:<name>", ...]}
+    """
+    try:
+        data = request.json or {}
+        changed = chatbot.update_knowledge(data.get('upsert', []), data.get('remove', []))
+        return jsonify({'changed': changed, 'version': chatbot.index.version})
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        logger.error("Error updating knowledge base: %s", e)
+        return jsonify({'error': 'Failed to update the knowledge base.'}), 500
+
+
+@app.route('/api/admin/kb/entries/<path:entry_id>', methods=['DELETE'])
+@admin_required
+def kb_remove(entry_id):
+    """Remove one knowledge-base entry."""
+    if not chatbot.update_knowledge(removals=[entry_id]):
+        return jsonify({'error': 'Unknown entry'}), 404
+    return jsonify({'changed': 1, 'version': chatbot.index.version})
+
+
+@app.route('/api/admin/kb/reload', methods=['POST'])
+@admin_required
+def kb_reload():
+    """Re-read company_data.json and changed documents now instead of waiting for the file watchers."""
+    changes = chatbot.reload_company_data()
+    changes['documents'] = chatbot.reload_documents()
+    return jsonify({'changes': changes, 'version': chatbot.index.version})
@@ -0,0 +1,331 @@
+# ASGI entry point for serving many open connections per worker, e.g.
+#   uvicorn asgi:app --workers 4
+# /api/chat and /api/chat/stream are handled natively on the event loop, with
+# the CPU-bound matching in a bounded thread pool the loop only awaits. Every
+# other route (the page, static files, batch and admin APIs) is passed to the
+# Flask app in the same pool.
+import asyncio
+import io
+import json
+import logging
+import math
+import os
+import sys
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from http.cookies import SimpleCookie
+from urllib.parse import parse_qs
+
+from werkzeug.http import dump_cookie
+
+from admission import Overloaded, retry_after_estimate
+from app import TRUST_PROXY_HEADERS, app as flask_app, chatbot, debug_requested, rate_limiter
+from streaming import SSE_PREAMBLE, sse_event, sse_response_events
+
+logger = logging.getLogger(__name__)
+
+# Threads running chatbot and Flask work, how many requests may be handed to them, and
+# how many more may wait on the event loop before requests are shed with a 503
+EXECUTOR_WORKERS = int(os.environ.get("ASGI_EXECUTOR_WORKERS", "4"))
+MAX_PENDING = int(os.environ.get("ASGI_MAX_PENDING", "256"))
+MAX_WAITING = int(os.environ.get("ASGI_MAX_WAITING", "1024"))
+
+
+class BoundedExecutor:
+    """Thread pool that lets at most max_pending calls queue or run at once.
+
+    Callers past the limit wait on the event loop instead of piling up
+    unbounded work behind the pool; once max_waiting are waiting, run()
+    raises Overloaded right away.
+    """
+    def __init__(self, max_workers, max_pending, max_waiting):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.max_waiting = max_waiting
+        self.waiting = 0
+        self.shed = 0
+        self._service_time = 0.05
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='chat-worker')
+        self._slots = None
+
+    def check(self):
+        """Raise Overloaded if a call made now would be shed."""
+        if self._slots is not None and self._slots.locked() and self.waiting >= self.max_waiting:
+            self.shed += 1
+            raise Overloaded(retry_after_estimate(self.waiting + self.max_pending, self._service_time, self.max_workers))
+
+    async def run(self, fn, *args):
+        if self._slots is None:
+            # Created lazily so it binds to the server's event loop
+            self._slots = asyncio.Semaphore(self.max_pending)
+        self.check()
+        self.waiting += 1
+        try:
+            await self._slots.acquire()
+        finally:
+            self.waiting -= 1
+        started = time.perf_counter()
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._pool, fn, *args)
+        finally:
+            self._slots.release()
+            self._service_time = 0.9 * self._service_time + 0.1 * (time.perf_counter() - started)
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False)
+
+
+executor = BoundedExecutor(EXECUTOR_WORKERS, MAX_PENDING, MAX_WAITING)
+
+
+async def read_body(receive):
+    """Read the full request body."""
+    body = b''
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            break
+        body += message.get('body', b'')
+        if not message.get('more_body'):
+            break
+    return body
+
+
+async def send_json(send, status, data, headers=()):
+    body = json.dumps(data).encode('utf-8')
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(b'content-type', b'application/json'), (b'content-length', str(len(body)).encode())] + list(headers)
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+
+def session_id_for(scope):
+    """Return (chat session id, Set-Cookie header or None) from Flask's signed session cookie."""
+    serializer = flask_app.session_interface.get_signing_serializer(flask_app)
+    cookie_name = flask_app.config['SESSION_COOKIE_NAME']
+    data = {}
+    for name, value in scope.get('headers', ()):
+        if name == b'cookie':
+            cookie = SimpleCookie(value.decode('latin-1')).get(cookie_name)
+            if cookie is not None:
+                try:
+                    data = serializer.loads(cookie.value, max_age=int(flask_app.permanent_session_lifetime.total_seconds()))
+                except Exception:
+                    data = {}
+    if 'chat_session_id' in data:
+        return data['chat_session_id'], None
+    data['chat_session_id'] = uuid.uuid4().hex
+    header = dump_cookie(cookie_name, serializer.dumps(data), httponly=True, path='/')
+    return data['chat_session_id'], (b'set-cookie', header.encode('latin-1'))
+
+
+def client_for(scope):
+    """The address rate limits are counted against, as in the Flask app."""
+    if TRUST_PROXY_HEADERS:
+        for name, value in scope.get('headers', ()):
+            if name == b'x-forwarded-for':
+                return value.decode('latin-1').split(',')[0].strip()
+    client = scope.get('client')
+    return client[0] if client else 'unknown'
+
+
+async def send_busy(send, status, error, retry_after):
+    await send_json(send, status, {'error': error}, [(b'retry-after', str(max(1, math.ceil(retry_after))).encode())])
+
+
+async def rate_limited(scope, send):
+    """Send a 429 and return True if the client is over its rate limit."""
+    if rate_limiter is None:
+        return False
+    if rate_limiter.backend is not None:
+        # A shared backend is a SQLite write that may wait on its busy timeout, so it
+        # runs on the loop's default thread pool rather than blocking every connection
+        wait = await asyncio.get_running_loop().run_in_executor(None, rate_limiter.acquire, client_for(scope))
+    else:
+        wait = rate_limiter.acquire(client_for(scope))
+    if not wait:
+        return False
+    await send_busy(send, 429, 'Too many requests', wait)
+    return True
+
+
+async def read_message(receive):
+    """Parse a JSON chat request body into (message, body); message is None if it is empty or invalid."""
+    try:
+        data = json.loads(await read_body(receive) or b'{}')
+    except ValueError:
+        return None, {}
+    if not isinstance(data, dict):
+        return None, {}
+    return str(data.get('message', '')).strip() or None, data
+
+
+def wants_trace(scope, data):
+    """Whether the request asked for a debug trace in its body or query string, as in the Flask app."""
+    value = data.get('debug')
+    if value is None:
+        value = parse_qs(scope.get('query_string', b'').decode('latin-1')).get('debug', [None])[-1]
+    authorization = ''
+    for name, header in scope.get('headers', ()):
+        if name == b'authorization':
+            authorization = header.decode('latin-1')
+    return debug_requested(value, authorization)
+
+
+async def chat(scope, receive, send):
+    """Async equivalent of the Flask /api/chat view."""
+    user_message, data = await read_message(receive)
+    if user_message is None:
+        await send_json(send, 400, {'error': 'Empty message'})
+        return
+    if await rate_limited(scope, send):
+        return
+    session_id, cookie = session_id_for(scope)
+    trace = {} if wants_trace(scope, data) else None
+    try:
+        response = await executor.run(chatbot.get_response, user_message, session_id, trace)
+    except Overloaded as e:
+        await send_busy(send, 503, 'Server is busy, please retry', e.retry_after)
+        return
+    except Exception as e:
+        logger.error("Error processing message: %s", e)
+        await send_json(send, 500, {'error': 'Failed to process your message. Please try again.'})
+        return
+    body = {'response': response}
+    if trace is not None:
+        body['debug'] = trace
+    await send_json(send, 200, body, [cookie] if cookie else [])
+
+
+async def chat_stream(scope, receive, send):
+    """Async equivalent of the Flask /api/chat/stream view."""
+    user_message, _ = await read_message(receive)
+    if user_message is None:
+        await send_json(send, 400, {'error': 'Empty message'})
+        return
+    if await rate_limited(scope, send):
+        return
+    try:
+        # Shed before the stream starts; once it has, errors can only be sent as events
+        executor.check()
+    except Overloaded as e:
+        await send_busy(send, 503, 'Server is busy, please retry', e.retry_after)
+        return
+    session_id, cookie = session_id_for(scope)
+    headers = [
+        (b'content-type', b'text/event-stream; charset=utf-8'),
+        (b'cache-control', b'no-cache'),
+        (b'x-accel-buffering', b'no')
+    ]
+    if cookie:
+        headers.append(cookie)
+    # Headers and a keep-alive comment go out before any matching work starts; the
+    # answer itself only follows once the whole response is computed
+    await send({'type': 'http.response.start', 'status': 200, 'headers': headers})
+    await send({'type': 'http.response.body', 'body': SSE_PREAMBLE.encode('utf-8'), 'more_body': True})
+    try:
+        response = await executor.run(chatbot.get_response, user_message, session_id)
+        events = sse_response_events(response)
+    except Exception as e:
+        logger.error("Error processing message: %s", e)
+        events = [sse_event('error', {'error': 'Failed to process your message. Please try again.'})]
+    for event in events:
+        await send({'type': 'http.response.body', 'body': event.encode('utf-8'), 'more_body': True})
+    await send({'type': 'http.response.body', 'body': b''})
+
+
+def wsgi_environ(scope, body):
+    """Build a WSGI environ for an ASGI HTTP request."""
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', ''),
+        'PATH_INFO': scope['path'],
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'REMOTE_ADDR': client[0],
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False
+    }
+    for name, value in scope.get('headers', ()):
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if name in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            environ[name] = value
+        elif f"HTTP_{name}" in environ:
+            environ[f"HTTP_{name}"] += f",{value}"
+        else:
+            environ[f"HTTP_{name}"] = value
+    # The body is fully buffered, so its length is known even for chunked uploads
+    environ['CONTENT_LENGTH'] = str(len(body))
+    environ.pop('HTTP_TRANSFER_ENCODING', None)
+    return environ
+
+
+def call_wsgi(environ):
+    """Run the Flask app to completion; returns (status code, headers, body)."""
+    response = {}
+
+    def start_response(status, headers, exc_info=None):
+        response['status'] = int(status.split(' ', 1)[0])
+        response['headers'] = [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers]
+
+    iterable = flask_app(environ, start_response)
+    try:
+        body = b''.join(iterable)
+    finally:
+        if hasattr(iterable, 'close'):
+            iterable.close()
+    return response['status'], response['headers'], body
+
+
+async def wsgi_fallback(scope, receive, send):
+    """Serve a request through the Flask app in the executor."""
+    environ = wsgi_environ(scope, await read_body(receive))
+    try:
+        status, headers, body = await executor.run(call_wsgi, environ)
+    except Overloaded as e:
+        await send_busy(send, 503, 'Server is busy, please retry', e.retry_after)
+        return
+    await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            executor.shutdown()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+# Natively async routes; everything else goes through Flask
+ROUTES = {
+    ('POST', '/api/chat'): chat,
+    ('POST', '/api/chat/stream'): chat_stream
+}
+
+
+async def app(scope, receive, send):
+    """ASGI application."""
+    if scope['type'] == 'lifespan':
+        await lifespan(receive, send)
+        return
+    if scope['type'] != 'http':
+        return
+    handler = ROUTES.get((scope['method'], scope['path']), wsgi_fallback)
+    await handler(scope, receive, send)
@@ -0,0 +1,101 @@
+"""Load test: a storm of identical chat messages, with and without request coalescing.
+
+Run from the repository root:
+
+    python benchmarks/bench_admission.py [--threads 64] [--rounds 20]
+
+Each round, --threads threads send the same message at once with an empty
+response memo, as when a popular question arrives before its answer is
+cached. --pipeline-ms adds latency to every pipeline run, standing in for
+a slow retrieval backend or a busy host. Reports how many times the response pipeline ran and the wall time
+per round, then how many requests an AdmissionQueue sheds at the same load.
+"""
+import argparse
+import logging
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from admission import AdmissionQueue, Overloaded, RequestCoalescer
+from chatbot import AphatorChatbot
+from response_cache import ResponseCache
+
+
+class NoCoalescing:
+    """Stand-in for RequestCoalescer that runs every call."""
+    coalesced = 0
+
+    def run(self, key, fn, *args):
+        return fn(*args)
+
+
+def storm(threads, target):
+    barrier = threading.Barrier(threads)
+
+    def worker(i):
+        barrier.wait()
+        target(i)
+
+    workers = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    start = time.perf_counter()
+    for worker_thread in workers:
+        worker_thread.start()
+    for worker_thread in workers:
+        worker_thread.join()
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--threads', type=int, default=64)
+    parser.add_argument('--rounds', type=int, default=20)
+    parser.add_argument('--message', default='how much does it cost')
+    parser.add_argument('--pipeline-ms', type=float, default=20.0)
+    parser.add_argument('--max-active', type=int, default=8)
+    parser.add_argument('--max-waiting', type=int, default=16)
+    args = parser.parse_args()
+    logging.getLogger().setLevel(logging.WARNING)
+
+    bot = AphatorChatbot(learned_cache=ResponseCache(max_size=0))
+    decide = bot._decide
+    calls = [0]
+
+    def counted(*decide_args):
+        calls[0] += 1
+        time.sleep(args.pipeline_ms / 1e3)
+        return decide(*decide_args)
+
+    bot._decide = counted
+    for label, inflight in (('without coalescing', NoCoalescing()), ('with coalescing', RequestCoalescer())):
+        bot.inflight = inflight
+        calls[0] = 0
+        elapsed = 0.0
+        for _ in range(args.rounds):
+            bot.invalidate_memo()
+            elapsed += storm(args.threads, lambda i: bot.get_response(args.message, session_id=f"storm-{i}"))
+        print(f"{label}: {calls[0]} pipeline runs for {args.threads * args.rounds} requests, "
+              f"{elapsed / args.rounds * 1e3:.1f} ms per round, {inflight.coalesced} coalesced")
+
+    admission = AdmissionQueue(max_active=args.max_active, max_waiting=args.max_waiting, wait_timeout=5.0)
+    retry_after = []
+
+    def admitted(i):
+        try:
+            with admission.admit():
+                bot.get_response(args.message, session_id=f"storm-{i}")
+        except Overloaded as e:
+            retry_after.append(e.retry_after)
+
+    bot.inflight = NoCoalescing()
+    for _ in range(args.rounds):
+        bot.invalidate_memo()
+        storm(args.threads, admitted)
+    print(f"admission (max_active={args.max_active}, max_waiting={args.max_waiting}): {admission.admitted} admitted, "
+          f"{admission.shed} shed, Retry-After {min(retry_after, default=0)}-{max(retry_after, default=0)}s")
+
+
+if __name__ == '__main__':
+    main()
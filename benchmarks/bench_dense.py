@@ -0,0 +1,138 @@
+"""Retrieval quality and speed of the tfidf, dense and hybrid retrieval modes.
+
+Run from the repository root:
+
+    python benchmarks/bench_dense.py [--variants 20] [--docs 20000 100000] [--queries 500]
+
+Quality: every corpus entry is paraphrased several ways (dropped words,
+typos, inflections, swapped word order) and each mode has to rank that
+entry first; off-topic questions should stay below the mode's threshold.
+Accuracy and false accepts are reported across a sweep of score thresholds.
+
+Speed: a synthetic corpus of --docs random texts built from the corpus
+vocabulary is searched with the exact dense scan and the IVF index, giving
+per-query latency, recall@1 of IVF against the exact scan and how often the
+document each query was sampled from comes first, across nprobe values.
+"""
+import argparse
+import logging
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+from chatbot import RETRIEVAL_THRESHOLDS, AphatorChatbot
+from embeddings import DenseIndex, HashedEmbedder
+from query_generator import OFF_TOPIC
+
+SUFFIXES = ['s', 'ing', 'ed', 'er', 'ment']
+
+EXTRA_OFF_TOPIC = [
+    'how tall is mount everest', 'what should i cook for dinner tonight', 'is it going to rain tomorrow',
+    'play some music', 'where can i buy cheap flights', 'what is the capital of australia',
+    'how do i fix my bike chain', 'who wrote hamlet', 'best running shoes for beginners'
+]
+
+THRESHOLDS = [0.1, 0.15, 0.2, 0.25, 0.3, 0.35, 0.4]
+
+
+def typo(word, rng):
+    if len(word) < 5:
+        return word
+    i = rng.randrange(1, len(word) - 2)
+    return word[:i] + word[i + 1] + word[i] + word[i + 2:]
+
+
+def paraphrase(text, rng):
+    """Perturb an entry text the way users rephrase it."""
+    words = text.lower().rstrip('?.!').split()
+    if len(words) > 3:
+        for _ in range(rng.randint(1, max(1, len(words) // 3))):
+            del words[rng.randrange(len(words))]
+    words = [typo(word, rng) if rng.random() < 0.2 else word for word in words]
+    words = [word + rng.choice(SUFFIXES) if rng.random() < 0.15 and len(word) > 3 else word for word in words]
+    if rng.random() < 0.5:
+        rng.shuffle(words)
+    return ' '.join(words[:12])
+
+
+def bench_quality(args, rng):
+    bots = {mode: AphatorChatbot(retrieval_mode=mode) for mode in ('tfidf', 'dense', 'hybrid')}
+    reference = bots['tfidf']
+    queries = []
+    for entry_id, text in zip(reference.ensure_index().ids, reference.corpus):
+        for _ in range(args.variants):
+            queries.append((paraphrase(text, rng), entry_id))
+    negatives = OFF_TOPIC + EXTRA_OFF_TOPIC
+
+    print(f"\n{len(queries)} paraphrased queries, {len(negatives)} off-topic questions")
+    print(f"{'mode':<8} {'top-1':>6} " + ' '.join(f"{'acc@' + str(t):>9} {'fa@' + str(t):>8}" for t in THRESHOLDS)
+          + f" {'us/query':>9}")
+    for mode, bot in bots.items():
+        texts = [bot._preprocess_text(query) for query, _ in queries]
+        start = time.perf_counter()
+        results = [matches[0] for matches in bot.ensure_index().search_batch(texts, k=1)]
+        per_query = (time.perf_counter() - start) / len(texts) * 1e6
+        negative_scores = [bot.search(question, k=1)[0].score for question in negatives]
+        correct = [match.entry_id == entry_id for match, (_, entry_id) in zip(results, queries)]
+        cells = []
+        for threshold in THRESHOLDS:
+            accepted = sum(ok and match.score > threshold for ok, match in zip(correct, results))
+            false_accepts = sum(score > threshold for score in negative_scores)
+            cells.append(f"{accepted / len(queries):>9.1%} {false_accepts / len(negatives):>8.1%}")
+        print(f"{mode:<8} {sum(correct) / len(queries):>6.1%} " + ' '.join(cells) + f" {per_query:>9.0f}")
+    print(f"current thresholds: {RETRIEVAL_THRESHOLDS}")
+
+
+def bench_speed(args, rng):
+    embedder = HashedEmbedder()
+    vocabulary = sorted({word for text in AphatorChatbot().corpus for word in text.lower().split() if len(word) > 3})
+    print(f"\n{'docs':>8} {'index':>10} {'build s':>8} {'us/query':>9} {'recall@1':>9} {'source@1':>9}")
+    for docs in args.docs:
+        corpus = [' '.join(rng.sample(vocabulary, 8)) for _ in range(docs)]
+        vectors = embedder.encode(corpus)
+        sources = rng.sample(range(docs), args.queries)
+        queries = embedder.encode([' '.join(rng.sample(corpus[i].split(), 5)) for i in sources])
+
+        def measure(index):
+            start = time.perf_counter()
+            results = [index.search(query)[0][0] for query in queries]
+            return results, (time.perf_counter() - start) / len(queries) * 1e6
+
+        exact_results, exact_us = measure(DenseIndex(vectors, kind='exact'))
+        source_hits = np.mean([a == b for a, b in zip(exact_results, sources)])
+        print(f"{docs:>8} {'exact':>10} {0.0:>8.1f} {exact_us:>9.0f} {1.0:>9.1%} {source_hits:>9.1%}")
+        start = time.perf_counter()
+        ivf = DenseIndex(vectors, kind='ivf')
+        build = time.perf_counter() - start
+        for nprobe in args.nprobe:
+            ivf.nprobe = nprobe
+            ivf_results, ivf_us = measure(ivf)
+            recall = np.mean([a == b for a, b in zip(exact_results, ivf_results)])
+            source_hits = np.mean([a == b for a, b in zip(ivf_results, sources)])
+            print(f"{docs:>8} {'ivf/' + str(nprobe):>10} {build:>8.1f} {ivf_us:>9.0f} {recall:>9.1%} {source_hits:>9.1%}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--variants', type=int, default=20, help='paraphrases per corpus entry')
+    parser.add_argument('--docs', type=int, nargs='+', default=[20000, 100000])
+    parser.add_argument('--queries', type=int, default=500)
+    parser.add_argument('--nprobe', type=int, nargs='+', default=[8, 16, 32])
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--skip-speed', action='store_true')
+    args = parser.parse_args()
+    logging.getLogger().setLevel(logging.WARNING)
+
+    rng = random.Random(args.seed)
+    bench_quality(args, rng)
+    if not args.skip_speed:
+        bench_speed(args, rng)
+
+
+if __name__ == '__main__':
+    main()
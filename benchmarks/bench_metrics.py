@@ -0,0 +1,64 @@
+"""Microbenchmark: cost of metrics instrumentation per pipeline stage and per response.
+
+Run from the repository root:
+
+    python benchmarks/bench_metrics.py [--laps 1000000] [--messages 20000]
+"""
+import argparse
+import logging
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from chatbot import AphatorChatbot
+from metrics import Metrics
+from response_cache import ResponseCache
+
+
+def per_response_us(bot, messages):
+    start = time.perf_counter()
+    for i, message in enumerate(messages):
+        bot.get_response(message, session_id=f"bench-{i % 50}")
+    return (time.perf_counter() - start) / len(messages) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--laps', type=int, default=1000000)
+    parser.add_argument('--messages', type=int, default=20000)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    # Debug logging would dwarf the differences being measured
+    logging.getLogger().setLevel(logging.WARNING)
+
+    # A request records ~8 stages; time laps plus the per-request flush in finish()
+    metrics = Metrics()
+    stages = ('memo', 'learned', 'matching', 'rules_before', 'retrieval', 'rules_after', 'finish', 'session_save')
+    requests = args.laps // len(stages)
+    start = time.perf_counter()
+    for _ in range(requests):
+        timer = metrics.timer()
+        for stage in stages:
+            timer.lap(stage)
+        timer.branch = 'rule'
+        timer.finish()
+    stage_ns = (time.perf_counter() - start) / (requests * len(stages)) * 1e9
+    print(f"StageTimer: {stage_ns:.0f} ns per stage, including the per-request flush")
+
+    rng = random.Random(args.seed)
+    plain = AphatorChatbot(learned_cache=ResponseCache(max_size=0))
+    messages = [rng.choice(plain.corpus) for _ in range(args.messages)]
+    instrumented = AphatorChatbot(learned_cache=ResponseCache(max_size=0), metrics=Metrics())
+    for bot in (plain, instrumented):
+        per_response_us(bot, messages[:1000])
+    without = per_response_us(plain, messages)
+    with_metrics = per_response_us(instrumented, messages)
+    print(f"get_response: {without:.1f} us without metrics, {with_metrics:.1f} us with metrics "
+          f"({with_metrics - without:+.1f} us)")
+
+
+if __name__ == '__main__':
+    main()
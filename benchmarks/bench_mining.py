@@ -0,0 +1,106 @@
+"""Offline transcript mining over a synthetic week of traffic.
+
+Run from the repository root:
+
+    python benchmarks/bench_mining.py [--exchanges 1000000] [--unmet-share 0.05]
+
+Generated queries (see query_generator.py) are mixed with questions about
+topics the knowledge base doesn't cover. Every distinct message is run
+through the response pipeline once for its branch, the exchanges are written
+with TranscriptLog, and TranscriptMiner then mines them. Reports throughput,
+peak memory of the mining step and whether the planted topics come out as
+the top candidates.
+"""
+import argparse
+import logging
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from chatbot import AphatorChatbot, ConversationContext
+from query_generator import generate_queries
+from transcript_mining import TranscriptMiner
+from transcripts import TranscriptLog, iter_transcripts
+
+UNMET_TOPICS = {
+    'refunds': ['what is your refund policy', 'can i get a refund', 'how do refunds work', 'refund for my subscription'],
+    'staking': ['do you offer staking services', 'can you build a staking platform', 'staking rewards setup'],
+    'careers': ['are you hiring', 'do you have any job openings', 'how can i apply for a job at aphator'],
+    'solana': ['do you develop on solana', 'can you write solana programs', 'solana smart contract development'],
+    'office': ['where is your office located', 'can i visit your office', 'what city are you based in']
+}
+
+PREFIXES = ['', '', 'hi, ', 'quick question: ', 'hey ', 'i was wondering ']
+
+
+def unmet_message(rng):
+    topic = rng.choice(list(UNMET_TOPICS))
+    text = rng.choice(PREFIXES) + rng.choice(UNMET_TOPICS[topic])
+    if rng.random() < 0.3:
+        text += '?'
+    return topic, text
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--exchanges', type=int, default=1000000)
+    parser.add_argument('--unmet-share', type=float, default=0.05)
+    parser.add_argument('--top', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    logging.getLogger().setLevel(logging.WARNING)
+
+    rng = random.Random(args.seed)
+    bot = AphatorChatbot()
+    generated = [query['message'] for query in generate_queries(5000, seed=args.seed)]
+    topics = {}
+    messages = []
+    for _ in range(args.exchanges):
+        if rng.random() < args.unmet_share:
+            topic, text = unmet_message(rng)
+            topics[text] = topic
+        else:
+            text = rng.choice(generated)
+        messages.append(text)
+    branches = {text: bot._decide(bot._parse(text), ConversationContext()).branch for text in set(messages)}
+
+    directory = tempfile.mkdtemp(prefix='aphator-mining-')
+    try:
+        log = TranscriptLog(directory, segment_bytes=16 * 2 ** 20, max_queued=args.exchanges).start()
+        week = 7 * 86400
+        start_ts = time.time() - week
+        for i, text in enumerate(messages):
+            log.append(f"session-{i % 20000}", text, '...', branches[text], timestamp=start_ts + i * week / args.exchanges)
+        log.stop()
+        del messages
+
+        tracemalloc.start()
+        start = time.perf_counter()
+        miner = TranscriptMiner(bot).add_exchanges(iter_transcripts(directory))
+        scanned = time.perf_counter() - start
+        report = miner.candidates(top=args.top, min_count=3)
+        elapsed = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+    print(f"{miner.scanned} exchanges: scan {scanned:.1f}s ({miner.scanned / scanned:,.0f}/s), total {elapsed:.1f}s, "
+          f"peak traced memory {peak / 2 ** 20:.1f} MB")
+    print(f"{miner.unanswered} unanswered, {miner.weak_matches} weak matches, {len(miner.counts)} distinct queries")
+    found = set()
+    for candidate in report['candidates']:
+        topic = next((topics[example] for example in candidate['examples'] if example in topics), '-')
+        found.add(topic)
+        print(f"{candidate['frequency']:>7} {candidate['distinct_queries']:>4} {topic:<8} {candidate['question']}")
+    print(f"planted topics in the top {args.top}: {len(found & set(UNMET_TOPICS))}/{len(UNMET_TOPICS)}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+"""Microbenchmark: sklearn cosine_similarity per query vs. the precomputed RetrievalEngine.
+
+Run from the repository root:
+
+    python benchmarks/bench_retrieval.py [--scale 1 10 100] [--queries 2000]
+
+The corpus is the chatbot's own corpus, repeated with light word shuffling to
+reach larger sizes, so vocabulary and sparsity stay realistic.
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.metrics.pairwise import cosine_similarity
+
+from chatbot import AphatorChatbot
+from retrieval import RetrievalEngine, top_k
+
+
+def build_corpus(base_corpus, scale, rng):
+    """Repeat the corpus scale times, shuffling words in every copy after the first."""
+    corpus = list(base_corpus)
+    for _ in range(scale - 1):
+        for text in base_corpus:
+            words = text.split()
+            rng.shuffle(words)
+            corpus.append(' '.join(words[:max(3, len(words) - rng.randint(0, 3))]))
+    return corpus
+
+
+def time_per_query(fn, queries):
+    start = time.perf_counter()
+    for query in queries:
+        fn(query)
+    return (time.perf_counter() - start) / len(queries) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--scale', type=int, nargs='+', default=[1, 10, 100])
+    parser.add_argument('--queries', type=int, default=2000)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    bot = AphatorChatbot()
+    query_texts = [rng.choice(bot.corpus) for _ in range(args.queries)]
+
+    print(f"{'docs':>8} {'cosine_similarity us/q':>24} {'RetrievalEngine us/q':>22} {'speedup':>8} {'parity':>7}")
+    for scale in args.scale:
+        corpus = build_corpus(bot.corpus, scale, rng)
+        vectorizer = TfidfVectorizer()
+        matrix = vectorizer.fit_transform(corpus)
+        engine = RetrievalEngine(matrix)
+        queries = [vectorizer.transform([bot._preprocess_text(text)]) for text in query_texts]
+
+        baseline = time_per_query(lambda q: cosine_similarity(q, matrix).flatten().argmax(), queries)
+        engine_time = time_per_query(lambda q: engine.search(q, k=1), queries)
+
+        parity = all(
+            engine.search(q, k=1)[0][0] == int(cosine_similarity(q, matrix).flatten().argmax())
+            for q in queries[:200]
+        )
+        print(f"{matrix.shape[0]:>8} {baseline:>24.1f} {engine_time:>22.1f} {baseline / engine_time:>7.1f}x {str(parity):>7}")
+
+    # Top-k is a partial sort over the score vector, not a full argsort
+    scores = np.random.default_rng(args.seed).random(100000)
+    for k in (1, 5, 20):
+        start = time.perf_counter()
+        for _ in range(200):
+            np.argsort(-scores, kind='stable')[:k]
+        full_sort = (time.perf_counter() - start) / 200 * 1e6
+        start = time.perf_counter()
+        for _ in range(200):
+            top_k(scores, k)
+        partial = (time.perf_counter() - start) / 200 * 1e6
+        print(f"top-{k:<3} over 100000 scores: argsort {full_sort:.0f} us, argpartition {partial:.0f} us")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+"""Throughput benchmark: threaded get_response with and without the process-pool scoring backend.
+
+Run from the repository root:
+
+    python benchmarks/bench_scoring_pool.py [--processes 1 2 4 8] [--threads 16] [--scale 200]
+
+Concurrent chats are simulated with a thread pool, as in a threaded gunicorn
+worker. The corpus is grown with shuffled copies of the chatbot's own
+entries (see bench_retrieval.build_corpus) so each message carries a
+realistic amount of matching and retrieval work. The memo and learned
+response caches are disabled so every message is analyzed from scratch.
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_retrieval import build_corpus
+from chatbot import AphatorChatbot
+from response_cache import ResponseCache
+from scoring_pool import ScoringPool
+
+
+def throughput(bot, messages, threads):
+    """Messages per second answered by `threads` concurrent sessions."""
+    def answer(i):
+        return bot.get_response(messages[i], session_id=f"bench-{i % threads}")
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        list(executor.map(answer, range(len(messages))))
+    return len(messages) / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--processes', type=int, nargs='+',
+                        default=sorted({1, 2, 4, os.cpu_count() or 1}))
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--messages', type=int, default=4000)
+    parser.add_argument('--scale', type=int, default=200, help='corpus copies to index')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    bot = AphatorChatbot(learned_cache=ResponseCache(max_size=0), response_memo=ResponseCache(max_size=0))
+    base_corpus = list(bot.corpus)
+    extra = build_corpus(base_corpus, args.scale, rng)[len(base_corpus):]
+    bot.update_knowledge([
+        {'kind': 'faq', 'id': f"bench:{i}", 'question': text, 'answer': text}
+        for i, text in enumerate(extra)
+    ])
+    messages = [' '.join(rng.sample(text.split(), min(6, len(text.split())))) for text in
+                (rng.choice(base_corpus) for _ in range(args.messages))]
+
+    print(f"{len(bot.corpus)} documents, {args.messages} messages, {args.threads} threads, {os.cpu_count()} cores")
+    baseline = throughput(bot, messages, args.threads)
+    print(f"{'in-process':>14} {baseline:>10.0f} msg/s")
+
+    for processes in args.processes:
+        pool = ScoringPool(bot, processes=processes)
+        pool.warm_up()
+        bot.scoring_pool = pool
+        pooled = throughput(bot, messages, args.threads)
+        start = time.perf_counter()
+        bot.get_responses(messages, session_ids=[f"batch-{i % args.threads}" for i in range(len(messages))])
+        batched = len(messages) / (time.perf_counter() - start)
+        bot.scoring_pool = None
+        pool.close()
+        print(f"{processes:>4} processes {pooled:>10.0f} msg/s ({pooled / baseline:.2f}x)"
+              f"   get_responses {batched:>8.0f} msg/s")
+
+
+if __name__ == '__main__':
+    main()
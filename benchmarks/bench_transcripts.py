@@ -0,0 +1,80 @@
+"""Microbenchmark: cost of transcript logging per response and transcript read throughput.
+
+Run from the repository root:
+
+    python benchmarks/bench_transcripts.py [--messages 20000] [--exchanges 500000]
+"""
+import argparse
+import logging
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from chatbot import AphatorChatbot
+from response_cache import ResponseCache
+from transcripts import TranscriptLog, iter_transcripts, segment_paths
+
+
+def per_response_us(bot, messages):
+    start = time.perf_counter()
+    for i, message in enumerate(messages):
+        bot.get_response(message, session_id=f"bench-{i % 50}")
+    return (time.perf_counter() - start) / len(messages) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--messages', type=int, default=20000)
+    parser.add_argument('--exchanges', type=int, default=500000)
+    parser.add_argument('--segment-mb', type=float, default=8)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    logging.getLogger().setLevel(logging.WARNING)
+
+    directory = tempfile.mkdtemp(prefix='aphator-transcripts-')
+    try:
+        rng = random.Random(args.seed)
+        plain = AphatorChatbot(learned_cache=ResponseCache(max_size=0))
+        messages = [rng.choice(plain.corpus) for _ in range(args.messages)]
+        log = TranscriptLog(os.path.join(directory, 'responses')).start()
+        logged = AphatorChatbot(learned_cache=ResponseCache(max_size=0), transcripts=log)
+        for bot in (plain, logged):
+            per_response_us(bot, messages[:1000])
+        without = per_response_us(plain, messages)
+        with_log = per_response_us(logged, messages)
+        log.stop()
+        print(f"get_response: {without:.1f} us without transcripts, {with_log:.1f} us with transcripts "
+              f"({with_log - without:+.1f} us), {log.dropped} dropped")
+
+        # Fill a log at a steady rate the writer keeps up with, then scan it
+        bulk_directory = os.path.join(directory, 'bulk')
+        log = TranscriptLog(bulk_directory, segment_bytes=int(args.segment_mb * 2 ** 20),
+                            max_queued=args.exchanges).start()
+        start = time.perf_counter()
+        for i in range(args.exchanges):
+            log.append(f"session-{i % 5000}", messages[i % len(messages)], plain.responses[i % len(plain.responses)],
+                       'tfidf', timestamp=1.7e9 + i)
+        append_ns = (time.perf_counter() - start) / args.exchanges * 1e9
+        start = time.perf_counter()
+        log.stop()
+        drain = time.perf_counter() - start
+        paths = segment_paths(bulk_directory)
+        size = sum(path.stat().st_size for path in paths)
+        print(f"append: {append_ns:.0f} ns per exchange; writer drained the rest in {drain:.2f}s; "
+              f"{log.written} written, {log.dropped} dropped, {len(paths)} segments, {size / log.written:.0f} bytes/exchange")
+
+        start = time.perf_counter()
+        scanned = sum(1 for _ in iter_transcripts(bulk_directory))
+        elapsed = time.perf_counter() - start
+        print(f"read: {scanned} exchanges in {elapsed:.2f}s ({scanned / elapsed:,.0f} exchanges/s)")
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
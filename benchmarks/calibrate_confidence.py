@@ -0,0 +1,140 @@
+"""Fit the retrieval confidence calibration (CONFIDENCE_CALIBRATION in knowledge_base.py).
+
+Run from the repository root:
+
+    python benchmarks/calibrate_confidence.py [--modes tfidf dense hybrid] [--variants 10] [--queries 5000]
+
+Labeled queries come from paraphrases of every knowledge entry (as in
+bench_dense.py), answered by that entry, and from query_generator.py, whose
+faq, service and product queries name their target entry while off-topic
+questions and small talk have none. Every top-k candidate is an example,
+labeled by whether it is the query's target. A logistic regression on score
+and margin is fitted on half of the queries and checked on the other half:
+the script prints the reliability of the fitted confidence, then the answer
+rate and precision of the chosen match at the current score thresholds and a
+sweep of confidence thresholds, a sweep of document chunk thresholds
+(DOCUMENT_THRESHOLDS in chatbot.py), and finally the weights to paste.
+"""
+import argparse
+import logging
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+from bench_dense import EXTRA_OFF_TOPIC, paraphrase
+from chatbot import DOCUMENT_FALLBACK_K, AphatorChatbot
+from knowledge_base import calibrated_confidence, candidate_margins
+from query_generator import OFF_TOPIC, SMALL_TALK, generate_queries
+
+CONFIDENCE_THRESHOLDS = [0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9]
+DOCUMENT_THRESHOLDS = [0.2, 0.25, 0.3, 0.35, 0.4, 0.45, 0.5]
+
+
+def labeled_queries(bot, args, rng):
+    """(message, target entry id or None) pairs."""
+    queries = []
+    for entry_id, text in zip(bot.ensure_index().ids, bot.corpus):
+        for _ in range(args.variants):
+            queries.append((paraphrase(text, rng), entry_id))
+    for query in generate_queries(args.queries, seed=args.seed):
+        if 'target' in query:
+            queries.append((query['message'], query['target']))
+        elif query['kind'] in ('off_topic', 'small_talk'):
+            queries.append((query['message'], None))
+    queries += [(question, None) for question in OFF_TOPIC + EXTRA_OFF_TOPIC + SMALL_TALK]
+    rng.shuffle(queries)
+    return queries
+
+
+def fit_logistic(features, labels, l2=1e-3, iterations=100):
+    """Weights then bias of an L2-regularized logistic regression, fitted by Newton's method."""
+    design = np.column_stack([features, np.ones(len(features))])
+    weights = np.zeros(design.shape[1])
+    for _ in range(iterations):
+        probabilities = 1.0 / (1.0 + np.exp(-design @ weights))
+        gradient = design.T @ (probabilities - labels) + l2 * weights
+        hessian = (design * (probabilities * (1.0 - probabilities))[:, None]).T @ design + l2 * np.eye(len(weights))
+        step = np.linalg.solve(hessian, gradient)
+        weights -= step
+        if np.abs(step).max() < 1e-9:
+            break
+    return tuple(float(weight) for weight in weights)
+
+
+def calibrate(bot, queries, args):
+    index = bot.ensure_index()
+    results = index.search_batch([bot._preprocess_text(message) for message, _ in queries], k=DOCUMENT_FALLBACK_K)
+    scores = np.zeros((len(queries), DOCUMENT_FALLBACK_K))
+    labels = np.zeros((len(queries), DOCUMENT_FALLBACK_K))
+    for row, (matches, (_, target)) in enumerate(zip(results, queries)):
+        scores[row, :len(matches)] = [match.score for match in matches]
+        labels[row, :len(matches)] = [match.entry_id == target for match in matches]
+    train = np.arange(len(queries)) % 2 == 0
+    features = np.stack([scores, candidate_margins(scores)], axis=-1)
+    weights = fit_logistic(features[train].reshape(-1, 2), labels[train].ravel())
+    confidence = calibrated_confidence(scores, weights)
+
+    test_confidence, test_labels = confidence[~train].ravel(), labels[~train].ravel()
+    log_loss = -np.mean(test_labels * np.log(test_confidence + 1e-12) + (1 - test_labels) * np.log(1 - test_confidence + 1e-12))
+    brier = np.mean((test_confidence - test_labels) ** 2)
+    print(f"\n{bot.retrieval_mode}: {len(queries)} queries, held-out log loss {log_loss:.3f}, Brier {brier:.3f}")
+    print(f"{'confidence':>12} {'candidates':>11} {'predicted':>10} {'observed':>9}")
+    bins = np.minimum((test_confidence * 10).astype(int), 9)
+    for b in range(10):
+        selected = bins == b
+        if selected.any():
+            print(f"{b / 10:>6.1f}-{(b + 1) / 10:<5.1f} {selected.sum():>11} {test_confidence[selected].mean():>10.3f} "
+                  f"{test_labels[selected].mean():>9.3f}")
+
+    # The chatbot answers with the curated-first choice among the candidates
+    chosen = []
+    for row in np.flatnonzero(~train):
+        match = bot._prefer_curated(index, results[row])
+        column = results[row].index(match)
+        chosen.append((match, confidence[row, column], bool(labels[row, column]), queries[row][1] is None))
+    print(f"{'answer when':>16} {'answered':>9} {'precision':>10} {'off-topic answered':>19}")
+    rules = [("score > thresholds", lambda match, conf: match.score > bot._answer_threshold(match))]
+    rules += [(f"confidence > {t}", lambda match, conf, t=t: conf > t) for t in CONFIDENCE_THRESHOLDS]
+    negatives = sum(negative for *_, negative in chosen)
+    for label, answers in rules:
+        answered = [(correct, negative) for match, conf, correct, negative in chosen if answers(match, conf)]
+        precision = sum(correct for correct, _ in answered) / max(1, len(answered))
+        false_accepts = sum(negative for _, negative in answered) / max(1, negatives)
+        print(f"{label:>16} {len(answered) / len(chosen):>9.1%} {precision:>10.1%} {false_accepts:>19.1%}")
+
+    # Document chunks clearing the base threshold, for choosing their own (DOCUMENT_THRESHOLDS)
+    documents = [(match.score, correct, negative) for match, _, correct, negative in chosen
+                 if index.kinds[match.position] == 'document' and match.score > bot.retrieval_threshold]
+    print(f"{'document score >':>16} {'answered':>9} {'correct':>10} {'off-topic answered':>19}")
+    for t in DOCUMENT_THRESHOLDS:
+        answered = [(correct, negative) for score, correct, negative in documents if score > t]
+        print(f"{t:>16} {len(answered):>9} {sum(correct for correct, _ in answered):>10} "
+              f"{sum(negative for _, negative in answered):>19}")
+    return weights
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--modes', nargs='+', default=['tfidf', 'dense', 'hybrid'])
+    parser.add_argument('--variants', type=int, default=10, help='paraphrases per corpus entry')
+    parser.add_argument('--queries', type=int, default=5000, help='generated queries')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    logging.getLogger().setLevel(logging.WARNING)
+
+    fitted = {}
+    for mode in args.modes:
+        bot = AphatorChatbot(retrieval_mode=mode)
+        fitted[mode] = calibrate(bot, labeled_queries(bot, args, random.Random(args.seed)), args)
+    print("\nCONFIDENCE_CALIBRATION = {")
+    print(',\n'.join(f"    '{mode}': ({', '.join(f'{weight:.3f}' for weight in weights)})"
+                     for mode, weights in fitted.items()))
+    print("}")
+
+
+if __name__ == '__main__':
+    main()
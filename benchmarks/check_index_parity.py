@@ -0,0 +1,130 @@
+"""Parity check: RetrievalEngine must pick the same best match as cosine_similarity argmax.
+
+Documents whose scores tie within floating-point tolerance are interchangeable,
+since the two paths sum the same products in a different order.
+
+Run from the repository root; exits non-zero on any mismatch:
+
+    python benchmarks/check_index_parity.py [--scale 1 20 200] [--queries 3000]
+
+Queries are the corpus entries themselves, word subsets of them, mixtures of
+two entries and random vocabulary draws, against the chatbot's corpus scaled up
+with shuffled copies. Top-k lists are compared with a full sort of the cosine
+scores, allowing for exact ties.
+
+Off-topic questions and small talk from the benchmark query set are then
+checked in every retrieval mode: none may be answered from a document chunk
+that merely shares a word with them (DOCUMENT_THRESHOLDS in chatbot.py).
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.metrics.pairwise import cosine_similarity
+
+from bench_dense import EXTRA_OFF_TOPIC
+from chatbot import DOCUMENT_FALLBACK_K, DOCUMENT_THRESHOLDS, AphatorChatbot
+from query_generator import OFF_TOPIC, SMALL_TALK
+from retrieval import RetrievalEngine
+from bench_retrieval import build_corpus
+
+TOLERANCE = 1e-9
+
+
+def make_queries(corpus, vocabulary, count, rng):
+    queries = []
+    for _ in range(count):
+        kind = rng.randrange(4)
+        words = rng.choice(corpus).split()
+        if kind == 0:
+            queries.append(' '.join(words))
+        elif kind == 1:
+            queries.append(' '.join(rng.sample(words, max(1, len(words) // 2))))
+        elif kind == 2:
+            queries.append(' '.join(words + rng.choice(corpus).split()[:3]))
+        else:
+            queries.append(' '.join(rng.sample(vocabulary, min(len(vocabulary), rng.randint(1, 6)))))
+    return queries
+
+
+def same_ranking(expected, actual, scores):
+    """Rankings agree if they only differ in the order of exactly tied documents."""
+    if len(expected) != len(actual):
+        return False
+    for (_, expected_score), (doc, score) in zip(expected, actual):
+        if abs(expected_score - score) > TOLERANCE or abs(scores[doc] - score) > TOLERANCE:
+            return False
+    return True
+
+
+def check_off_topic(bot):
+    """Number of off-topic questions the chatbot would answer with a document chunk."""
+    index = bot.ensure_index()
+    questions = OFF_TOPIC + EXTRA_OFF_TOPIC + SMALL_TALK
+    answered = 0
+    for question, matches in zip(questions, index.search_batch(
+            [bot._preprocess_text(question) for question in questions], k=DOCUMENT_FALLBACK_K)):
+        match = bot._prefer_curated(index, matches)
+        if index.kinds[match.position] == 'document' and match.score > bot._answer_threshold(match):
+            answered += 1
+            print(f"  {bot.retrieval_mode}: off-topic {question!r} answered by {match.entry_id} ({match.score:.4f})")
+    print(f"{bot.retrieval_mode:>7}: {len(questions)} off-topic questions, {answered} answered from documents")
+    return answered
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--scale', type=int, nargs='+', default=[1, 20, 200])
+    parser.add_argument('--queries', type=int, default=3000)
+    parser.add_argument('--k', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    bot = AphatorChatbot()
+    failures = 0
+
+    for scale in args.scale:
+        corpus = build_corpus(bot.corpus, scale, rng)
+        vectorizer = TfidfVectorizer()
+        matrix = vectorizer.fit_transform(corpus)
+        engine = RetrievalEngine(matrix)
+        texts = make_queries(corpus, sorted(vectorizer.vocabulary_), args.queries, rng)
+        queries = vectorizer.transform([bot._preprocess_text(text) for text in texts])
+
+        mismatches = 0
+        start = time.perf_counter()
+        engine_results = engine.search_batch(queries, k=args.k)
+        engine_time = time.perf_counter() - start
+
+        for row in range(queries.shape[0]):
+            scores = cosine_similarity(queries[row], matrix).flatten()
+            best = int(scores.argmax())
+            engine_best, engine_score = engine_results[row][0]
+            expected = [(int(doc), float(scores[doc])) for doc in scores.argsort(kind='stable')[::-1][:args.k]]
+            # A different index is only a mismatch if it isn't tied with the argmax
+            if scores[engine_best] < scores[best] - TOLERANCE or abs(engine_score - scores[best]) > TOLERANCE:
+                mismatches += 1
+                print(f"  best-match mismatch for {texts[row]!r}: argmax {best} ({scores[best]:.6f}), "
+                      f"engine {engine_best} ({engine_score:.6f})")
+            elif not same_ranking(expected, engine_results[row], scores):
+                mismatches += 1
+                print(f"  top-{args.k} mismatch for {texts[row]!r}")
+
+        failures += mismatches
+        print(f"{matrix.shape[0]:>7} docs: {queries.shape[0]} queries, {mismatches} mismatches; "
+              f"matrix {engine_time / queries.shape[0] * 1e6:.0f} us/q")
+
+    for mode in DOCUMENT_THRESHOLDS:
+        failures += check_off_topic(bot if mode == bot.retrieval_mode else AphatorChatbot(retrieval_mode=mode))
+
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+"""Cold-start profile: import time per module and time to first answer for each startup mode.
+
+Run from the repository root:
+
+    python benchmarks/import_time.py [--modes eager lazy background] [--top 15] [--output startup.json]
+
+Each mode runs in a fresh interpreter. `python -X importtime` attributes the
+import of app.py to modules, which are aggregated by top-level package. The
+child then reports the time to import app, to answer a greeting and to
+become ready for retrieval.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+from collections import defaultdict
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CHILD = r"""
+import json, logging, sys, time
+start = time.perf_counter()
+import app
+imported = time.perf_counter()
+logging.getLogger().setLevel(logging.WARNING)
+app.chatbot.get_response('hello', session_id='cold-start')
+answered = time.perf_counter()
+numpy_loaded = 'numpy' in sys.modules
+app.chatbot.ensure_index()
+ready = time.perf_counter()
+print(json.dumps({
+    'import_app_ms': (imported - start) * 1e3,
+    'first_answer_ms': (answered - start) * 1e3,
+    'retrieval_ready_ms': (ready - start) * 1e3,
+    'numpy_loaded_at_first_answer': numpy_loaded,
+}))
+"""
+
+
+def parse_importtime(stderr):
+    """Per-module (self us, cumulative us) from `python -X importtime` output."""
+    modules = {}
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        modules[name.strip()] = (int(self_us), int(cumulative_us))
+    return modules
+
+
+def profile(mode):
+    """Run one cold start; returns (timings, per-module import times, self time per top-level package)."""
+    env = dict(os.environ, STARTUP_MODE=mode, KB_WATCH_INTERVAL='0', METRICS_ENABLED='0')
+    process = subprocess.run([sys.executable, '-X', 'importtime', '-c', CHILD], cwd=ROOT, env=env,
+                             capture_output=True, text=True, timeout=300)
+    if process.returncode != 0:
+        raise RuntimeError(f"startup mode {mode} failed:\n{process.stderr[-2000:]}")
+    timings = json.loads(process.stdout.strip().splitlines()[-1])
+    modules = parse_importtime(process.stderr)
+    packages = defaultdict(int)
+    for name, (self_us, _) in modules.items():
+        packages[name.split('.')[0]] += self_us
+    return timings, modules, dict(packages)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--modes', nargs='+', default=['eager', 'lazy', 'background'])
+    parser.add_argument('--top', type=int, default=15)
+    parser.add_argument('--output', help='write the results as JSON to this file')
+    args = parser.parse_args()
+
+    report = {}
+    for mode in args.modes:
+        timings, modules, packages = profile(mode)
+        report[mode] = {'timings': timings, 'packages_ms': {name: us / 1e3 for name, us in packages.items()}}
+        print(f"\n== STARTUP_MODE={mode}")
+        print(f"import app {timings['import_app_ms']:.0f} ms, first answer {timings['first_answer_ms']:.0f} ms, "
+              f"retrieval ready {timings['retrieval_ready_ms']:.0f} ms, "
+              f"numpy loaded for first answer: {timings['numpy_loaded_at_first_answer']}")
+        print(f"{'package':<28} {'self ms':>9}")
+        for name, us in sorted(packages.items(), key=lambda item: -item[1])[:args.top]:
+            print(f"{name:<28} {us / 1e3:>9.1f}")
+        local = {name: cumulative for name, (_, cumulative) in modules.items()
+                 if os.path.exists(os.path.join(ROOT, f"{name}.py"))}
+        print(f"{'repo module':<28} {'cumulative ms':>14}")
+        for name, us in sorted(local.items(), key=lambda item: -item[1]):
+            print(f"{name:<28} {us / 1e3:>14.1f}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=4)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,155 @@
+"""Synthetic query generator built from company_data.json and INTENT_CATEGORIES.
+
+Run from the repository root to write a replayable query corpus:
+
+    python benchmarks/query_generator.py [--count 5000] [--seed 0] [--output queries.jsonl]
+
+Each line is {"message": ..., "kind": ...}, where kind names the template
+family the message came from (faq, service, product, intent:<name>,
+follow_up, small_talk, off_topic); faq, service and product queries also
+carry "target", the id of the knowledge entry they were generated from.
+The same seed always yields the same corpus, so results can be compared
+between commits.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from chatbot import INTENT_CATEGORIES, SENTIMENT_WORDS
+
+DATA_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'company_data.json')
+
+# How often each template family is drawn
+KIND_WEIGHTS = {
+    'faq': 25,
+    'service': 15,
+    'product': 15,
+    'intent': 25,
+    'follow_up': 8,
+    'small_talk': 5,
+    'off_topic': 7
+}
+
+SERVICE_TEMPLATES = [
+    "Tell me about your {name}",
+    "How much does {name} cost?",
+    "Do you offer {name}?",
+    "I need help with {lower}",
+    "What is included in {name}?",
+    "{lower} pricing",
+]
+
+PRODUCT_TEMPLATES = [
+    "What is {name}?",
+    "How much is {name}",
+    "Tell me more about {name}",
+    "Is {name} better than the alternatives?",
+    "{lower}",
+]
+
+INTENT_TEMPLATES = [
+    "{pattern}",
+    "{pattern} {topic}",
+    "{pattern} your {topic} services",
+    "I wanted to ask, {pattern} {topic}?",
+]
+
+TOPICS = ['blockchain', 'crypto trading', 'nft', 'web3', 'security', 'apps', 'smart contracts', 'software']
+
+FOLLOW_UPS = ['yes please', 'yes', 'sure, tell me more', 'ok', 'yeah that sounds good', 'no thanks']
+
+SMALL_TALK = ['how are you', 'who are you', 'are you a bot?', 'what is your name', 'lol', 'cool']
+
+OFF_TOPIC = [
+    'what is the weather today', 'recommend a good pizza place', 'who won the football game',
+    'translate hello to french', 'what time is it in tokyo', 'tell me a joke about cats'
+]
+
+
+def load_company_data(path=DATA_FILE):
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+def paraphrase(text, rng):
+    """Lightly perturb a question: drop a word, change case or punctuation."""
+    words = text.rstrip('?.!').split()
+    if len(words) > 4 and rng.random() < 0.4:
+        del words[rng.randrange(len(words))]
+    text = ' '.join(words)
+    if rng.random() < 0.3:
+        text = text.lower()
+    if rng.random() < 0.5:
+        text += '?'
+    return text
+
+
+def generate_query(company_data, rng):
+    """Return one {"message", "kind"} query, with "target" when it asks about a knowledge entry."""
+    kind = rng.choices(list(KIND_WEIGHTS), weights=list(KIND_WEIGHTS.values()))[0]
+    # Targets use the same ids as AphatorChatbot's knowledge entries
+    if kind == 'faq' and company_data.get('faqs'):
+        item = rng.choice(company_data['faqs'])
+        return {'message': paraphrase(item['question'], rng), 'kind': 'faq',
+                'target': item.get('id') or f"faq:{item['question']}"}
+    if kind == 'service' and company_data.get('services'):
+        service = rng.choice(company_data['services'])
+        name = service['name']
+        message = rng.choice(SERVICE_TEMPLATES).format(name=name, lower=name.lower())
+        return {'message': message, 'kind': 'service', 'target': service.get('id') or f"service:{name}"}
+    if kind == 'product' and company_data.get('products'):
+        product = rng.choice(company_data['products'])
+        name = product['name']
+        message = rng.choice(PRODUCT_TEMPLATES).format(name=name, lower=name.lower())
+        return {'message': message, 'kind': 'product', 'target': product.get('id') or f"product:{name}"}
+    if kind == 'follow_up':
+        return {'message': rng.choice(FOLLOW_UPS), 'kind': 'follow_up'}
+    if kind == 'small_talk':
+        return {'message': rng.choice(SMALL_TALK), 'kind': 'small_talk'}
+    if kind == 'off_topic':
+        return {'message': rng.choice(OFF_TOPIC), 'kind': 'off_topic'}
+
+    intent = rng.choice(list(INTENT_CATEGORIES))
+    message = rng.choice(INTENT_TEMPLATES).format(pattern=rng.choice(INTENT_CATEGORIES[intent]), topic=rng.choice(TOPICS))
+    if rng.random() < 0.15:
+        sentiment = rng.choice(list(SENTIMENT_WORDS))
+        message += f", {rng.choice(SENTIMENT_WORDS[sentiment])}"
+    return {'message': message, 'kind': f"intent:{intent}"}
+
+
+def generate_queries(count, seed=0, company_data=None):
+    """Deterministic list of count synthetic queries."""
+    rng = random.Random(seed)
+    company_data = company_data or load_company_data()
+    return [generate_query(company_data, rng) for _ in range(count)]
+
+
+def load_queries(path):
+    """Read a query corpus written by this script (or any JSONL with a "message" field)."""
+    with open(path, 'r') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--count', type=int, default=5000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='-', help="JSONL file to write, or - for stdout")
+    args = parser.parse_args()
+
+    queries = generate_queries(args.count, args.seed)
+    out = sys.stdout if args.output == '-' else open(args.output, 'w')
+    try:
+        for query in queries:
+            out.write(json.dumps(query) + '\n')
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,335 @@
+"""Benchmark and load-test suite for the chatbot engine, with JSON results for regression tracking.
+
+Run from the repository root:
+
+    python benchmarks/run_suite.py [--output results.json] [--compare baseline.json]
+                                   [--sections construction latency memory http]
+
+Sections:
+  construction  AphatorChatbot() construction time, from the data files and from an index artifact
+  latency       get_response p50/p95/p99 per answer branch, replaying a query corpus twice
+                (first pass, then a repeat pass with warm caches)
+  memory        growth of learned_responses and ConversationContext over one long session,
+                and of the session store over many short ones (tracemalloc)
+  http          end-to-end /api/chat throughput and latency with a local threaded load generator,
+                against an in-process server or --url
+
+Queries come from query_generator.py (--queries-file to replay a saved corpus).
+With --compare, timings that got more than --threshold slower are reported and
+the exit status is 1.
+"""
+import argparse
+import gc
+import http.client
+import json
+import logging
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from urllib.parse import urlparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+from chatbot import AphatorChatbot
+from metrics import Metrics
+from query_generator import generate_queries, load_queries
+
+SECTIONS = ('construction', 'latency', 'memory', 'http')
+
+
+class RecordingMetrics(Metrics):
+    """Metrics that also keep every request's (branch, nanoseconds) for exact percentiles."""
+    def __init__(self):
+        super().__init__()
+        self.samples = []
+
+    def record(self, started, laps, finished, branch):
+        super().record(started, laps, finished, branch)
+        self.samples.append((branch, finished - started))
+
+
+def percentiles_us(samples_ns):
+    values = np.array(samples_ns, dtype=np.float64) / 1e3
+    return {
+        'count': int(len(values)),
+        'mean_us': float(values.mean()),
+        'p50_us': float(np.percentile(values, 50)),
+        'p95_us': float(np.percentile(values, 95)),
+        'p99_us': float(np.percentile(values, 99)),
+        'max_us': float(values.max())
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), timeout=10).stdout.strip() or None
+    except Exception:
+        return None
+
+
+def bench_construction(args):
+    """Median and best construction time, from the data files and from a prebuilt index artifact."""
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        artifact = os.path.join(tmp, 'index.aphidx')
+        AphatorChatbot().build_index_artifact(artifact)
+        for name, kwargs in (('data_files', {}), ('index_artifact', {'index_artifact': artifact})):
+            timings = []
+            for _ in range(args.construct_runs):
+                gc.collect()
+                start = time.perf_counter()
+                AphatorChatbot(**kwargs)
+                timings.append((time.perf_counter() - start) * 1e3)
+            results[name] = {'median_ms': statistics.median(timings), 'min_ms': min(timings), 'runs': len(timings)}
+    return results
+
+
+def replay(bot, queries, turns_per_session, prefix):
+    for i, query in enumerate(queries):
+        bot.get_response(query['message'], session_id=f"{prefix}-{i // turns_per_session}")
+
+
+def bench_latency(args, queries):
+    """Per-branch latency of get_response over a first pass and a repeat pass of the corpus."""
+    metrics = RecordingMetrics()
+    bot = AphatorChatbot(metrics=metrics)
+    results = {}
+    for phase in ('first_pass', 'repeat_pass'):
+        metrics.samples = []
+        start = time.perf_counter()
+        replay(bot, queries, args.turns_per_session, phase)
+        elapsed = time.perf_counter() - start
+        by_branch = {}
+        for branch, duration in metrics.samples:
+            by_branch.setdefault(branch, []).append(duration)
+        results[phase] = {
+            'messages_per_second': len(queries) / elapsed,
+            'overall': percentiles_us([duration for _, duration in metrics.samples]),
+            'branches': {branch: percentiles_us(samples) for branch, samples in sorted(by_branch.items())}
+        }
+    results['caches'] = {'learned': bot.learned_responses.stats(), 'response_memo': bot.response_memo.stats()}
+    return results
+
+
+def bench_memory(args, queries):
+    """Traced memory growth over one long session and over many short sessions."""
+    tracemalloc.start()
+    try:
+        bot = AphatorChatbot()
+        gc.collect()
+        baseline = tracemalloc.get_traced_memory()[0]
+        long_session = []
+        checkpoint = max(1, args.long_session_turns // 5)
+        for turn in range(1, args.long_session_turns + 1):
+            bot.get_response(queries[turn % len(queries)]['message'], session_id='long-session')
+            if turn % checkpoint == 0:
+                context = bot.sessions.get('long-session')
+                long_session.append({
+                    'turns': turn,
+                    'traced_kb': (tracemalloc.get_traced_memory()[0] - baseline) / 1024,
+                    'learned_responses': len(bot.learned_responses),
+                    'history_length': len(context.history),
+                    'user_interests': len(context.user_interests),
+                    'context_json_bytes': len(json.dumps(context.to_dict()))
+                })
+
+        bot = AphatorChatbot()
+        gc.collect()
+        baseline = tracemalloc.get_traced_memory()[0]
+        for session in range(args.sessions):
+            for turn in range(args.turns_per_session):
+                query = queries[(session * args.turns_per_session + turn) % len(queries)]
+                bot.get_response(query['message'], session_id=f"session-{session}")
+        gc.collect()
+        many_sessions = {
+            'sessions': args.sessions,
+            'turns_per_session': args.turns_per_session,
+            'sessions_held': len(bot.sessions),
+            'traced_kb': (tracemalloc.get_traced_memory()[0] - baseline) / 1024,
+            'learned_responses': len(bot.learned_responses)
+        }
+        many_sessions['traced_kb_per_session'] = many_sessions['traced_kb'] / max(1, many_sessions['sessions_held'])
+    finally:
+        tracemalloc.stop()
+    return {'long_session': long_session, 'many_sessions': many_sessions}
+
+
+def start_local_server():
+    """Serve app.py from a threaded development server on a free port; returns (base url, server)."""
+    os.environ.setdefault('KB_WATCH_INTERVAL', '0')
+    from werkzeug.serving import make_server
+    import app as chat_app
+    logging.getLogger().setLevel(logging.WARNING)
+    server = make_server('127.0.0.1', 0, chat_app.app, threaded=True)
+    threading.Thread(target=server.serve_forever, name='bench-server', daemon=True).start()
+    return f"http://127.0.0.1:{server.server_port}", server
+
+
+def bench_http(args, queries):
+    """Throughput and latency of POST /api/chat from concurrent clients, each with its own session cookie."""
+    server = None
+    base_url = args.url
+    if not base_url:
+        base_url, server = start_local_server()
+    target = urlparse(base_url)
+    per_client = max(1, args.http_requests // args.http_clients)
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+
+    def client(index):
+        cookie = None
+        local_latencies = []
+        local_errors = 0
+        for i in range(per_client):
+            query = queries[(index * per_client + i) % len(queries)]
+            body = json.dumps({'message': query['message']})
+            headers = {'Content-Type': 'application/json'}
+            if cookie:
+                headers['Cookie'] = cookie
+            start = time.perf_counter_ns()
+            try:
+                connection = http.client.HTTPConnection(target.hostname, target.port, timeout=30)
+                connection.request('POST', f"{target.path.rstrip('/')}/api/chat", body=body, headers=headers)
+                response = connection.getresponse()
+                response.read()
+                set_cookie = response.getheader('Set-Cookie')
+                if set_cookie:
+                    cookie = set_cookie.split(';', 1)[0]
+                connection.close()
+                if response.status != 200:
+                    local_errors += 1
+            except OSError:
+                local_errors += 1
+            local_latencies.append(time.perf_counter_ns() - start)
+        with lock:
+            latencies.extend(local_latencies)
+            errors.append(local_errors)
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(args.http_clients)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    if server is not None:
+        server.shutdown()
+    return {
+        'target': 'local' if args.url is None else args.url,
+        'clients': args.http_clients,
+        'requests': len(latencies),
+        'errors': sum(errors),
+        'requests_per_second': len(latencies) / elapsed,
+        'latency': percentiles_us(latencies)
+    }
+
+
+# Lower is better for timings, higher for throughput; (path, higher_is_better)
+COMPARED_METRICS = [
+    (('construction', 'data_files', 'median_ms'), False),
+    (('construction', 'index_artifact', 'median_ms'), False),
+    (('latency', 'first_pass', 'overall', 'p50_us'), False),
+    (('latency', 'first_pass', 'overall', 'p99_us'), False),
+    (('latency', 'repeat_pass', 'overall', 'p50_us'), False),
+    (('latency', 'repeat_pass', 'overall', 'p99_us'), False),
+    (('latency', 'first_pass', 'messages_per_second'), True),
+    (('http', 'requests_per_second'), True),
+    (('http', 'latency', 'p99_us'), False),
+]
+
+
+def lookup(results, path):
+    for key in path:
+        if not isinstance(results, dict) or key not in results:
+            return None
+        results = results[key]
+    return results
+
+
+def compare(baseline, current, threshold):
+    """Print the change of each compared metric; returns the paths that regressed beyond threshold."""
+    regressions = []
+    print(f"\nCompared with {baseline.get('meta', {}).get('commit') or 'baseline'}:")
+    for path, higher_is_better in COMPARED_METRICS:
+        old, new = lookup(baseline.get('results', {}), path), lookup(current['results'], path)
+        if not old or new is None:
+            continue
+        change = (new - old) / old
+        regressed = -change > threshold if higher_is_better else change > threshold
+        if regressed:
+            regressions.append('.'.join(path))
+        print(f"  {'.'.join(path):<45} {old:>12.1f} -> {new:>12.1f} ({change:+.1%}){'  REGRESSION' if regressed else ''}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sections', nargs='+', choices=SECTIONS, default=list(SECTIONS))
+    parser.add_argument('--queries', type=int, default=3000, help='synthetic queries to generate')
+    parser.add_argument('--queries-file', help='replay a JSONL query corpus instead')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--construct-runs', type=int, default=5)
+    parser.add_argument('--turns-per-session', type=int, default=8)
+    parser.add_argument('--long-session-turns', type=int, default=5000)
+    parser.add_argument('--sessions', type=int, default=1000)
+    parser.add_argument('--http-clients', type=int, default=8)
+    parser.add_argument('--http-requests', type=int, default=2000)
+    parser.add_argument('--url', help='base URL of a running server for the http section')
+    parser.add_argument('--output', help='write results as JSON to this file')
+    parser.add_argument('--compare', help='baseline results JSON to compare against')
+    parser.add_argument('--threshold', type=float, default=0.10, help='relative slowdown counted as a regression')
+    args = parser.parse_args()
+    # Debug logging would dominate every timing
+    logging.getLogger().setLevel(logging.WARNING)
+
+    queries = load_queries(args.queries_file) if args.queries_file else generate_queries(args.queries, args.seed)
+    sections = {
+        'construction': lambda: bench_construction(args),
+        'latency': lambda: bench_latency(args, queries),
+        'memory': lambda: bench_memory(args, queries),
+        'http': lambda: bench_http(args, queries)
+    }
+    results = {}
+    for name in args.sections:
+        start = time.perf_counter()
+        results[name] = sections[name]()
+        print(f"{name}: done in {time.perf_counter() - start:.1f}s", file=sys.stderr)
+
+    report = {
+        'meta': {
+            'commit': git_commit(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'queries': len(queries),
+            'args': vars(args)
+        },
+        'results': results
+    }
+    text = json.dumps(report, indent=4)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            regressions = compare(json.load(f), report, args.threshold)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,49 +1,27 @@
 import json
-import re
 import random
 import logging
 import os
+import fcntl
 import time
+import threading
 from pathlib import Path
-from collections import defaultdict, Counter
-import numpy as np
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
+from collections import defaultdict, Counter, deque
+from session_store import SessionStore
+from response_cache import ResponseCache
+from matcher import KeywordMatcher
+from rules import RuleEngine, RuleFacts
+from document_ingest import DocumentSource, source_of_entry
+from admission import RequestCoalescer
+from response_tags import ResponseTagger, tag_signature
+# The tokenizers and STOPWORDS used to live here and are still importable from this module
+from text_processing import STOPWORDS, ParsedMessage, simple_tokenize
+# knowledge_base and index_artifact pull in numpy and scipy, so they are
+# imported where the index is built, which startup='lazy' defers
 
-# Setup logging
-logging.basicConfig(level=logging.DEBUG)
+# Logging is configured by the application (see structured_logging.py)
 logger = logging.getLogger(__name__)
 
-# Simple text processing functions that don't rely on NLTK
-def simple_tokenize(text):
-    """Simple tokenization without relying on NLTK"""
-    # Convert to lowercase
-    text = text.lower()
-    # Remove punctuation and split on spaces
-    text = re.sub(r'[^\w\s]', ' ', text)
-    # Split on whitespace
-    return text.split()
-
-# Common English stopwords
-STOPWORDS = {
-    'i', 'me', 'my', 'myself', 'we', 'our', 'ours', 'ourselves', 'you', "you're", "you've", "you'll", 
-    "you'd", 'your', 'yours', 'yourself', 'yourselves', 'he', 'him', 'his', 'himself', 'she', "she's", 
-    'her', 'hers', 'herself', 'it', "it's", 'its', 'itself', 'they', 'them', 'their', 'theirs', 
-    'themselves', 'what', 'which', 'who', 'whom', 'this', 'that', "that'll", 'these', 'those', 'am', 
-    'is', 'are', 'was', 'were', 'be', 'been', 'being', 'have', 'has', 'had', 'having', 'do', 'does', 
-    'did', 'doing', 'a', 'an', 'the', 'and', 'but', 'if', 'or', 'because', 'as', 'until', 'while', 
-    'of', 'at', 'by', 'for', 'with', 'about', 'against', 'between', 'into', 'through', 'during', 
-    'before', 'after', 'above', 'below', 'to', 'from', 'up', 'down', 'in', 'out', 'on', 'off', 'over', 
-    'under', 'again', 'further', 'then', 'once', 'here', 'there', 'when', 'where', 'why', 'how', 'all', 
-    'any', 'both', 'each', 'few', 'more', 'most', 'other', 'some', 'such', 'no', 'nor', 'not', 'only', 
-    'own', 'same', 'so', 'than', 'too', 'very', 's', 't', 'can', 'will', 'just', 'don', "don't", 
-    'should', "should've", 'now', 'd', 'll', 'm', 'o', 're', 've', 'y', 'ain', 'aren', "aren't", 
-    'couldn', "couldn't", 'didn', "didn't", 'doesn', "doesn't", 'hadn', "hadn't", 'hasn', "hasn't", 
-    'haven', "haven't", 'isn', "isn't", 'ma', 'mightn', "mightn't", 'mustn', "mustn't", 'needn', "needn't", 
-    'shan', "shan't", 'shouldn', "shouldn't", 'wasn', "wasn't", 'weren', "weren't", 'won', "won't", 
-    'wouldn', "wouldn't"
-}
-
 # User intent categories
 INTENT_CATEGORIES = {
     'greeting': ['hello', 'hi', 'hey', 'greetings', 'good morning', 'good afternoon', 'good evening'],
@@ -58,32 +36,118 @@ INTENT_CATEGORIES = {
     'clarification': ['what do you mean', 'confused', 'don\'t understand', 'clarify', 'elaborate']
 }
 
+# Words used for simple sentiment analysis
+SENTIMENT_WORDS = {
+    'positive': ['good', 'great', 'excellent', 'amazing', 'wonderful', 'best', 'love', 'like', 'helpful', 'useful'],
+    'negative': ['bad', 'poor', 'terrible', 'awful', 'worst', 'hate', 'dislike', 'useless', 'disappointing', 'expensive']
+}
+
+# Session id used when callers don't supply one
+DEFAULT_SESSION_ID = 'default'
+
+# Where `python index_artifact.py` writes the prebuilt index by default
+DEFAULT_INDEX_ARTIFACT = Path(os.path.dirname(os.path.abspath(__file__))) / 'index.aphidx'
+
+# When the retrieval index is built: during construction, on first use, or by a warm-up thread
+STARTUP_MODES = ('eager', 'lazy', 'background')
+
+# Best-match score above which retrieval answers, per retrieval mode; dense cosines of
+# hashed n-grams run higher than TF-IDF ones for unrelated texts
+RETRIEVAL_THRESHOLDS = {'tfidf': 0.2, 'dense': 0.35, 'hybrid': 0.3}
+
+# Higher bar for answering with a document chunk: chunks are long and share stray words
+# ("real-time") with off-topic questions. Calibrated with benchmarks/calibrate_confidence.py
+DOCUMENT_THRESHOLDS = {'tfidf': 0.3, 'dense': 0.4, 'hybrid': 0.35}
+
+# company_data.json list holding each kind of entry the admin API can edit
+COMPANY_DATA_LISTS = {'faq': 'faqs', 'service': 'services', 'product': 'products'}
+
+# Matches fetched per message so a curated entry ranked below document chunks is still found
+DOCUMENT_FALLBACK_K = 5
+
+# Retrieval candidates listed in a debug trace
+TRACE_CANDIDATES = 10
+
+# Branches whose answers are learned for the message's key terms; learning fallbacks and
+# generic intent replies would replay them for every later message with the same terms.
+# Knowledge-base answers are labelled with the retrieval mode that found them
+LEARNED_BRANCHES = frozenset({'tfidf', 'dense', 'hybrid', 'rule'})
+
+class ResponseDecision:
+    """The deterministic outcome of the response pipeline for one message.
+
+    Random parts (which greeting or fallback, whether to add an engagement
+    prompt) are applied after lookup, so decisions can be memoized. ids are
+    the response ids of the responses, which is what session history keeps,
+    and prompt_id the engagement prompt a learned response was stored with.
+    """
+    __slots__ = ('branch', 'responses', 'ids', 'key_terms', 'engage', 'topic', 'context_dependent', 'prompt_id')
+
+    def __init__(self, branch, responses, ids, key_terms, engage=False, topic=None, context_dependent=False,
+                 prompt_id=None):
+        self.branch = branch
+        self.responses = responses
+        self.ids = ids
+        self.key_terms = key_terms
+        self.engage = engage
+        self.topic = topic
+        self.context_dependent = context_dependent
+        self.prompt_id = prompt_id
+
+# Memo marker for messages whose decision also depends on the session context
+CONTEXT_DEPENDENT = ResponseDecision('context', (), (), [], context_dependent=True)
+
+class MessageAnalysis:
+    """Session-independent facts about a message, which a scoring worker process can compute.
+
+    rules_mtime and index_snapshot (the index's snapshot_id) identify the rule
+    table and index it was computed with, so stale results from a worker can
+    be detected.
+    """
+    __slots__ = ('key_terms', 'matches', 'intent', 'sentiment', 'retrieval', 'rules_mtime', 'index_snapshot')
+
+    def __init__(self, key_terms, matches, intent, sentiment, retrieval, rules_mtime, index_snapshot):
+        self.key_terms = key_terms
+        self.matches = matches
+        self.intent = intent
+        self.sentiment = sentiment
+        self.retrieval = retrieval
+        self.rules_mtime = rules_mtime
+        self.index_snapshot = index_snapshot
+
 class ConversationContext:
     """Stores conversation history and context for more coherent responses"""
-    def __init__(self, max_history=5):
-        self.history = []
+    # One instance lives per visitor session, so keep idle ones small
+    __slots__ = ('history', 'max_history', 'max_interests', 'user_interests', 'session_start', 'topic_focus')
+
+    def __init__(self, max_history=5, max_interests=20):
+        self.history = deque(maxlen=max_history)
         self.max_history = max_history
+        self.max_interests = max_interests
         self.user_interests = Counter()
         self.session_start = time.time()
         self.topic_focus = None
         
-    def add_exchange(self, user_input, bot_response):
+    def add_exchange(self, user_input, response_id, prompt_id=None, interests=None):
         """Add a conversation exchange to history"""
+        # Answers are kept as response ids (see AphatorChatbot._resolve), not as their
+        # full text; the deque drops the oldest exchange once max_history is reached
         self.history.append({
             'user_input': user_input,
-            'bot_response': bot_response,
+            'response_id': response_id,
+            'prompt_id': prompt_id,
             'timestamp': time.time()
         })
         
-        # Keep history within max size
-        if len(self.history) > self.max_history:
-            self.history.pop(0)
-        
         # Update user interests based on keywords in input
-        tokens = simple_tokenize(user_input)
-        interests = [token for token in tokens if len(token) > 3 and token not in STOPWORDS]
+        if interests is None:
+            interests = ParsedMessage(user_input).key_terms
         self.user_interests.update(interests)
         
+        # Keep only the strongest interests so long sessions stay compact
+        if len(self.user_interests) > self.max_interests:
+            self.user_interests = Counter(dict(self.user_interests.most_common(self.max_interests)))
+        
     def get_dominant_topic(self):
         """Get the most common topic from recent conversation"""
         if not self.user_interests:
@@ -97,7 +161,7 @@ class ConversationContext:
             
         history_to_check = self.history
         if within_exchanges is not None:
-            history_to_check = self.history[-within_exchanges:]
+            history_to_check = list(self.history)[-within_exchanges:]
             
         for exchange in history_to_check:
             if term.lower() in exchange['user_input'].lower():
@@ -108,19 +172,104 @@ class ConversationContext:
         """Get the duration of the current conversation in seconds"""
         return time.time() - self.session_start
 
+    def to_dict(self):
+        """Serialize the context for a shared session backend"""
+        return {
+            'history': list(self.history),
+            'max_history': self.max_history,
+            'max_interests': self.max_interests,
+            'user_interests': dict(self.user_interests),
+            'session_start': self.session_start,
+            'topic_focus': self.topic_focus
+        }
+
+    @classmethod
+    def from_dict(cls, state):
+        """Rebuild a context serialized with to_dict"""
+        context = cls(max_history=state.get('max_history', 5), max_interests=state.get('max_interests', 20))
+        context.history.extend(state.get('history', []))
+        context.user_interests.update(state.get('user_interests', {}))
+        context.session_start = state.get('session_start', context.session_start)
+        context.topic_focus = state.get('topic_focus')
+        return context
+
 class AphatorChatbot:
-    def __init__(self):
-        """Initialize the Aphator Tech Chatbot with company data."""
+    def __init__(self, session_store=None, learned_cache=None, learn_base_responses=True, rules_path=None,
+                 response_memo=None, retrieval_index='auto', index_artifact=None, scoring_pool=None,
+                 metrics=None, startup='eager', data_file=None, text_data_file=None, retrieval_mode='tfidf',
+                 embedder=None, transcripts=None, builtin_entries=True, tenant=None):
+        """Initialize the Aphator Tech Chatbot with company data.
+
+        data_file, text_data_file and rules_path default to the files next to
+        this module; a tenant registry points them at each tenant's directory
+        and turns off builtin_entries, Aphator's hand-written application
+        development answers, so a tenant is only answered from its own data.
+        text_data_file may also be a folder of .txt and .md documentation;
+        its files are chunked by section into the knowledge base.
+        retrieval_mode is 'tfidf', 'dense' (embedder, HashedEmbedder by
+        default) or 'hybrid'. transcripts is an optional TranscriptLog that
+        every exchange is appended to, under the tenant name if one is given.
+        """
+        if startup not in STARTUP_MODES:
+            raise ValueError(f"Unknown startup mode: {startup}")
         # Use the predefined stopwords instead of NLTK
         self.stop_words = STOPWORDS
-        self.company_data = self.load_company_data()
-        self.vectorizer = TfidfVectorizer()
+        module_dir = Path(os.path.dirname(os.path.abspath(__file__)))
+        self.data_file = Path(data_file) if data_file is not None else module_dir / 'company_data.json'
+        self.text_data_file = Path(text_data_file) if text_data_file is not None else module_dir / 'data' / 'companydata.txt'
+        self.builtin_entries = builtin_entries
+        # Prebuilt index to memory-map instead of parsing and indexing the data files
+        self.index_artifact = index_artifact
+        # Optional ScoringPool that analyzes messages in worker processes
+        self.scoring_pool = scoring_pool
+        # Optional Metrics for per-stage timings; None skips all instrumentation
+        self.metrics = metrics
+        # Optional TranscriptLog; session history is trimmed, the transcript keeps every exchange
+        self.transcripts = transcripts
+        self.tenant = tenant
+        self.company_data = None
+        # Text documentation, indexed as chunks and re-indexed per file when its mtime changes
+        self.documents = DocumentSource(self.text_data_file)
+        self.has_text_data = self.text_data_file.exists()
+        # Published KnowledgeIndex; None until built when startup is deferred
+        self.index = None
+        self.knowledge = None
+        self.index_ready = threading.Event()
+        self._index_lock = threading.Lock()
+        # Serializes knowledge updates so snapshots are published and swapped in version order
+        self._knowledge_lock = threading.RLock()
+        self._warm_up_thread = None
         
-        # Initialize conversation context for tracking user intent and history
-        self.context = ConversationContext(max_history=10)
+        # Declarative response rules, hot-reloaded when rules.json changes
+        if rules_path is None:
+            rules_path = module_dir / 'rules.json'
+        self.rules = RuleEngine(rules_path)
+        # 'matrix' (sparse dot product); 'auto' is the same engine
+        self.retrieval_index = retrieval_index
+        if retrieval_mode not in RETRIEVAL_THRESHOLDS:
+            raise ValueError(f"Unknown retrieval mode: {retrieval_mode}")
+        self.retrieval_mode = retrieval_mode
+        self.embedder = embedder
+        self.retrieval_threshold = RETRIEVAL_THRESHOLDS[retrieval_mode]
+        self.document_threshold = DOCUMENT_THRESHOLDS[retrieval_mode]
         
-        # Track learning from conversations
-        self.learned_responses = {}
+        # Conversation contexts for tracking user intent and history, one per session
+        if session_store is None:
+            session_store = SessionStore(
+                context_factory=lambda: ConversationContext(max_history=10),
+                context_loader=ConversationContext.from_dict
+            )
+        self.sessions = session_store
+        
+        # Track learning from conversations in a bounded, evicting cache
+        self.learned_responses = learned_cache if learned_cache is not None else ResponseCache(max_size=5000)
+        # Store responses without the random engagement prompt so it isn't frozen in
+        self.learn_base_responses = learn_base_responses
+        
+        # Memoized decisions keyed on the normalized message
+        self.response_memo = response_memo if response_memo is not None else ResponseCache(max_size=10000)
+        # Decisions being computed right now, so a burst of the same question runs the pipeline once
+        self.inflight = RequestCoalescer()
         self.topic_keywords = defaultdict(list)
         
         # Populate keyword-to-topic mapping for better understanding
@@ -139,8 +288,18 @@ class AphatorChatbot:
             "Is there a particular challenge with {topic} that you're looking to solve?"
         ]
         
-        # Prepare vectorizer with existing data
-        self.prepare_vectors()
+        # Compile every pattern table into one automaton, matched once per message
+        self.matcher = self._build_matcher()
+        self.topic_labels = [f"topic:{topic}" for topic in self.topic_keywords]
+        # Tags what each response mentions once, when it is indexed or loaded
+        self.tagger = self._new_tagger()
+        self._applied_tag_signature = self._tag_signature()
+        
+        # Prepare vectorizer with existing data, now or deferred until it is needed
+        if startup == 'eager':
+            self.prepare_vectors()
+        elif startup == 'background':
+            self.start_warm_up()
         
         # Greetings and fallbacks
         self.greetings = [
@@ -160,29 +319,23 @@ class AphatorChatbot:
             "I don't have information on that specific topic. Would you like to know about our crypto solutions or tech services instead?",
             "I'm still learning and don't have an answer for that yet. Can I tell you about Aphator Tech's expertise in blockchain or development services?"
         ]
+        self._tag_fixed_responses()
         
         logger.info("Aphator Chatbot initialized successfully")
     
     def load_company_data(self):
         """Load company data from JSON file."""
         try:
-            data_file = Path(os.path.dirname(os.path.abspath(__file__))) / 'company_data.json'
+            data_file = self.data_file
             
-            # Load text data from data/companydata.txt if it exists
-            text_data_file = Path(os.path.dirname(os.path.abspath(__file__))) / 'data' / 'companydata.txt'
-            if text_data_file.exists():
-                logger.info(f"Found additional company data at {text_data_file}")
-                # We'll use this data later for enhanced responses
-                with open(text_data_file, 'r') as tf:
-                    self.text_company_data = tf.read()
-            else:
-                self.text_company_data = None
+            # The text data itself is streamed into chunks by DocumentSource, not kept here
+            self.has_text_data = self.text_data_file.exists()
                 
             # Load primary JSON data
             with open(data_file, 'r') as f:
                 return json.load(f)
         except Exception as e:
-            logger.error(f"Error loading company data: {str(e)}")
+            logger.error("Error loading company data: %s", e)
             return {
                 "company_info": {
                     "name": "Aphator Tech",
@@ -195,74 +348,396 @@ class AphatorChatbot:
             }
     
     def prepare_vectors(self):
-        """Prepare TF-IDF vectors from company data."""
-        # Extract all content for vectorization
-        self.corpus = []
-        self.responses = []
+        """Prepare TF-IDF vectors from the prebuilt index artifact or from company data."""
+        from index_artifact import load_artifact, source_hash
+        
+        self.knowledge = None
+        index = None
+        if self.index_artifact:
+            index, metadata = load_artifact(self.index_artifact, source_hash(self.data_files), self.retrieval_index,
+                                            self.retrieval_mode, self.embedder, tags_from_json=self.tagger.from_json)
+        if index is not None and metadata.get('builtin_entries', True) != self.builtin_entries:
+            logger.warning("Index artifact %s was built %s the builtin entries; rebuilding from the data files",
+                           self.index_artifact, 'with' if metadata.get('builtin_entries', True) else 'without')
+            index = None
+        if index is not None:
+            # The mutable knowledge base is only built if the index is later updated
+            self.has_text_data = metadata.get('has_text_data', False)
+            self.documents.manifest = dict(metadata.get('documents', {}))
+            if metadata.get('tag_signature') != self._tag_signature():
+                logger.warning("Index artifact %s was tagged with other keyword tables; retagging its entries",
+                               self.index_artifact)
+                index.tags = [self.tagger(response) for response in index.responses]
+            self.index = index
+        else:
+            # Entries are indexed incrementally, so later data changes don't refit everything
+            self.company_data = self.load_company_data()
+            self.knowledge = self._new_knowledge_base()
+            self.knowledge.sync(self._knowledge_entries(self.company_data))
+            self.documents.sync(self.knowledge)
+            self.index = self.knowledge.publish()
+        self.index_ready.set()
+        
+        if len(self.index):
+            logger.info("Prepared vectors for %s items", len(self.index))
+        else:
+            logger.warning("No content available for vectorization")
+    
+    def ensure_index(self):
+        """Return the published index, building it now if startup deferred it."""
+        index = self.index
+        if index is None:
+            with self._index_lock:
+                if self.index is None:
+                    self.prepare_vectors()
+            index = self.index
+        return index
+    
+    def start_warm_up(self):
+        """Build the index in a background thread; until then messages get rules-only answers."""
+        def warm_up():
+            try:
+                self.ensure_index()
+            except Exception as e:
+                logger.error("Error warming up the index: %s", e)
+            finally:
+                # Without a running warm-up, the next message that needs retrieval builds the index itself
+                self._warm_up_thread = None
+        
+        self._warm_up_thread = threading.Thread(target=warm_up, name='index-warm-up', daemon=True)
+        self._warm_up_thread.start()
+        return self._warm_up_thread
+    
+    @property
+    def warming_up(self):
+        """True while a background warm-up is building the index."""
+        return self._warm_up_thread is not None
+    
+    def _serving_index(self):
+        """Index for answering messages, or None while a background warm-up is still building it."""
+        index = self.index
+        if index is None and self._warm_up_thread is None:
+            index = self.ensure_index()
+        return index
+    
+    @property
+    def data_files(self):
+        """Files the knowledge entries are built from, in index artifact hash order."""
+        return [self.data_file] + list(self.documents.files().values())
+    
+    def build_index_artifact(self, path):
+        """Write the current index to a memory-mappable artifact for fast worker startup."""
+        from index_artifact import source_hash, write_artifact
+        write_artifact(path, self.ensure_index(), source_hash(self.data_files),
+                       metadata={'has_text_data': self.has_text_data, 'documents': self.documents.manifest,
+                                 'builtin_entries': self.builtin_entries,
+                                 'tag_signature': self._tag_signature()})
+    
+    def _new_knowledge_base(self):
+        from knowledge_base import KnowledgeBase
+        # Entries are tagged with their response's topic as they are indexed, not per request;
+        # the lambda looks up self.tagger on each call because a rules reload replaces it
+        return KnowledgeBase(retrieval_index=self.retrieval_index, retrieval_mode=self.retrieval_mode,
+                             embedder=self.embedder, tagger=lambda text: self.tagger(text))
+    
+    def _ensure_knowledge(self):
+        """Rebuild the mutable knowledge base from the mapped index before its first update.
+
+        Callers hold _knowledge_lock.
+        """
+        index = self.ensure_index()
+        if self.knowledge is not None:
+            return
+        knowledge = self._new_knowledge_base()
+        for entry_id, kind, text, response in zip(index.ids, index.kinds, index.corpus, index.responses):
+            # Document chunks keep their per-file source so a changed file only replaces its own chunks;
+            # everything else, admin edits included, comes from company_data.json
+            knowledge.upsert(entry_id, kind, text, response, source=source_of_entry(entry_id) or 'file')
+        knowledge.version = index.version
+        self.knowledge = knowledge
+    
+    @property
+    def corpus(self):
+        return self.ensure_index().corpus
+    
+    @property
+    def responses(self):
+        return self.ensure_index().responses
+    
+    @property
+    def tfidf_matrix(self):
+        index = self.ensure_index()
+        return index.matrix if len(index) else None
+    
+    @property
+    def retrieval(self):
+        return self.ensure_index().retrieval
+    
+    def memory_usage(self):
+        """Estimated bytes held by the index and knowledge base, plus session and cache sizes.
+
+        heap_bytes is what the process allocated; mapped_bytes is index
+        artifact data backed by the page cache, which the OS can reclaim.
+        """
+        heap_bytes = mapped_bytes = 0
+        if self.index is not None:
+            heap_bytes, mapped_bytes = self.index.memory_usage()
+        if self.knowledge is not None:
+            heap_bytes += self.knowledge.memory_usage()
+        return {
+            'heap_bytes': heap_bytes,
+            'mapped_bytes': mapped_bytes,
+            'entries': len(self.index) if self.index is not None else 0,
+            'sessions': len(self.sessions),
+            'learned_responses': len(self.learned_responses),
+            'memo_entries': len(self.response_memo)
+        }
+    
+    def _knowledge_entries(self, company_data):
+        """Build (id, kind, text, response) corpus entries from company data."""
+        entries = []
         
         # Add FAQ data
-        for item in self.company_data.get("faqs", []):
-            self.corpus.append(item.get("question", ""))
-            self.responses.append(item.get("answer", ""))
+        for item in company_data.get("faqs", []):
+            entries.append(self._faq_entry(item))
         
         # Add service descriptions
-        for service in self.company_data.get("services", []):
-            self.corpus.append(service.get("name", "") + " " + service.get("description", ""))
-            self.responses.append(self._generate_service_response(service))
+        for service in company_data.get("services", []):
+            entries.append(self._service_entry(service))
         
         # Add product information
-        for product in self.company_data.get("products", []):
-            self.corpus.append(product.get("name", "") + " " + product.get("description", ""))
-            self.responses.append(self._generate_product_response(product))
+        for product in company_data.get("products", []):
+            entries.append(self._product_entry(product))
         
-        # Add company info
-        company_info = self.company_data.get("company_info", {})
-        company_text = f"{company_info.get('name', '')} {company_info.get('description', '')} {' '.join(company_info.get('expertise', []))}"
-        self.corpus.append("Tell me about Aphator Tech")
-        self.responses.append(self._generate_company_response(company_info))
+        # Add company info; without a company name only the builtin Aphator description could be given
+        company_info = company_data.get("company_info", {})
+        if self.builtin_entries or company_info.get("name"):
+            name = company_info.get("name", "Aphator Tech")
+            entries.append(("company:about", "company", f"Tell me about {name}", self._generate_company_response(company_info)))
+            entries.append(("company:what", "company", f"What does {name} do", self._generate_company_response(company_info)))
         
-        self.corpus.append("What does Aphator Tech do")
-        self.responses.append(self._generate_company_response(company_info))
+        if not self.builtin_entries:
+            return entries
         
         # Add application development specific responses
-        self.corpus.append("Can you help me launch an application")
-        self.responses.append("Yes, Aphator Tech specializes in developing and launching applications for various platforms. " +
-                             "Our software development team can help you create mobile apps (iOS/Android), web applications, " +
-                             "and enterprise software solutions. Pricing starts at $10,000 for full applications, with " +
-                             "the exact cost depending on complexity and requirements. Would you like to discuss your specific app idea?")
-        
-        self.corpus.append("How much does app development cost")
-        self.responses.append("At Aphator Tech, application development costs start at $10,000 for basic applications. " +
-                             "The final price depends on factors like complexity, features, platform requirements, and timeline. " +
-                             "We offer both native app development for iOS/Android and cross-platform solutions. " +
-                             "We'd be happy to provide a detailed quote after understanding your specific requirements.")
-        
-        self.corpus.append("What kind of applications can you build")
-        self.responses.append("Aphator Tech can develop a wide range of applications including: mobile apps for iOS and Android, " +
-                             "web applications, enterprise software, blockchain dApps, cryptocurrency trading platforms, " +
-                             "NFT marketplaces, fintech solutions, and custom software for specific business needs. " +
-                             "Our development team is skilled in multiple technologies and frameworks to create reliable, " +
-                             "scalable, and secure applications tailored to your requirements.")
-                             
-        # If we have content, create the vectors
-        if self.corpus:
-            self.tfidf_matrix = self.vectorizer.fit_transform(self.corpus)
-            logger.info(f"Prepared vectors for {len(self.corpus)} items")
-        else:
-            logger.warning("No content available for vectorization")
-            self.tfidf_matrix = None
+        entries.append(("builtin:launch_application", "builtin", "Can you help me launch an application",
+                        "Yes, Aphator Tech specializes in developing and launching applications for various platforms. " +
+                        "Our software development team can help you create mobile apps (iOS/Android), web applications, " +
+                        "and enterprise software solutions. Pricing starts at $10,000 for full applications, with " +
+                        "the exact cost depending on complexity and requirements. Would you like to discuss your specific app idea?"))
+        
+        entries.append(("builtin:app_development_cost", "builtin", "How much does app development cost",
+                        "At Aphator Tech, application development costs start at $10,000 for basic applications. " +
+                        "The final price depends on factors like complexity, features, platform requirements, and timeline. " +
+                        "We offer both native app development for iOS/Android and cross-platform solutions. " +
+                        "We'd be happy to provide a detailed quote after understanding your specific requirements."))
+        
+        entries.append(("builtin:application_types", "builtin", "What kind of applications can you build",
+                        "Aphator Tech can develop a wide range of applications including: mobile apps for iOS and Android, " +
+                        "web applications, enterprise software, blockchain dApps, cryptocurrency trading platforms, " +
+                        "NFT marketplaces, fintech solutions, and custom software for specific business needs. " +
+                        "Our development team is skilled in multiple technologies and frameworks to create reliable, " +
+                        "scalable, and secure applications tailored to your requirements."))
+        return entries
+    
+    def _faq_entry(self, item):
+        question = item.get("question", "")
+        return (item.get("id") or f"faq:{question}", "faq", question, item.get("answer", ""))
+    
+    def _service_entry(self, service):
+        return (service.get("id") or f"service:{service.get('name', '')}", "service",
+                service.get("name", "") + " " + service.get("description", ""), self._generate_service_response(service))
+    
+    def _product_entry(self, product):
+        return (product.get("id") or f"product:{product.get('name', '')}", "product",
+                product.get("name", "") + " " + product.get("description", ""), self._generate_product_response(product))
+    
+    def reload_company_data(self):
+        """Re-read company_data.json and apply only the entries that changed."""
+        company_data = self.load_company_data()
+        with self._knowledge_lock:
+            self._ensure_knowledge()
+            changes = self.knowledge.sync(self._knowledge_entries(company_data))
+            self.company_data = company_data
+            if any(changes.values()):
+                self._publish_knowledge()
+        logger.info("Reloaded company data: %s", changes)
+        return changes
+    
+    def reload_documents(self):
+        """Re-chunk documentation files whose mtime changed and publish if any chunk changed."""
+        # A deferred index isn't built yet and will read the current files when it is
+        if self.index is None or not self.documents.changed():
+            return {'files': 0, 'added': 0, 'updated': 0, 'removed': 0}
+        with self._knowledge_lock:
+            self._ensure_knowledge()
+            changes = self.documents.sync(self.knowledge)
+            self.has_text_data = self.text_data_file.exists()
+            if changes['added'] or changes['updated'] or changes['removed']:
+                self._publish_knowledge()
+        if changes['files']:
+            logger.info("Reloaded documents: %s", changes)
+        return changes
+    
+    def update_knowledge(self, upserts=(), removals=()):
+        """Add, update or remove FAQ, service and product entries in company_data.json and publish them.
+
+        upserts are dicts with a kind of faq (question, answer), service or
+        product (name, description, pricing), like the company_data.json
+        lists; removals are the entry ids of such items. The edit is written
+        to the data file, so it survives restarts and other workers apply it
+        through their file watchers; this worker reloads it at once. Returns
+        the number of entries added, updated or removed.
+        """
+        builders = {'faq': self._faq_entry, 'service': self._service_entry, 'product': self._product_entry}
+        for item in upserts:
+            if item.get('kind') not in builders:
+                raise ValueError(f"Unknown entry kind: {item.get('kind')}")
+        with self._knowledge_lock, open(f"{self.data_file}.lock", 'w') as lock:
+            # Workers sharing the data file take turns reading, editing and replacing it
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            with open(self.data_file, 'r') as f:
+                company_data = json.load(f)
+            for item in upserts:
+                kind = item['kind']
+                entry_id = builders[kind](item)[0]
+                fields = {key: value for key, value in item.items() if key != 'kind'}
+                items = company_data.setdefault(COMPANY_DATA_LISTS[kind], [])
+                positions = [i for i, existing in enumerate(items) if builders[kind](existing)[0] == entry_id]
+                if positions:
+                    items[positions[0]] = fields
+                else:
+                    items.append(fields)
+            for entry_id in removals:
+                for kind, key in COMPANY_DATA_LISTS.items():
+                    if key in company_data:
+                        company_data[key] = [existing for existing in company_data[key]
+                                             if builders[kind](existing)[0] != entry_id]
+            tmp_path = f"{self.data_file}.{os.getpid()}.tmp"
+            with open(tmp_path, 'w') as f:
+                json.dump(company_data, f, indent=4, ensure_ascii=False)
+                f.write('\n')
+            os.replace(tmp_path, self.data_file)
+            changes = self.reload_company_data()
+        return sum(changes.values())
+    
+    def _publish_knowledge(self):
+        """Swap in a new index snapshot; in-flight requests keep the one they started with.
+
+        Callers hold _knowledge_lock, so a slower publish can't replace a newer snapshot.
+        """
+        self.index = self.knowledge.publish()
+        self.invalidate_memo()
+        if self.scoring_pool is not None:
+            # Workers mapped the previous snapshot and would otherwise search it forever
+            self.scoring_pool.refresh(self)
+    
+    def _build_matcher(self):
+        """Build the keyword automaton from the intent, topic, rule keyword and sentiment tables."""
+        matcher = KeywordMatcher()
+        for intent, patterns in INTENT_CATEGORIES.items():
+            matcher.add_group(f"intent:{intent}", patterns)
+        for topic, keywords in self.topic_keywords.items():
+            matcher.add_group(f"topic:{topic}", keywords)
+        for group, patterns in self.rules.keyword_groups.items():
+            matcher.add_group(f"keyword:{group}", patterns)
+        for sentiment, words in SENTIMENT_WORDS.items():
+            matcher.add_group(f"sentiment:{sentiment}", words)
+        return matcher.build()
+    
+    def _new_tagger(self):
+        return ResponseTagger(self.matcher, self.topic_labels, [f"intent:{intent}" for intent in INTENT_CATEGORIES])
+    
+    def _tag_signature(self):
+        """Digest of every keyword table that goes into response tags."""
+        return tag_signature(INTENT_CATEGORIES, self.topic_keywords, self.rules.keyword_groups, SENTIMENT_WORDS)
+    
+    def _tag_fixed_responses(self):
+        """Tag the rule responses, greetings, farewells and fallbacks."""
+        self.rule_responses = {rule.id: (rule.response, self.tagger(rule.response)) for rule in self.rules.compiled.rules}
+        self.fixed_tags = {
+            'greeting': [self.tagger(text) for text in self.greetings],
+            'farewell': [self.tagger(text) for text in self.farewells],
+            'fallback': [self.tagger(text) for text in self.fallbacks]
+        }
+        # Tags of engagement prompts and personalized greetings, by prompt id and interest
+        self._prompt_tags = {}
+        self._interest_tags = ResponseCache(max_size=1000)
+    
+    def _apply_rules(self):
+        """Rebuild the keyword automaton and response tags after rules.json was reloaded."""
+        signature = self._tag_signature()
+        self.matcher = self._build_matcher()
+        self.tagger = self._new_tagger()
+        self._tag_fixed_responses()
+        if signature == self._applied_tag_signature:
+            return
+        # The rule keyword groups changed, so stored tags may miss labels or keep stale ones
+        self._applied_tag_signature = signature
+        index = self.index
+        if index is not None:
+            index.tags = [self.tagger(response) for response in index.responses]
+        if self.knowledge is not None:
+            self.knowledge.retag()
+        logger.info("Retagged responses for the new rule keywords")
+    
+    def _resolve(self, response_id):
+        """Return (text, ResponseTags) for a response id, or None if it no longer exists.
+
+        Ids are "kb:<entry id>", "rule:<rule id>", "greeting:<n>" (with
+        ":<interest>" when personalized), "farewell:<n>" and "fallback:<n>".
+        """
+        kind, _, key = response_id.partition(':')
+        if kind == 'kb':
+            index = self.index
+            position = index.position(key) if index is not None else None
+            if position is None:
+                return None
+            return index.responses[position], index.tags[position]
+        if kind == 'rule':
+            return self.rule_responses.get(key)
+        tags = self.fixed_tags.get(kind)
+        number, _, interest = key.partition(':')
+        if tags is None or not number.isdigit() or int(number) >= len(tags):
+            return None
+        number = int(number)
+        if kind == 'greeting' and interest:
+            interest_tags = self._interest_tags.peek(interest)
+            if interest_tags is None:
+                interest_tags = self.tagger(self._personalize_greeting('', interest))
+                self._interest_tags.set(interest, interest_tags)
+            return (self._personalize_greeting(self.greetings[number], interest),
+                    self.tagger.combine(tags[number], interest_tags))
+        texts = {'greeting': self.greetings, 'farewell': self.farewells, 'fallback': self.fallbacks}[kind]
+        return texts[number], tags[number]
+    
+    def _previous_tags(self, context):
+        """Return the tags of the session's last answer and its engagement prompt, or None."""
+        if not context.history:
+            return None
+        exchange = context.history[-1]
+        response_id = exchange.get('response_id')
+        if response_id is None:
+            # Sessions saved before history kept response ids hold the text itself
+            text = exchange.get('bot_response')
+            return self.tagger(text) if text else None
+        resolved = self._resolve(response_id)
+        tags = resolved[1] if resolved is not None else None
+        prompt_id = exchange.get('prompt_id')
+        if prompt_id:
+            tags = self.tagger.combine(tags, self._engagement_prompt_tags(prompt_id))
+        return tags
+    
+    def _personalize_greeting(self, greeting, interest):
+        return greeting + f" I see you're interested in {interest}. How can I help you with that today?"
+    
+    def _parse(self, text):
+        """Lowercase and tokenize a message once for every pipeline stage."""
+        return ParsedMessage(text, self.stop_words)
     
     def _preprocess_text(self, text):
         """Preprocess text by tokenizing and removing stopwords."""
-        # Convert to lowercase and remove punctuation
-        text = text.lower()
-        text = re.sub(r'[^\w\s]', '', text)
-        
-        # Tokenize using our simple tokenizer and remove stopwords
-        tokens = simple_tokenize(text)
-        tokens = [word for word in tokens if word not in self.stop_words]
-        
-        return " ".join(tokens)
+        return self._parse(text).query
     
     def _generate_service_response(self, service):
         """Generate a formatted response about a service."""
@@ -277,360 +752,430 @@ class AphatorChatbot:
         expertise = ", ".join(company_info.get('expertise', []))
         return f"{company_info.get('name', 'Aphator Tech')} is {company_info.get('description', 'a leading provider of crypto and tech solutions')}. We specialize in {expertise}."
     
-    def get_response(self, user_input):
-        """Get a response based on user input with context awareness and learning."""
-        # Check for learned responses first
-        tokens = simple_tokenize(user_input)
-        key_terms = [token for token in tokens if len(token) > 3 and token not in self.stop_words]
+    def get_response(self, user_input, session_id=None, trace=None):
+        """Get a response based on user input with context awareness and learning.
+
+        trace, if given, is a dict that is filled with how the response was
+        chosen: the branch that fired and the ranked retrieval candidates.
+        """
+        started = time.perf_counter_ns()
+        timer = self.metrics.timer() if self.metrics else None
+        message = self._parse(user_input)
+        if timer:
+            timer.lap('parse')
+        context = self.sessions.get(session_id or DEFAULT_SESSION_ID)
+        if timer:
+            timer.lap('session_load')
+        response, branch = self._respond(message, context, timer=timer, trace=trace)
+        self.sessions.save(session_id or DEFAULT_SESSION_ID, context)
+        if timer:
+            timer.lap('session_save')
+            timer.finish()
+        self._log_response(session_id, branch, started)
+        if self.transcripts is not None:
+            self.transcripts.append(session_id or DEFAULT_SESSION_ID, message.text, response, branch,
+                                    tenant=self.tenant)
+        return response
+
+    def get_responses(self, messages, session_ids=None, sessions=None):
+        """Get responses for a batch of messages, scoring retrieval for the whole batch at once.
+
+        session_ids is either one session id for every message or a list with
+        one per message. Messages are answered in order, so each session's
+        context evolves exactly as it would with separate get_response calls.
+        sessions is the SessionStore holding them, self.sessions by default.
+        """
+        if sessions is None:
+            sessions = self.sessions
+        if session_ids is None or isinstance(session_ids, str):
+            session_ids = [session_ids] * len(messages)
+        if len(session_ids) != len(messages):
+            raise ValueError("session_ids must have one entry per message")
         
-        if key_terms and len(key_terms) >= 2:
+        parsed = [self._parse(user_input) for user_input in messages]
+        index = None
+        if self.scoring_pool:
+            analyses = self.scoring_pool.analyze_batch(messages)
+            retrievals = [None] * len(messages)
+        else:
+            analyses = [None] * len(messages)
+            index = self._serving_index()
+            retrievals = self._retrieve_batch(parsed, index)
+        responses = []
+        contexts = {}
+        for message, session_id, retrieval, analysis in zip(parsed, session_ids, retrievals, analyses):
+            session_id = session_id or DEFAULT_SESSION_ID
+            context = contexts.get(session_id)
+            if context is None:
+                context = contexts[session_id] = sessions.get(session_id)
+            started = time.perf_counter_ns()
+            timer = self.metrics.timer() if self.metrics else None
+            response, branch = self._respond(message, context, retrieval, analysis, timer,
+                                             retrieval_version=index.version if index is not None else None)
+            responses.append(response)
+            if timer:
+                timer.finish()
+            self._log_response(session_id, branch, started)
+            if self.transcripts is not None:
+                self.transcripts.append(session_id, message.text, response, branch, tenant=self.tenant)
+        
+        # Write each touched session through to the backend once per batch
+        for session_id, context in contexts.items():
+            sessions.save(session_id, context)
+        return responses
+
+    def _respond(self, message, context, retrieval=None, analysis=None, timer=None, trace=None,
+                 retrieval_version=None):
+        """Pick a response for one ParsedMessage using the given session context.
+
+        Returns (response, branch); timer is the request's StageTimer when
+        metrics are enabled and trace a dict to fill for debugging.
+        retrieval_version is the version of the index a precomputed retrieval
+        came from; it is dropped if another snapshot has been published since.
+        """
+        # Pick up edited rules without restarting the worker
+        if self.rules.reload_if_changed():
+            self._apply_rules()
+            self.invalidate_memo()
+        
+        # Until a background warm-up publishes the index, answers come from rules
+        # only, so they are neither memoized nor learned
+        index = self.index
+        index_ready = index is not None
+        index_version = index.version if index_ready else None
+        
+        if retrieval is not None and retrieval_version != index_version:
+            retrieval = None
+        if analysis is not None:
+            analysis = self._usable_analysis(analysis, index)
+        
+        # A learned answer comes before anything memoized, so messages with one skip the memo
+        pattern = self._learned_pattern(message.key_terms)
+        learned = pattern is not None and pattern in self.learned_responses
+        memoize = index_ready and not learned
+        
+        # Identical questions after normalization share one decision; the index version
+        # and rules mtime keep decisions stored just after a reload from being served
+        memo_key = (message.normalized, index_version, self.rules.mtime)
+        fingerprint = None
+        decision = None
+        if memoize:
+            decision = self.response_memo.get((memo_key, None))
+            if decision is not None and decision.context_dependent:
+                fingerprint = self._context_fingerprint(context)
+                decision = self.response_memo.get((memo_key, fingerprint))
+        
+        if timer:
+            timer.lap('memo')
+        
+        memoized = decision is not None
+        if decision is None:
+            if fingerprint is None:
+                fingerprint = self._context_fingerprint(context)
+            # Concurrent identical messages in equivalent contexts share one decision
+            decision = self.inflight.run((memo_key, fingerprint, learned),
+                                         self._decide, message, context, retrieval, analysis, timer)
+            if memoize:
+                if decision.context_dependent:
+                    self.response_memo.set((memo_key, None), CONTEXT_DEPENDENT)
+                    self.response_memo.set((memo_key, fingerprint), decision)
+                else:
+                    self.response_memo.set((memo_key, None), decision)
+        
+        if trace is not None:
+            self._trace(trace, message, decision, memoized)
+        
+        response = self._finish(decision, message.text, context, learn=index_ready)
+        if timer:
+            timer.lap('finish')
+            timer.branch = decision.branch
+        return response, decision.branch
+
+    def _trace(self, trace, message, decision, memoized):
+        """Record the branch that fired and the top retrieval candidates with their scores.
+
+        The candidates are ranked afresh, so they are listed even when a rule,
+        the memo or a learned response answered; candidates sharing no term
+        with the message are left out. chosen is the one retrieval would
+        answer with if its score clears the threshold.
+        """
+        index = self.index
+        candidates = index.search(message.query, k=TRACE_CANDIDATES) if index is not None and len(index) else []
+        chosen = self._prefer_curated(index, candidates[:DOCUMENT_FALLBACK_K]) if candidates else None
+        trace.update({
+            'branch': decision.branch,
+            'memoized': memoized,
+            'topic': decision.topic,
+            'retrieval': {
+                'mode': self.retrieval_mode,
+                'threshold': self.retrieval_threshold,
+                'document_threshold': self.document_threshold,
+                'chosen': chosen.entry_id if chosen is not None else None,
+                'candidates': [{
+                    'entry_id': match.entry_id,
+                    'kind': index.kinds[match.position],
+                    'score': round(match.score, 4),
+                    'confidence': round(match.confidence, 4),
+                    'topic': match.tags.topic if match.tags else None,
+                    'intent': match.tags.intent if match.tags else None
+                } for match in candidates if match.score > 0]
+            }
+        })
+
+    def _usable_analysis(self, analysis, index):
+        """A worker's MessageAnalysis, or None if the worker has not caught up with the current rules.
+
+        Its retrieval is dropped if it searched another index snapshot.
+        """
+        if analysis.rules_mtime != self.rules.mtime:
+            return None
+        if index is None or analysis.index_snapshot != index.snapshot_id:
+            analysis.retrieval = None
+        return analysis
+
+    def _log_response(self, session_id, branch, started):
+        """Emit the structured per-message record (session, branch, latency) at DEBUG.
+
+        One record per message is too many for INFO in production; LOG_LEVEL=DEBUG
+        with a LOG_SAMPLE_RATES share for DEBUG keeps a sample of them.
+        """
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Answered message", extra={
+                'session_id': session_id or DEFAULT_SESSION_ID,
+                'branch': branch,
+                'latency_ms': round((time.perf_counter_ns() - started) / 1e6, 3)
+            })
+
+    def invalidate_memo(self):
+        """Drop memoized decisions after company data or rules change."""
+        self.response_memo.clear()
+        logger.info("Cleared response memo")
+
+    def _context_fingerprint(self, context):
+        """The parts of a session context that can change a decision."""
+        if not context.history:
+            return (False, None, None)
+        return (True, context.get_dominant_topic(), self._previous_tags(context))
+
+    def _decide(self, message, context, retrieval=None, analysis=None, timer=None):
+        """Run the response pipeline and return its deterministic outcome.
+
+        retrieval is the best Match when it was already computed for a batch,
+        and analysis the MessageAnalysis when a scoring worker computed it;
+        anything missing is computed here if needed.
+        """
+        key_terms = analysis.key_terms if analysis is not None else message.key_terms
+        
+        # Check for learned responses first
+        learned = None
+        pattern = self._learned_pattern(key_terms)
+        if pattern is not None:
             # Look for matching patterns in learned responses
-            pattern = ' '.join(sorted(key_terms[:3]))  # Use up to 3 key terms
-            if pattern in self.learned_responses:
-                logger.debug(f"Using learned response for pattern: {pattern}")
-                learned_response = self.learned_responses[pattern]
-                # Add engagement and learn from this interaction
-                final_response = self._add_engagement_prompt(learned_response)
-                self._learn_from_interaction(user_input, final_response)
-                return final_response
-                
-        # Detect user intent
-        intent = self._detect_intent(user_input)
-        sentiment = self._analyze_sentiment(user_input)
-        lower_input = user_input.lower()
+            learned = self._resolve_learned(self.learned_responses.get(pattern))
+        if timer:
+            timer.lap('learned')
+        if learned is not None:
+            logger.debug("Using learned response for pattern: %s", pattern)
+            response_id, prompt_id, response, tags = learned
+            return ResponseDecision('learned', (response,), (response_id,), key_terms,
+                                    engage=True, topic=tags.topic, prompt_id=prompt_id)
+        
+        if analysis is None and retrieval is None and self.scoring_pool is not None:
+            # Only messages the memo and learned responses can't answer pay for the
+            # round trip to a worker, and coalesced duplicates share one
+            analysis = self._usable_analysis(self.scoring_pool.analyze(message.text), self.index)
+            if timer:
+                timer.lap('scoring_pool')
+        if analysis is not None:
+            if retrieval is None:
+                retrieval = analysis.retrieval
+            matches, intent, sentiment = analysis.matches, analysis.intent, analysis.sentiment
+        else:
+            # Match every pattern table against the message in a single pass
+            matches = self.matcher.match(message.lowered, lowered=True)
+            
+            # Detect user intent
+            intent = self._detect_intent(matches)
+            sentiment = self._analyze_sentiment(matches)
+        if timer:
+            timer.lap('matching')
         
         # Check for greetings
-        if self._is_greeting(user_input):
-            greeting = random.choice(self.greetings)
+        if self._is_greeting(matches):
+            greetings = tuple(self.greetings)
+            ids = tuple(f"greeting:{number}" for number in range(len(greetings)))
             # If this isn't the first interaction, personalize based on history
-            if self.context.history:
-                dominant_topic = self.context.get_dominant_topic()
+            if context.history:
+                dominant_topic = context.get_dominant_topic()
                 if dominant_topic:
-                    greeting += f" I see you're interested in {dominant_topic}. How can I help you with that today?"
-            
-            self._learn_from_interaction(user_input, greeting)
-            return greeting
+                    greetings = tuple(self._personalize_greeting(greeting, dominant_topic) for greeting in greetings)
+                    ids = tuple(f"{response_id}:{dominant_topic}" for response_id in ids)
+            return ResponseDecision('greeting', greetings, ids, key_terms, context_dependent=True)
         
         # Check for farewells
-        if self._is_farewell(user_input):
-            farewell = random.choice(self.farewells)
-            self._learn_from_interaction(user_input, farewell)
-            return farewell
-        
-        # General help response for broad questions
-        if any(phrase in lower_input for phrase in ["how can you help", "what can you do", "assist me", "help me with"]):
-            help_response = ("I can help you with information about Aphator Tech's products and services. " +
-                           "We specialize in blockchain development, cryptocurrency trading solutions, Web3 integration, " +
-                           "NFT development, cybersecurity for crypto, and custom software development. " +
-                           "How can I assist you specifically today?")
-            self._learn_from_interaction(user_input, help_response)
-            return help_response
-
-        # Handle "I want to" type requests with context awareness
-        if "want to" in lower_input:
-            if any(word in lower_input for word in ["build", "create", "develop", "launch"]):
-                if any(word in lower_input for word in ["app", "application", "website", "software", "platform"]):
-                    app_response = ("Aphator Tech can help you develop your application or software project. Our development team " +
-                                  "creates custom solutions for various platforms including web, mobile, and enterprise systems. " +
-                                  "Application development starts at $10,000, with the exact price depending on your specific requirements. " +
-                                  "Would you like to tell me more about your project?")
-                    self._learn_from_interaction(user_input, app_response)
-                    return self._add_engagement_prompt(app_response, "application")
-                    
-                if any(word in lower_input for word in ["blockchain", "smart contract", "dapp", "token"]):
-                    blockchain_response = ("Aphator Tech specializes in blockchain development. We can help you build custom blockchain solutions, " +
-                                         "smart contracts, DApps, or handle tokenization services. Our blockchain services start at $5,000, " +
-                                         "and we work with various blockchain protocols including Ethereum, Solana, and Binance Smart Chain. " +
-                                         "What kind of blockchain project are you looking to develop?")
-                    self._learn_from_interaction(user_input, blockchain_response)
-                    return self._add_engagement_prompt(blockchain_response, "blockchain")
-                    
-                if any(word in lower_input for word in ["trade", "trading", "invest", "investment"]):
-                    trading_response = ("For cryptocurrency trading and investment solutions, Aphator Tech offers custom trading bots, " +
-                                      "market analysis tools, and portfolio management systems. Our TradeBotX product ($59.99/month) provides " +
-                                      "automated trading capabilities with strategy building and risk management features. " +
-                                      "Would you like more information about our trading solutions?")
-                    self._learn_from_interaction(user_input, trading_response)
-                    return self._add_engagement_prompt(trading_response, "crypto_trading")
-                    
-        # Check for more specific queries that can be handled directly from text data
-        if hasattr(self, 'text_company_data') and self.text_company_data:
-            # Check for product specific questions with context awareness
-            if "cryptotracker" in lower_input or "crypto tracker" in lower_input:
-                tracker_response = ("CryptoTracker Pro is Aphator Tech's all-in-one cryptocurrency portfolio tracking and management solution. " +
-                                  "It offers multi-wallet support, real-time price updates, performance analytics, and tax reporting tools. " +
-                                  "It's available for $29.99/month. Would you like more details about its features?")
-                self._learn_from_interaction(user_input, tracker_response)
-                return self._add_engagement_prompt(tracker_response, "crypto_trading")
-            
-            if "blocksecure" in lower_input or "block secure" in lower_input:
-                security_response = ("BlockSecure is our comprehensive security solution for blockchain assets. It includes multi-signature " +
-                                   "wallet implementation, automated security audits, threat detection and alerts, and secure backup solutions. " +
-                                   "Available for $49.99/month. Would you like to learn more about how it can protect your crypto assets?")
-                self._learn_from_interaction(user_input, security_response)
-                return self._add_engagement_prompt(security_response, "security")
-            
-            if "smartcontract" in lower_input or "smart contract builder" in lower_input or "smart contract" in lower_input:
-                contract_response = ("SmartContract Builder is Aphator Tech's no-code platform for creating smart contracts. It includes a template " +
-                                   "library, visual contract builder, automated testing, and one-click deployment capabilities. " +
-                                   "It's priced at $39.99/month. Would you like more information about how it simplifies smart contract development?")
-                self._learn_from_interaction(user_input, contract_response)
-                return self._add_engagement_prompt(contract_response, "blockchain")
-            
-            if "tradebotx" in lower_input or "trade bot" in lower_input or "trading bot" in lower_input:
-                bot_response = ("TradeBotX is our automated cryptocurrency trading bot featuring a strategy builder, multi-exchange support, " +
-                              "backtesting capabilities, and risk management tools. It's available for $59.99/month. " +
-                              "Would you like to know more about how it can optimize your trading strategies?")
-                self._learn_from_interaction(user_input, bot_response)
-                return self._add_engagement_prompt(bot_response, "crypto_trading")
-            
-            # Check for services with context awareness
-            if "blockchain" in lower_input or "dapp" in lower_input:
-                blockchain_service = ("Aphator Tech offers comprehensive blockchain development services, including custom blockchain solutions, " +
-                                    "smart contract creation and auditing, DApp development, tokenization services, and blockchain integration " +
-                                    "with existing systems. Our team has extensive experience building secure and efficient blockchain applications " +
-                                    "tailored to specific business needs.")
-                self._learn_from_interaction(user_input, blockchain_service)
-                return self._add_engagement_prompt(blockchain_service, "blockchain")
-            
-            if any(word in lower_input for word in ["trading", "crypto trading", "cryptocurrency trading"]):
-                trading_service = ("Our Cryptocurrency Trading Solutions include custom trading bots, market analysis tools, portfolio management " +
-                                 "systems, trading strategy implementation, and real-time market data integration. We can help optimize " +
-                                 "your trading operations with cutting-edge technology and expertise in cryptocurrency markets.")
-                self._learn_from_interaction(user_input, trading_service)
-                return self._add_engagement_prompt(trading_service, "crypto_trading")
-            
-            if "web3" in lower_input:
-                web3_service = ("Aphator Tech specializes in Web3 integration services, including wallet integration, decentralized authentication, " +
-                              "smart contract interaction, cross-chain compatibility, and gas optimization. We can help connect your " +
-                              "existing platforms to the decentralized web and blockchain ecosystems.")
-                self._learn_from_interaction(user_input, web3_service)
-                return self._add_engagement_prompt(web3_service, "blockchain")
-            
-            if "nft" in lower_input:
-                nft_service = ("Our NFT development services include NFT marketplace development, collection smart contracts, minting tools " +
-                             "and platforms, metadata management, and royalty implementation. We can help you create, launch, and " +
-                             "manage NFT projects from concept to deployment.")
-                self._learn_from_interaction(user_input, nft_service)
-                return self._add_engagement_prompt(nft_service, "nft")
-            
-            if "security" in lower_input or "cybersecurity" in lower_input or "secure" in lower_input:
-                security_service = ("Aphator Tech provides specialized Cybersecurity for Crypto services, including wallet security audits, " +
-                                  "smart contract vulnerability analysis, penetration testing, security protocol implementation, and " +
-                                  "secure key management solutions. We help protect your digital assets with advanced security measures.")
-                self._learn_from_interaction(user_input, security_service)
-                return self._add_engagement_prompt(security_service, "security")
-            
-            if any(word in lower_input for word in ["contact", "reach", "email", "phone", "call"]):
-                contact_info = ("You can reach Aphator Tech through the following channels:\nEmail: info@aphatortech.com\n" +
-                              "Support: support@aphatortech.com\nPhone: +1-555-APHATOR\nWebsite: www.aphatortech.com")
-                self._learn_from_interaction(user_input, contact_info)
-                return contact_info
-                       
-            # Application development questions
-            if any(word in lower_input for word in ["app", "application", "software", "mobile app", "web app"]):
-                app_dev_info = ("Aphator Tech provides comprehensive application development services, including mobile applications (iOS/Android), " + 
-                              "web applications, enterprise systems, and custom software solutions. Our development process includes " +
-                              "requirements analysis, design, development, testing, and deployment. Pricing starts at $10,000 for " +
-                              "full applications, with the final cost depending on complexity, features, and timeline. Would you like " +
-                              "to discuss your specific software needs?")
-                self._learn_from_interaction(user_input, app_dev_info)
-                return self._add_engagement_prompt(app_dev_info, "application")
-            
-            # Pricing questions
-            if any(word in lower_input for word in ["price", "pricing", "cost", "how much", "fee", "payment"]):
-                pricing_info = ("Aphator Tech offers various services and products with different pricing structures. " +
-                              "Our software development services start at $10,000 for full applications. " +
-                              "Blockchain development starts at $5,000. Our products include CryptoTracker Pro ($29.99/month), " +
-                              "BlockSecure ($49.99/month), SmartContract Builder ($39.99/month), and TradeBotX ($59.99/month). " +
-                              "We'd be happy to provide a detailed quote based on your specific requirements.")
-                self._learn_from_interaction(user_input, pricing_info)
-                return pricing_info
+        if self._is_farewell(matches):
+            return ResponseDecision('farewell', tuple(self.farewells),
+                                    tuple(f"farewell:{number}" for number in range(len(self.farewells))), key_terms)
+        
+        facts = RuleFacts(
+            matches, intent, sentiment,
+            has_text_data=self.has_text_data,
+            previous_tags=self._previous_tags(context)
+        )
+        self.rules.requests += 1
+        
+        # Keyword rules for services, products, contact and pricing
+        rule, evaluated = self.rules.evaluate('before_retrieval', facts)
+        logger.debug("Evaluated %s rules before retrieval", evaluated)
+        if timer:
+            timer.lap('rules_before')
+        if rule:
+            return self._rule_decision(rule, key_terms, facts)
         
         # If we have vectorized data, find the best match
-        if self.tfidf_matrix is not None and self.corpus:
-            # Preprocess and vectorize the user input
-            processed_input = self._preprocess_text(user_input)
-            input_vector = self.vectorizer.transform([processed_input])
-            
-            # Calculate similarity with all corpus items
-            similarity_scores = cosine_similarity(input_vector, self.tfidf_matrix).flatten()
-            
-            # Find the best match
-            best_match_idx = similarity_scores.argmax()
-            max_similarity = similarity_scores[best_match_idx]
-            
-            logger.debug(f"Best match index: {best_match_idx}, similarity: {max_similarity}")
-            
+        if retrieval is None:
+            retrieval = self._retrieve(message)
+        if timer:
+            timer.lap('retrieval')
+        if retrieval is not None:
             # If we have a reasonable match, return the corresponding response
-            if max_similarity > 0.2:  # Threshold for confidence
-                response = self.responses[best_match_idx]
-                
-                # Determine topic to use with the engagement prompt
-                topic = None
-                for topic_name, keywords in self.topic_keywords.items():
-                    if any(keyword in response.lower() for keyword in keywords):
-                        topic = topic_name
-                        break
+            if retrieval.score > self._answer_threshold(retrieval):  # Threshold for confidence
+                response = retrieval.response
                 
-                # Add engagement and learn from this interaction
-                final_response = self._add_engagement_prompt(response, topic)
-                self._learn_from_interaction(user_input, final_response)
-                return final_response
-        
-        # Check for conversation continuity based on context
-        if self.context.history:
-            # Look for potential follow-up to previous conversation
-            last_exchange = self.context.history[-1]
-            last_response = last_exchange['bot_response'].lower()
-            
-            # If the previous response mentioned a service/product, try to continue that thread
-            if any(term in last_response for term in ['would you like', 'more information', 'tell me', 'interested in']):
-                # Detect positive response
-                if any(word in lower_input for word in ['yes', 'sure', 'okay', 'please', 'interested', 'tell me']):
-                    # Find what we were talking about
-                    topics_mentioned = []
-                    for topic, keywords in self.topic_keywords.items():
-                        if any(keyword in last_response for keyword in keywords):
-                            topics_mentioned.append(topic)
-                    
-                    if topics_mentioned:
-                        primary_topic = topics_mentioned[0]
-                        if primary_topic == 'blockchain':
-                            follow_up = ("Our blockchain development team specializes in EVM-compatible chains like Ethereum, " +
-                                       "Binance Smart Chain, and Polygon, as well as alternate protocols like Solana and Cosmos. " +
-                                       "We can develop custom smart contracts, create DApps, handle token issuance, build NFT platforms, " +
-                                       "and integrate existing applications with blockchain technology. Would you like to schedule " +
-                                       "a consultation with one of our blockchain specialists?")
-                            self._learn_from_interaction(user_input, follow_up)
-                            return follow_up
-                        
-                        elif primary_topic == 'crypto_trading':
-                            follow_up = ("Our trading solutions can be customized to your specific needs and trading style. " +
-                                       "We can develop algorithmic bots that trade based on technical indicators, implement " +
-                                       "specific strategies (trend-following, mean reversion, arbitrage, etc.), create real-time " +
-                                       "portfolio trackers and analytics systems, and integrate with major exchanges. Would you like " +
-                                       "to discuss what features would be most important for your trading needs?")
-                            self._learn_from_interaction(user_input, follow_up)
-                            return follow_up
-                        
-                        elif primary_topic == 'application':
-                            follow_up = ("Our application development process begins with thorough requirements gathering " +
-                                       "to ensure we build precisely what you need. We develop mobile apps (native or cross-platform), " +
-                                       "web applications, enterprise systems, and custom software solutions. Our developers follow " +
-                                       "industry best practices for secure, scalable, and maintainable code. Would you like to " +
-                                       "tell me more about the specific application you're looking to build?")
-                            self._learn_from_interaction(user_input, follow_up)
-                            return follow_up
-                        
-                        elif primary_topic == 'nft':
-                            follow_up = ("Our NFT development services cover the complete lifecycle from concept to marketplace. " +
-                                       "This includes creating smart contracts for your collection, implementing minting functionality, " +
-                                       "managing metadata and assets, building marketplace functionality, and ensuring proper royalty " +
-                                       "distribution. We've helped launch several successful NFT projects in art, gaming, and utility tokens. " +
-                                       "Would you like to discuss your specific NFT project ideas?")
-                            self._learn_from_interaction(user_input, follow_up)
-                            return follow_up
-                        
-                        elif primary_topic == 'security':
-                            follow_up = ("Our security services include comprehensive audits of smart contracts and blockchain applications, " +
-                                       "implementation of multi-signature solutions, secure key management systems, vulnerability assessment, " +
-                                       "penetration testing, and ongoing security monitoring. We help protect your digital assets with " +
-                                       "industry-leading security practices. Would you like more information about specific security " +
-                                       "concerns or protocols?")
-                            self._learn_from_interaction(user_input, follow_up)
-                            return follow_up
-        
-        # Attempt to handle general questions based on intent
-        if intent != "general_query":
-            if intent == "opinion":
-                opinion_response = ("Based on our extensive experience in the crypto and tech space, Aphator Tech " +
-                                  "recommends a careful, strategic approach to implementing blockchain and crypto solutions. " +
-                                  "Security should always be the priority, followed by scalability and user experience. " +
-                                  "Our experts can provide more specific recommendations based on your unique requirements.")
-                self._learn_from_interaction(user_input, opinion_response)
-                return opinion_response
-            
-            elif intent == "comparison":
-                comparison_response = ("When comparing solutions, Aphator Tech focuses on security, performance, cost-effectiveness, " +
-                                     "and long-term maintainability. Each technology has its strengths - for example, Ethereum offers " +
-                                     "robust security and widespread adoption but with higher gas fees, while alternatives like Solana " +
-                                     "offer higher throughput at potentially lower costs. We can help you evaluate the best fit for your specific needs.")
-                self._learn_from_interaction(user_input, comparison_response)
-                return comparison_response
-            
-            elif intent == "problem":
-                problem_response = ("Aphator Tech specializes in solving complex technical challenges in the crypto and blockchain space. " +
-                                  "Common issues we address include smart contract vulnerabilities, blockchain integration difficulties, " +
-                                  "scalability bottlenecks, and security concerns. Our team can analyze your specific problem and develop " +
-                                  "a tailored solution. Could you tell me more about the specific challenge you're facing?")
-                self._learn_from_interaction(user_input, problem_response)
-                return problem_response
-            
-            elif intent == "clarification":
-                clarification_response = ("I'd be happy to clarify any information about Aphator Tech's services or crypto technology in general. " +
-                                       "We aim to make complex technical concepts accessible and understandable. Could you specify which " +
-                                       "aspect you'd like me to explain in more detail?")
-                self._learn_from_interaction(user_input, clarification_response)
-                return clarification_response
-        
-        # General learning response for unhandled queries about learning capabilities
-        if any(word in lower_input for word in ["learn", "train", "teaching", "model", "improve"]):
-            learning_response = ("I'm designed to learn and improve as I interact with more questions. While I don't have training capabilities " +
-                              "in the traditional sense, the Aphator Tech team regularly updates my knowledge base to better assist with questions " +
-                              "about our crypto and tech services. Is there something specific about Aphator Tech you'd like to know?")
-            self._learn_from_interaction(user_input, learning_response)
-            return learning_response
-        
-        # Custom fallback with context awareness
-        if sentiment == "negative":
-            # If user seems frustrated, be more helpful
-            apologetic_fallback = ("I apologize for not understanding your question correctly. " +
-                                 "Aphator Tech specializes in blockchain development, crypto trading solutions, application development, " +
-                                 "NFT platforms, and security services. Could you please rephrase your question or specify which " +
-                                 "of our services you're interested in learning more about?")
-            self._learn_from_interaction(user_input, apologetic_fallback)
-            return apologetic_fallback
-        else:
-            # Standard fallback
-            fallback = random.choice(self.fallbacks)
-            self._learn_from_interaction(user_input, fallback)
-            return fallback
-    
-    def _is_greeting(self, text):
-        """Check if text contains a greeting."""
-        greeting_patterns = ['hello', 'hi', 'hey', 'greetings', 'good morning', 'good afternoon', 'good evening']
-        return any(pattern in text.lower() for pattern in greeting_patterns)
-    
-    def _is_farewell(self, text):
-        """Check if text contains a farewell."""
-        farewell_patterns = ['bye', 'goodbye', 'see you', 'talk to you later', 'thanks', 'thank you']
-        return any(pattern in text.lower() for pattern in farewell_patterns)
-        
-    def _detect_intent(self, text):
-        """Determine the intent of the user's message."""
-        text_lower = text.lower()
+                # The entry's topic, tagged at index time, goes with the engagement prompt
+                return ResponseDecision(self.retrieval_mode, (response,), (f"kb:{retrieval.entry_id}",), key_terms, engage=True,
+                                        topic=retrieval.tags.topic if retrieval.tags else None,
+                                        context_dependent=facts.used_previous)
+        
+        # Follow-ups to the previous answer, intent fallbacks and frustrated users
+        rule, evaluated = self.rules.evaluate('after_retrieval', facts)
+        logger.debug("Evaluated %s rules after retrieval", evaluated)
+        if timer:
+            timer.lap('rules_after')
+        if rule:
+            return self._rule_decision(rule, key_terms, facts)
+        
+        # Standard fallback
+        return ResponseDecision('fallback', tuple(self.fallbacks),
+                                tuple(f"fallback:{number}" for number in range(len(self.fallbacks))), key_terms,
+                                context_dependent=facts.used_previous)
+    
+    def analyze(self, user_input):
+        """Compute the session-independent MessageAnalysis for a message."""
+        if self.rules.reload_if_changed():
+            self._apply_rules()
+        message = self._parse(user_input)
+        matches = self.matcher.match(message.lowered, lowered=True)
+        return MessageAnalysis(
+            message.key_terms, matches, self._detect_intent(matches), self._analyze_sentiment(matches),
+            self._retrieve(message), self.rules.mtime, self.ensure_index().snapshot_id
+        )
+    
+    def search(self, user_input, k=5):
+        """Return the top-k corpus matches for a message."""
+        return self.ensure_index().search(self._preprocess_text(user_input), k=k)
+    
+    def _retrieve(self, message):
+        """Return the best corpus Match for a ParsedMessage, or None without vectors."""
+        index = self._serving_index()
+        if index is None or not len(index):
+            return None
+        
+        # Preprocess the user input and find the best match among all corpus items
+        best_match = self._prefer_curated(index, index.search(message.query, k=DOCUMENT_FALLBACK_K))
+        
+        logger.debug("Best match: %s, similarity: %s", best_match.entry_id, best_match.score)
+        return best_match
+    
+    def best_matches(self, messages):
+        """Best knowledge-base Match (or None) for each message string, whatever its score.
+
+        This is the match retrieval would answer with if it cleared the
+        threshold, for tools such as transcript mining.
+        """
+        return self._retrieve_batch([self._parse(text) for text in messages])
+    
+    def _retrieve_batch(self, messages, index=None):
+        """Best corpus Match for every ParsedMessage using one sparse matrix product.
+
+        index defaults to the serving index.
+        """
+        if index is None:
+            index = self._serving_index()
+        if index is None or not len(index) or not messages:
+            return [None] * len(messages)
+        
+        return [self._prefer_curated(index, matches)
+                for matches in index.search_batch([message.query for message in messages], k=DOCUMENT_FALLBACK_K)]
+    
+    def _answer_threshold(self, match):
+        """Score a match must exceed to be answered: higher for document chunks."""
+        if source_of_entry(match.entry_id) is not None:
+            return self.document_threshold
+        return self.retrieval_threshold
+    
+    def _prefer_curated(self, index, matches):
+        """The best FAQ, service or product match above the threshold, else the best match overall.
+
+        Document chunks repeat much of the hand-written entries' wording, so
+        they only answer questions no curated entry covers.
+        """
+        for match in matches:
+            if match.score <= self.retrieval_threshold:
+                break
+            if index.kinds[match.position] != 'document':
+                return match
+        return matches[0]
+    
+    def _rule_decision(self, rule, key_terms, facts):
+        """Turn a matched rule into a response decision."""
+        logger.debug("Matched rule: %s", rule.id)
+        return ResponseDecision(rule.branch, (rule.response,), (f"rule:{rule.id}",), key_terms,
+                                engage=bool(rule.engagement_topic), topic=rule.engagement_topic,
+                                context_dependent=facts.used_previous)
+    
+    def _finish(self, decision, user_input, context, learn=True):
+        """Pick the final wording for a decision, learn from it and record the exchange."""
+        number = 0 if len(decision.responses) == 1 else random.randrange(len(decision.responses))
+        response = decision.responses[number]
+        
+        prompt_id = None
+        if decision.engage and decision.topic:
+            prompt_id = self._choose_engagement_prompt(decision.topic)
+        final_response = response
+        if prompt_id is not None:
+            final_response = f"{response}\n\n{self._engagement_prompt(prompt_id)}"
         
+        self._learn_from_interaction(user_input, context, decision.ids[number], prompt_id or decision.prompt_id,
+                                     key_terms=decision.key_terms, learn=learn and decision.branch in LEARNED_BRANCHES)
+        return final_response
+    
+    def _is_greeting(self, matches):
+        """Check if the message contains a greeting."""
+        return matches.has('intent:greeting')
+    
+    def _is_farewell(self, matches):
+        """Check if the message contains a farewell."""
+        return matches.has('intent:farewell')
+        
+    def _detect_intent(self, matches):
+        """Determine the intent of the user's message."""
         # Check against our intent categories
-        for intent, patterns in INTENT_CATEGORIES.items():
-            if any(pattern in text_lower for pattern in patterns):
+        for intent in INTENT_CATEGORIES:
+            if matches.has(f"intent:{intent}"):
                 return intent
                 
         # Check for known topics in our topic keywords
-        for topic, keywords in self.topic_keywords.items():
-            if any(keyword in text_lower for keyword in keywords):
-                return f"topic_{topic}"
+        topic_label = matches.first(self.topic_labels)
+        if topic_label:
+            return f"topic_{topic_label[len('topic:'):]}"
                 
         return "general_query"
         
-    def _analyze_sentiment(self, text):
+    def _analyze_sentiment(self, matches):
         """Simple sentiment analysis to detect user mood."""
-        positive_words = ['good', 'great', 'excellent', 'amazing', 'wonderful', 'best', 'love', 'like', 'helpful', 'useful']
-        negative_words = ['bad', 'poor', 'terrible', 'awful', 'worst', 'hate', 'dislike', 'useless', 'disappointing', 'expensive']
-        
-        text_tokens = simple_tokenize(text)
-        positive_count = sum(1 for word in text_tokens if word in positive_words)
-        negative_count = sum(1 for word in text_tokens if word in negative_words)
+        positive_count = matches.count('sentiment:positive')
+        negative_count = matches.count('sentiment:negative')
         
         if positive_count > negative_count:
             return "positive"
@@ -638,40 +1183,63 @@ class AphatorChatbot:
             return "negative"
         return "neutral"
         
-    def _add_engagement_prompt(self, response, topic=None):
-        """Add an engagement prompt to encourage further conversation."""
+    def _choose_engagement_prompt(self, topic):
+        """Decide whether to add an engagement prompt to encourage further conversation.
+
+        Returns the prompt id ("<n>:<topic>") or None.
+        """
         # Don't add prompts to every response
         if random.random() > 0.7:  # 30% chance to add a prompt
-            return response
-            
-        if not topic:
-            # Try to determine topic from the response
-            for topic_name, keywords in self.topic_keywords.items():
-                if any(keyword in response.lower() for keyword in keywords):
-                    topic = topic_name
-                    break
-                    
-        if topic:
-            # Format the prompt with the detected topic
-            prompt = random.choice(self.engagement_prompts).format(topic=topic.replace('_', ' '))
-            return f"{response}\n\n{prompt}"
-        
-        return response
+            return None
+        return f"{random.randrange(len(self.engagement_prompts))}:{topic}"
+    
+    def _engagement_prompt(self, prompt_id):
+        """Format the engagement prompt with its topic."""
+        number, _, topic = prompt_id.partition(':')
+        return self.engagement_prompts[int(number)].format(topic=topic.replace('_', ' '))
+    
+    def _engagement_prompt_tags(self, prompt_id):
+        tags = self._prompt_tags.get(prompt_id)
+        if tags is None:
+            tags = self._prompt_tags[prompt_id] = self.tagger(self._engagement_prompt(prompt_id))
+        return tags
+    
+    def _learned_pattern(self, key_terms):
+        """The learned-response pattern for a message's key terms, or None for fewer than two."""
+        if key_terms and len(key_terms) >= 2:
+            return ' '.join(sorted(key_terms[:3]))  # Use up to 3 key terms
+        return None
+    
+    def _resolve_learned(self, learned):
+        """Return (response id, prompt id, text, tags) for a learned value, or None if it no longer resolves.
+
+        Learned values are [response id, prompt id] pairs; plain strings from
+        snapshots written before responses had ids are ignored.
+        """
+        if not isinstance(learned, (list, tuple)):
+            return None
+        response_id, prompt_id = learned
+        resolved = self._resolve(response_id)
+        if resolved is None:
+            return None
+        response, tags = resolved
+        if prompt_id:
+            response = f"{response}\n\n{self._engagement_prompt(prompt_id)}"
+            tags = self.tagger.combine(tags, self._engagement_prompt_tags(prompt_id))
+        return response_id, prompt_id, response, tags
         
-    def _learn_from_interaction(self, user_input, response):
+    def _learn_from_interaction(self, user_input, context, response_id, prompt_id=None, key_terms=None, learn=True):
         """Store user input patterns to improve future responses."""
         # Extract key terms from user input
-        tokens = simple_tokenize(user_input)
-        key_terms = [token for token in tokens if len(token) > 3 and token not in self.stop_words]
+        if key_terms is None:
+            key_terms = self._parse(user_input).key_terms
         
-        if key_terms and len(key_terms) >= 2:
-            # Create a simple pattern from the key terms
-            pattern = ' '.join(sorted(key_terms[:3]))  # Use up to 3 key terms
-            
-            # Store the response for this pattern if we don't already have one
-            if pattern not in self.learned_responses:
-                self.learned_responses[pattern] = response
-                logger.debug(f"Learned new pattern: {pattern}")
+        pattern = self._learned_pattern(key_terms)
+        if learn and pattern is not None:
+            # Store the response for this pattern if we don't already have a usable one
+            if self._resolve_learned(self.learned_responses.peek(pattern)) is None:
+                self.learned_responses.set(pattern, (response_id, None if self.learn_base_responses else prompt_id))
+                logger.debug("Learned new pattern: %s", pattern)
                 
         # Update conversation context
-        self.context.add_exchange(user_input, response)
+        context.add_exchange(user_input, response_id, prompt_id, interests=key_terms)
@@ -0,0 +1,188 @@
+import logging
+import os
+import re
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+# Files picked up when the text data path is a folder
+DOCUMENT_SUFFIXES = ('.txt', '.md')
+
+# Chunks longer than this are split, so one huge section can't dominate a match
+MAX_CHUNK_CHARS = 1200
+
+# Knowledge base source of a document's chunks; entry ids are "doc:<name>#<n>"
+DOCUMENT_SOURCE_PREFIX = 'document:'
+
+HEADING_RE = re.compile(r'^(#{1,6})\s+(.*?)\s*#*\s*$')
+NUMBERED_ITEM_RE = re.compile(r'^(\d+)[.)]\s+(.*)$')
+BULLET_RE = re.compile(r'^\s*(?:[-*+]|\d+[.)])\s+(.*)$')
+
+
+def document_source(name):
+    return DOCUMENT_SOURCE_PREFIX + name
+
+
+def source_of_entry(entry_id):
+    """Knowledge base source of a document chunk id, or None for other entries."""
+    if not entry_id.startswith('doc:'):
+        return None
+    return document_source(entry_id[len('doc:'):].rsplit('#', 1)[0])
+
+
+class Chunk:
+    """A section or list item of a document: its heading path and body lines."""
+    __slots__ = ('headings', 'lines')
+
+    def __init__(self, headings, lines):
+        self.headings = headings
+        self.lines = lines
+
+    @property
+    def title(self):
+        return self.headings[-1] if self.headings else ''
+
+    @property
+    def text(self):
+        """Text that is indexed: the headings below the document title plus the body."""
+        return ' '.join(self.headings[1:] + self.lines)
+
+    @property
+    def response(self):
+        """The chunk as an answer, e.g. "Blockchain Development: Custom blockchain solutions; DApp development."."""
+        body = '; '.join(line.rstrip('.;:') for line in self.lines)
+        if not self.title:
+            return body + '.'
+        return f"{self.title}: {body}."
+
+
+def iter_chunks(lines, max_chars=MAX_CHUNK_CHARS):
+    """Stream section-aware chunks from an iterable of lines.
+
+    A heading starts a new section, and within a section every top-level
+    numbered item ("1. Blockchain Development") starts a chunk that collects
+    its bullet points. Other lines belong to the section's own chunk. Only the
+    current chunk is held in memory, so any file size can be streamed.
+    """
+    headings = []
+    item = None
+    body = []
+    size = 0
+
+    def chunk():
+        if not body:
+            # A numbered item without bullet points is a one-line chunk of its section
+            return Chunk(list(headings), [item])
+        return Chunk(headings + ([item] if item else []), body)
+
+    for line in lines:
+        line = line.rstrip()
+        stripped = line.strip()
+        if not stripped:
+            continue
+        heading = HEADING_RE.match(stripped)
+        numbered = NUMBERED_ITEM_RE.match(line)
+        if heading or numbered:
+            if body or item:
+                yield chunk()
+            body = []
+            size = 0
+            if heading:
+                level = len(heading.group(1))
+                headings = headings[:level - 1] + [heading.group(2)]
+                item = None
+            else:
+                item = numbered.group(2).strip()
+            continue
+
+        bullet = BULLET_RE.match(line)
+        text = bullet.group(1).strip() if bullet else stripped
+        if body and size + len(text) > max_chars:
+            yield chunk()
+            body = []
+            size = 0
+        body.append(text)
+        size += len(text)
+
+    if body or item:
+        yield chunk()
+
+
+def chunk_entries(path, name):
+    """(id, kind, text, response) knowledge entries for every chunk of a document file."""
+    entries = []
+    with open(path, 'r', encoding='utf-8', errors='replace') as f:
+        for position, chunk in enumerate(iter_chunks(f)):
+            entries.append((f"doc:{name}#{position}", 'document', chunk.text, chunk.response))
+    return entries
+
+
+class DocumentSource:
+    """Text documentation indexed into a KnowledgeBase and kept up to date by mtime.
+
+    path is a single file or a folder searched recursively for .txt and .md
+    files. The manifest records the mtime and size each file had when it was
+    last indexed, so sync() only re-chunks files that changed and drops the
+    chunks of files that disappeared. Files are streamed and nothing but the
+    chunks is kept, so large folders don't stay in memory.
+    """
+    def __init__(self, path, manifest=None):
+        self.path = Path(path)
+        self.manifest = dict(manifest or {})
+
+    def files(self):
+        """{name: path} of every document, named relative to the folder."""
+        if self.path.is_file():
+            return {self.path.name: self.path}
+        if not self.path.is_dir():
+            return {}
+        return {
+            file.relative_to(self.path).as_posix(): file
+            for file in sorted(self.path.rglob('*'))
+            if file.suffix.lower() in DOCUMENT_SUFFIXES and file.is_file()
+        }
+
+    @staticmethod
+    def _state(path):
+        stat = os.stat(path)
+        return [stat.st_mtime_ns, stat.st_size]
+
+    def sync(self, knowledge):
+        """Apply changed, new and deleted documents to a KnowledgeBase; returns change counts."""
+        changes = {'files': 0, 'added': 0, 'updated': 0, 'removed': 0}
+        files = self.files()
+        for name, path in files.items():
+            try:
+                state = self._state(path)
+                if self.manifest.get(name) == state:
+                    continue
+                entries = chunk_entries(path, name)
+            except OSError as e:
+                logger.error("Error reading document %s: %s", path, e)
+                continue
+            result = knowledge.sync(entries, source=document_source(name))
+            self.manifest[name] = state
+            changes['files'] += 1
+            for key in ('added', 'updated', 'removed'):
+                changes[key] += result[key]
+            logger.info("Indexed %s chunks from %s", len(entries), path)
+        for name in [name for name in self.manifest if name not in files]:
+            result = knowledge.sync([], source=document_source(name))
+            del self.manifest[name]
+            changes['files'] += 1
+            changes['removed'] += result['removed']
+            logger.info("Removed document %s from the index", name)
+        return changes
+
+    def changed(self):
+        """True if any document was added, modified or deleted since the last sync."""
+        files = self.files()
+        if set(files) != set(self.manifest):
+            return True
+        for name, path in files.items():
+            try:
+                if self._state(path) != self.manifest[name]:
+                    return True
+            except OSError:
+                return True
+        return False
@@ -0,0 +1,162 @@
+import zlib
+from functools import lru_cache
+
+import numpy as np
+
+from matcher import WORD_RE
+from retrieval import top_k
+from text_processing import STOPWORDS
+
+# Corpora at least this large are searched through an IVF index in 'auto' mode
+DENSE_IVF_MIN_DOCS = 20000
+
+
+@lru_cache(maxsize=65536)
+def _word_features(word, dim, min_n, max_n):
+    """(buckets, signs) of a word and its character n-grams; cached since words repeat."""
+    features = [word]
+    padded = f"<{word}>"
+    for n in range(min_n, max_n + 1):
+        features.extend(padded[i:i + n] for i in range(len(padded) - n + 1))
+    buckets = []
+    signs = []
+    for feature in features:
+        hashed = zlib.crc32(feature.encode('utf-8'))
+        buckets.append(hashed % dim)
+        # Signed hashing makes colliding features cancel out on average instead of piling up
+        signs.append(1.0 if hashed & 0x80000000 else -1.0)
+    # The whole word carries as much of the vector's energy as all of its n-grams together
+    signs[0] *= max(1, len(features) - 1) ** 0.5
+    return tuple(buckets), tuple(signs)
+
+
+class HashedEmbedder:
+    """CPU-only text embeddings from hashed words and character n-grams.
+
+    Each content word and its n-grams ("<dapp>" gives "<da", "dap", ...)
+    are hashed into dim signed buckets, so inflections, compounds and typos
+    ("develop", "developer", "devlopment") land close together without a
+    vocabulary or a model download. Rows are L2-normalized float32, so a dot
+    product is the cosine similarity.
+    """
+    def __init__(self, dim=512, min_n=3, max_n=5, stop_words=STOPWORDS):
+        self.dim = dim
+        self.min_n = min_n
+        self.max_n = max_n
+        self.stop_words = stop_words
+
+    @property
+    def signature(self):
+        """Settings that must match for stored vectors to be reused."""
+        return {'kind': 'hashed', 'dim': self.dim, 'min_n': self.min_n, 'max_n': self.max_n}
+
+    def encode(self, texts):
+        """(len(texts), dim) float32 matrix of unit-length embeddings; empty texts give zero rows."""
+        rows = []
+        columns = []
+        values = []
+        for row, text in enumerate(texts):
+            for word in WORD_RE.findall(text.lower()):
+                if word in self.stop_words:
+                    continue
+                buckets, signs = _word_features(word, self.dim, self.min_n, self.max_n)
+                rows.extend([row] * len(buckets))
+                columns.extend(buckets)
+                values.extend(signs)
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        np.add.at(vectors, (np.array(rows, dtype=np.intp), np.array(columns, dtype=np.intp)),
+                  np.array(values, dtype=np.float32))
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0.0] = 1.0
+        vectors /= norms
+        return vectors
+
+
+class DenseIndex:
+    """Nearest-neighbour search over a contiguous float32 matrix of unit-length vectors.
+
+    Small corpora are scanned exactly with one matrix product per batch.
+    Large ones use an inverted-file (IVF) index: spherical k-means splits the
+    vectors into about 4*sqrt(n) clusters stored contiguously, and a query
+    only scores the clusters whose centroids are among its nprobe closest.
+    """
+    def __init__(self, vectors, kind='auto', nlist=None, nprobe=16, seed=0):
+        self.vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        if kind == 'auto':
+            kind = 'ivf' if len(self.vectors) >= DENSE_IVF_MIN_DOCS else 'exact'
+        if kind not in ('exact', 'ivf'):
+            raise ValueError(f"Unknown dense index: {kind}")
+        self.kind = kind
+        self.nprobe = nprobe
+        self.centroids = None
+        if kind == 'ivf' and len(self.vectors):
+            self._build_ivf(nlist or max(1, int(4 * np.sqrt(len(self.vectors)))), seed)
+
+    def __len__(self):
+        return len(self.vectors)
+
+    def _assign(self, vectors, centroids, chunk=8192):
+        """Index of the closest centroid for every vector, computed in bounded chunks."""
+        assignment = np.empty(len(vectors), dtype=np.intp)
+        for start in range(0, len(vectors), chunk):
+            assignment[start:start + chunk] = (vectors[start:start + chunk] @ centroids.T).argmax(axis=1)
+        return assignment
+
+    def _build_ivf(self, nlist, seed, iterations=10, sample_per_list=40):
+        rng = np.random.default_rng(seed)
+        vectors = self.vectors
+        nlist = min(nlist, len(vectors))
+        # Centroids are trained on a sample, as with faiss; every vector is assigned afterwards
+        sample = vectors
+        if len(vectors) > nlist * sample_per_list:
+            sample = vectors[np.sort(rng.choice(len(vectors), nlist * sample_per_list, replace=False))]
+        centroids = sample[rng.choice(len(sample), nlist, replace=False)].copy()
+        for _ in range(iterations):
+            assignment = self._assign(sample, centroids)
+            order = np.argsort(assignment, kind='stable')
+            counts = np.bincount(assignment, minlength=nlist)
+            starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+            sums = np.zeros_like(centroids)
+            present = counts > 0
+            sums[present] = np.add.reduceat(sample[order], starts[present], axis=0)
+            # Clusters that lost every vector restart from random vectors
+            sums[~present] = sample[rng.choice(len(sample), int((~present).sum()))]
+            norms = np.linalg.norm(sums, axis=1, keepdims=True)
+            norms[norms == 0.0] = 1.0
+            centroids = (sums / norms).astype(np.float32)
+        assignment = self._assign(vectors, centroids)
+
+        # Store each cluster's vectors contiguously; list_ids maps back to corpus positions
+        self.list_ids = np.argsort(assignment, kind='stable')
+        self.list_vectors = np.ascontiguousarray(vectors[self.list_ids])
+        self.list_offsets = np.searchsorted(assignment[self.list_ids], np.arange(nlist + 1))
+        self.centroids = centroids
+
+    def search_batch(self, query_vectors, k=1):
+        """Top-k (position, score) pairs for every row of a query matrix, best first."""
+        query_vectors = np.asarray(query_vectors, dtype=np.float32)
+        if not len(self.vectors):
+            return [[] for _ in range(len(query_vectors))]
+        if self.centroids is None:
+            scores = query_vectors @ self.vectors.T
+            return [[(int(i), float(row[i])) for i in top_k(row, k)] for row in scores]
+
+        nprobe = min(self.nprobe, len(self.centroids))
+        probes = np.argpartition(-(query_vectors @ self.centroids.T), nprobe - 1, axis=1)[:, :nprobe]
+        results = []
+        offsets = self.list_offsets
+        for query, lists in zip(query_vectors, probes):
+            # Each list is a contiguous block, so probing it is one slice and one product
+            ids = np.concatenate([self.list_ids[offsets[i]:offsets[i + 1]] for i in lists])
+            scores = np.concatenate([self.list_vectors[offsets[i]:offsets[i + 1]] @ query for i in lists])
+            best = top_k(scores, k)
+            results.append([(int(ids[i]), float(scores[i])) for i in best])
+        return results
+
+    def search(self, query_vector, k=1):
+        """Top-k (position, score) pairs for one query vector."""
+        return self.search_batch(np.asarray(query_vector).reshape(1, -1), k)[0]
+
+    def scores_for(self, query_vector, positions):
+        """Exact cosine scores of one query against the given corpus positions."""
+        return self.vectors[positions] @ np.asarray(query_vector, dtype=np.float32)
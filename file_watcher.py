@@ -0,0 +1,61 @@
+import logging
+import os
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class FileWatcher:
+    """Polls files for mtime changes and calls a callback from a daemon thread.
+
+    changed, if given, is also polled and any True result counts as a change;
+    it covers folders whose files come and go.
+    """
+    def __init__(self, paths, callback, interval=5.0, changed=None):
+        self.paths = [str(path) for path in paths]
+        self.callback = callback
+        self.changed = changed
+        self.interval = interval
+        self._mtimes = {path: self._mtime(path) for path in self.paths}
+        self._stopped = threading.Event()
+        self._thread = None
+
+    @staticmethod
+    def _mtime(path):
+        try:
+            return os.path.getmtime(path)
+        except OSError:
+            return None
+
+    def check(self):
+        """Call the callback once if any watched file changed; returns True if it did."""
+        changed = False
+        for path in self.paths:
+            mtime = self._mtime(path)
+            if mtime != self._mtimes[path]:
+                self._mtimes[path] = mtime
+                changed = True
+        if not changed and self.changed is not None:
+            try:
+                changed = self.changed()
+            except Exception as e:
+                logger.error("Error checking for file changes: %s", e)
+        if changed:
+            try:
+                self.callback()
+            except Exception as e:
+                logger.error("Error reloading after file change: %s", e)
+        return changed
+
+    def start(self):
+        """Start polling in the background."""
+        def run():
+            while not self._stopped.wait(self.interval):
+                self.check()
+
+        self._thread = threading.Thread(target=run, name='file-watcher', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
@@ -0,0 +1,188 @@
+import hashlib
+import json
+import logging
+import os
+import struct
+import sys
+
+import numpy as np
+import scipy.sparse as sp
+
+from embeddings import HashedEmbedder
+from knowledge_base import KnowledgeIndex
+from response_tags import ResponseTags
+
+logger = logging.getLogger(__name__)
+
+# File layout: MAGIC, format version (uint32), header length (uint64), JSON
+# header, then the raw arrays, each starting on an ALIGNMENT byte boundary
+MAGIC = b'APHATORIDX'
+ARTIFACT_VERSION = 1
+ALIGNMENT = 64
+PREAMBLE = struct.Struct('<IQ')
+
+
+def source_hash(paths):
+    """SHA-256 over the contents of the data files an artifact was built from."""
+    digest = hashlib.sha256()
+    for path in paths:
+        digest.update(os.path.basename(str(path)).encode('utf-8') + b'\0')
+        try:
+            with open(path, 'rb') as f:
+                for block in iter(lambda: f.read(1 << 20), b''):
+                    digest.update(block)
+        except FileNotFoundError:
+            digest.update(b'<missing>')
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+def _csr_arrays(prefix, matrix):
+    # One index dtype for indices and indptr, so scipy wraps the mapped arrays without casting
+    index_dtype = np.int32 if max(matrix.nnz, matrix.shape[0], matrix.shape[1]) < 2 ** 31 else np.int64
+    return {
+        f"{prefix}_data": np.asarray(matrix.data, dtype=np.float64),
+        f"{prefix}_indices": np.asarray(matrix.indices, dtype=index_dtype),
+        f"{prefix}_indptr": np.asarray(matrix.indptr, dtype=index_dtype),
+    }
+
+
+def write_artifact(path, index, data_hash, metadata=None):
+    """Atomically write a KnowledgeIndex to a memory-mappable artifact file."""
+    n_terms = len(index.idf)
+    terms = [None] * n_terms
+    for term, column in index.vocabulary.items():
+        if column < n_terms:
+            terms[column] = term
+    term_doc = index.matrix.T.tocsr()
+    term_doc.sort_indices()
+
+    arrays = {'idf': np.asarray(index.idf, dtype=np.float64)}
+    arrays.update(_csr_arrays('matrix', index.matrix))
+    arrays.update(_csr_arrays('term_doc', term_doc))
+    if index.dense is not None:
+        # Reused by dense and hybrid loads with the same embedder settings
+        arrays['dense'] = index.dense.vectors
+    # Entries share a few distinct tag sets, stored once and referenced by number
+    tag_sets = {}
+    tag_ids = [tag_sets.setdefault(tags, len(tag_sets)) for tags in index.tags]
+
+    layout = {}
+    offset = 0
+    for name, array in arrays.items():
+        offset = -(-offset // ALIGNMENT) * ALIGNMENT
+        layout[name] = {'dtype': array.dtype.str, 'shape': list(array.shape), 'offset': offset}
+        offset += array.nbytes
+
+    header = {
+        'source_hash': data_hash,
+        'version': index.version,
+        'snapshot_id': index.snapshot_id,
+        'shape': list(index.matrix.shape),
+        'terms': terms,
+        'ids': index.ids,
+        'kinds': index.kinds,
+        'corpus': index.corpus,
+        'responses': index.responses,
+        'tag_sets': [tags.to_json() if tags is not None else None for tags in tag_sets],
+        'tag_ids': tag_ids,
+        'metadata': metadata or {},
+        'embedder': index.embedder.signature if index.dense is not None else None,
+        'arrays': layout
+    }
+    header_bytes = json.dumps(header).encode('utf-8')
+    data_start = -(-(len(MAGIC) + PREAMBLE.size + len(header_bytes)) // ALIGNMENT) * ALIGNMENT
+
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(MAGIC)
+        f.write(PREAMBLE.pack(ARTIFACT_VERSION, len(header_bytes)))
+        f.write(header_bytes)
+        for name, array in arrays.items():
+            f.write(b'\0' * (data_start + layout[name]['offset'] - f.tell()))
+            f.write(np.ascontiguousarray(array).tobytes())
+    os.replace(tmp_path, path)
+    logger.info("Wrote index artifact %s with %s entries", path, len(index))
+
+
+def read_header(path):
+    """Return (header dict, byte offset of the array section) for an artifact file."""
+    with open(path, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not an index artifact")
+        version, header_length = PREAMBLE.unpack(f.read(PREAMBLE.size))
+        if version != ARTIFACT_VERSION:
+            raise ValueError(f"{path} has unsupported artifact version {version}")
+        header = json.loads(f.read(header_length).decode('utf-8'))
+    data_start = -(-(len(MAGIC) + PREAMBLE.size + header_length) // ALIGNMENT) * ALIGNMENT
+    return header, data_start
+
+
+def load_artifact(path, data_hash=None, retrieval_index='auto', retrieval_mode='tfidf', embedder=None,
+                  tags_from_json=None):
+    """Memory-map an artifact as a KnowledgeIndex.
+
+    Returns (index, metadata), or (None, None) if the file is missing,
+    unreadable or was built from data whose hash differs from data_hash.
+    The arrays are read-only mappings of the file, so every worker process
+    shares the same physical pages through the OS page cache. Dense vectors
+    are mapped too when the artifact has them for the same embedder
+    settings; otherwise a dense or hybrid index embeds the corpus on load.
+    Stored response tags are rebuilt with tags_from_json (ResponseTags by
+    default).
+    """
+    if not os.path.exists(path):
+        return None, None
+    try:
+        header, data_start = read_header(path)
+        if data_hash is not None and header['source_hash'] != data_hash:
+            logger.warning("Index artifact %s is stale; rebuilding from the data files", path)
+            return None, None
+
+        arrays = {}
+        for name, spec in header['arrays'].items():
+            shape = tuple(spec['shape'])
+            if shape[0] == 0:
+                arrays[name] = np.empty(shape, dtype=np.dtype(spec['dtype']))
+                continue
+            arrays[name] = np.memmap(path, dtype=np.dtype(spec['dtype']), mode='r',
+                                     offset=data_start + spec['offset'], shape=shape)
+
+        n_documents, n_terms = header['shape']
+        matrix = sp.csr_matrix((arrays['matrix_data'], arrays['matrix_indices'], arrays['matrix_indptr']),
+                               shape=(n_documents, n_terms), copy=False)
+        term_doc = sp.csr_matrix((arrays['term_doc_data'], arrays['term_doc_indices'], arrays['term_doc_indptr']),
+                                 shape=(n_terms, n_documents), copy=False)
+        term_doc.has_sorted_indices = True
+        vocabulary = {term: column for column, term in enumerate(header['terms']) if term is not None}
+        dense_vectors = None
+        if retrieval_mode != 'tfidf':
+            embedder = embedder or HashedEmbedder()
+            if 'dense' in arrays and header.get('embedder') == embedder.signature:
+                dense_vectors = arrays['dense']
+        tags = None
+        if 'tag_sets' in header:
+            tags_from_json = tags_from_json or ResponseTags.from_json
+            tag_sets = [tags_from_json(value) if value is not None else None for value in header['tag_sets']]
+            tags = [tag_sets[tag_id] for tag_id in header['tag_ids']]
+        index = KnowledgeIndex(
+            header['version'], header['ids'], header['kinds'], header['corpus'], header['responses'],
+            vocabulary, arrays['idf'], matrix, retrieval_index, term_doc=term_doc,
+            retrieval_mode=retrieval_mode, embedder=embedder, dense_vectors=dense_vectors,
+            tags=tags,
+            # Artifacts written before snapshot ids were stored are identified by their contents
+            snapshot_id=header.get('snapshot_id') or f"{header['source_hash']}:{header['version']}"
+        )
+    except Exception as e:
+        logger.error("Error loading index artifact %s: %s", path, e)
+        return None, None
+    logger.info("Memory-mapped index artifact %s with %s entries", path, len(index))
+    return index, header['metadata']
+
+
+if __name__ == '__main__':
+    # Build step: python index_artifact.py [output path]; RETRIEVAL_MODE=dense or hybrid also stores embeddings
+    logging.basicConfig(level=logging.INFO)
+    from chatbot import AphatorChatbot, DEFAULT_INDEX_ARTIFACT
+    output = sys.argv[1] if len(sys.argv) > 1 else str(DEFAULT_INDEX_ARTIFACT)
+    AphatorChatbot(retrieval_mode=os.environ.get('RETRIEVAL_MODE', 'tfidf')).build_index_artifact(output)
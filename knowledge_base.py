@@ -0,0 +1,444 @@
+import logging
+import mmap
+import re
+import sys
+import threading
+import uuid
+from collections import Counter, namedtuple
+
+import numpy as np
+import scipy.sparse as sp
+
+from embeddings import DenseIndex, HashedEmbedder
+from retrieval import build_index, l2_normalize_rows, top_k
+
+logger = logging.getLogger(__name__)
+
+# Same analyzer as sklearn's TfidfVectorizer defaults: lowercase, words of 2+ characters
+TOKEN_RE = re.compile(r"(?u)\b\w\w+\b")
+
+# One retrieval result, carrying the response and its tags from the snapshot that produced it
+Match = namedtuple('Match', ['position', 'score', 'entry_id', 'response', 'tags', 'confidence'])
+
+# How queries are scored: TF-IDF cosine, dense embedding cosine, or a weighted blend of both
+RETRIEVAL_MODES = ('tfidf', 'dense', 'hybrid')
+
+# Hybrid mode rescores the union of this many best candidates from each side
+HYBRID_CANDIDATES = 20
+
+# Logistic calibration per retrieval mode: (score weight, margin weight, bias), where the
+# margin is a candidate's lead over the best other candidate. Fitted on generated queries
+# with benchmarks/calibrate_confidence.py; rerun it after changing the scoring
+CONFIDENCE_CALIBRATION = {
+    'tfidf': (5.170, 4.035, -2.795),
+    'dense': (3.820, 7.993, -2.649),
+    'hybrid': (4.987, 6.496, -2.871)
+}
+
+
+def _is_mapped(array):
+    """Whether an array's memory comes from a memory-mapped file."""
+    while array is not None:
+        if isinstance(array, (np.memmap, mmap.mmap)):
+            return True
+        array = getattr(array, 'base', None)
+    return False
+
+
+# Candidates always scored per query, so the best match's margin over the runner-up,
+# and with it its confidence, doesn't depend on how many matches were asked for
+MARGIN_CANDIDATES = 2
+
+
+def candidate_margins(scores):
+    """Each candidate's score minus the best score among the other candidates of its query.
+
+    scores is a (queries, k) array sorted best first, with missing candidates
+    scored zero; k must be at least 2 for the best candidate's margin to be
+    its lead over the runner-up.
+    """
+    best = scores[:, :1]
+    runner_up = scores[:, 1:2] if scores.shape[1] > 1 else np.zeros_like(best)
+    margins = scores - best
+    margins[:, :1] = best - runner_up
+    return margins
+
+
+def calibrated_confidence(scores, weights):
+    """Probability that each candidate answers its query, for a (queries, k) array of scores sorted best first."""
+    score_weight, margin_weight, bias = weights
+    return 1.0 / (1.0 + np.exp(-(score_weight * scores + margin_weight * candidate_margins(scores) + bias)))
+
+
+def _strings_size(strings):
+    """Bytes held by a list of strings, including the list itself."""
+    return sys.getsizeof(strings) + sum(sys.getsizeof(string) for string in strings)
+
+
+class KnowledgeEntry:
+    """A corpus entry: the text matched against queries and the response it answers with."""
+    __slots__ = ('id', 'kind', 'text', 'response', 'source', 'columns', 'counts', 'vector', 'tags')
+
+    def __init__(self, entry_id, kind, text, response, source, columns, counts, tags=None):
+        self.id = entry_id
+        self.kind = kind
+        self.text = text
+        self.response = response
+        self.source = source
+        self.columns = columns
+        self.counts = counts
+        # Dense embedding of the text, computed at the first publish that needs it
+        self.vector = None
+        # Tags of the response, computed once when the entry is added or its response changes
+        self.tags = tags
+
+
+class KnowledgeIndex:
+    """Immutable, query-ready snapshot of the knowledge base.
+
+    Requests read self.index once and use that snapshot throughout, so a swap
+    to a newer version never shows them a half-built state. With a 'dense'
+    or 'hybrid' retrieval_mode the corpus is also embedded (dense_vectors
+    when they were precomputed) and searched through a DenseIndex; hybrid
+    scores are hybrid_weight * TF-IDF + (1 - hybrid_weight) * dense cosine.
+    tags holds each entry's response tags (or None), returned with its matches
+    so responses are never rescanned per request; every match also carries a
+    confidence calibrated with CONFIDENCE_CALIBRATION for the retrieval mode.
+    version counts publishes within one knowledge base; snapshot_id identifies
+    the snapshot across processes (an index artifact keeps the one it was
+    written from), so results computed elsewhere can be matched to it.
+    """
+    def __init__(self, version, ids, kinds, corpus, responses, vocabulary, idf, matrix,
+                 retrieval_index='auto', term_doc=None, retrieval_mode='tfidf', embedder=None,
+                 dense_vectors=None, hybrid_weight=0.5, tags=None, snapshot_id=None):
+        if retrieval_mode not in RETRIEVAL_MODES:
+            raise ValueError(f"Unknown retrieval mode: {retrieval_mode}")
+        self.version = version
+        self.snapshot_id = snapshot_id or uuid.uuid4().hex
+        self.ids = ids
+        self.kinds = kinds
+        self.corpus = corpus
+        self.responses = responses
+        self.tags = tags if tags is not None else [None] * len(ids)
+        self._positions = None
+        # The vocabulary dict is shared with the builder and only ever grows;
+        # columns beyond this snapshot's IDF vector are ignored
+        self.vocabulary = vocabulary
+        self.idf = idf
+        self.matrix = matrix
+        self.retrieval = build_index(matrix, retrieval_index, term_doc=term_doc) if ids else None
+        self.retrieval_mode = retrieval_mode
+        self.hybrid_weight = hybrid_weight
+        self.calibration = CONFIDENCE_CALIBRATION[retrieval_mode]
+        self.embedder = None
+        self.dense = None
+        if retrieval_mode != 'tfidf':
+            self.embedder = embedder or HashedEmbedder()
+            if ids:
+                self.dense = DenseIndex(dense_vectors if dense_vectors is not None else self.embedder.encode(corpus))
+
+    def __len__(self):
+        return len(self.ids)
+
+    def position(self, entry_id):
+        """Position of an entry in this snapshot, or None; the lookup table is built on first use."""
+        positions = self._positions
+        if positions is None:
+            positions = self._positions = {entry_id: position for position, entry_id in enumerate(self.ids)}
+        return positions.get(entry_id)
+
+    def memory_usage(self):
+        """Estimated (heap bytes, memory-mapped bytes) of the arrays, texts and vocabulary."""
+        arrays = [self.idf, self.matrix.data, self.matrix.indices, self.matrix.indptr]
+        if self.retrieval is not None:
+            term_doc = self.retrieval.term_doc
+            arrays += [term_doc.data, term_doc.indices, term_doc.indptr, getattr(self.retrieval, 'max_weights', None)]
+        if self.dense is not None:
+            arrays += [self.dense.vectors, getattr(self.dense, 'list_vectors', None), self.dense.centroids]
+        heap = mapped = 0
+        seen = set()
+        for array in arrays:
+            if array is None or id(array) in seen:
+                continue
+            seen.add(id(array))
+            if _is_mapped(array):
+                mapped += array.nbytes
+            else:
+                heap += array.nbytes
+        heap += _strings_size(self.ids) + _strings_size(self.corpus) + _strings_size(self.responses)
+        # Tags are shared between entries, so only the list is counted
+        heap += sys.getsizeof(self.tags)
+        if self._positions is not None:
+            heap += sys.getsizeof(self._positions)
+        # The vocabulary dict may be shared with the KnowledgeBase; it is counted here only
+        heap += sys.getsizeof(self.vocabulary) + sum(sys.getsizeof(term) for term in self.vocabulary)
+        return heap, mapped
+
+    def transform(self, texts):
+        """L2-normalized TF-IDF query matrix, equivalent to TfidfVectorizer.transform."""
+        n_terms = len(self.idf)
+        indptr = [0]
+        indices = []
+        data = []
+        for text in texts:
+            counts = Counter(TOKEN_RE.findall(text.lower()))
+            for term, count in counts.items():
+                column = self.vocabulary.get(term)
+                if column is not None and column < n_terms and self.idf[column] > 0:
+                    indices.append(column)
+                    data.append(count * self.idf[column])
+            indptr.append(len(indices))
+        queries = sp.csr_matrix((np.array(data, dtype=np.float64), np.array(indices, dtype=np.int32), np.array(indptr)),
+                                shape=(len(texts), n_terms))
+        return l2_normalize_rows(queries)
+
+    def search(self, text, k=1):
+        """Top-k Match results for one preprocessed query text."""
+        if self.retrieval is None:
+            return []
+        if self.retrieval_mode == 'tfidf':
+            return self._matches([self.retrieval.search(self.transform([text]), k=max(k, MARGIN_CANDIDATES))], k)[0]
+        return self.search_batch([text], k=k)[0]
+
+    def search_batch(self, texts, k=1):
+        """Top-k Match results for each preprocessed query text."""
+        if self.retrieval is None:
+            return [[] for _ in texts]
+        depth = max(k, MARGIN_CANDIDATES)
+        if self.retrieval_mode == 'tfidf':
+            results = self.retrieval.search_batch(self.transform(texts), k=depth)
+        elif self.retrieval_mode == 'dense':
+            results = self.dense.search_batch(self.embedder.encode(texts), k=depth)
+        else:
+            results = self._hybrid_search(texts, depth)
+        return self._matches(results, k)
+
+    def _hybrid_search(self, texts, k):
+        """Blend TF-IDF and dense cosine scores over the best candidates of either."""
+        sparse_queries = self.transform(texts)
+        dense_queries = self.embedder.encode(texts)
+        candidates = max(k, HYBRID_CANDIDATES)
+        sparse_results = self.retrieval.search_batch(sparse_queries, k=candidates)
+        dense_results = self.dense.search_batch(dense_queries, k=candidates)
+        # Score every query against the union of all candidates with one product per side
+        row_candidates = [sorted({position for position, _ in sparse_result} | {position for position, _ in dense_result})
+                          for sparse_result, dense_result in zip(sparse_results, dense_results)]
+        union = np.array(sorted(set().union(*row_candidates)), dtype=np.intp)
+        sparse_scores = (sparse_queries @ self.matrix[union].T).toarray()
+        dense_scores = dense_queries @ self.dense.vectors[union].T
+        scores = self.hybrid_weight * sparse_scores + (1.0 - self.hybrid_weight) * dense_scores
+        results = []
+        for row, positions in enumerate(row_candidates):
+            columns = np.searchsorted(union, positions)
+            row_scores = scores[row, columns]
+            results.append([(int(positions[i]), float(row_scores[i])) for i in top_k(row_scores, k)])
+        return results
+
+    def _matches(self, results, k):
+        """The top-k Match lists for (position, score) result lists, calibrating every candidate's confidence at once.
+
+        results hold at least MARGIN_CANDIDATES candidates per query where
+        the corpus has them, so confidences are the same for every k.
+        """
+        width = max((len(result) for result in results), default=0)
+        if not width:
+            return [[] for _ in results]
+        scores = np.zeros((len(results), width))
+        for row, result in enumerate(results):
+            scores[row, :len(result)] = [score for _, score in result]
+        confidences = calibrated_confidence(scores, self.calibration).tolist()
+        return [[Match(position, score, self.ids[position], self.responses[position], self.tags[position],
+                       confidence)
+                 for (position, score), confidence in zip(result[:k], row_confidences)]
+                for result, row_confidences in zip(results, confidences)]
+
+
+class KnowledgeBase:
+    """Mutable TF-IDF knowledge base that publishes immutable KnowledgeIndex snapshots.
+
+    Adding, updating or removing an entry only tokenizes that entry and
+    adjusts the vocabulary and document frequencies. IDF weights are
+    recomputed lazily when a new snapshot is published, and the corpus matrix
+    is then reassembled from the stored term counts in one vectorized pass
+    instead of refitting a vectorizer. Weights follow TfidfVectorizer's
+    defaults (smooth IDF, L2 norm), so scores match a full refit. Only
+    tokenizing, embedding and tagging scale with the size of a change: since
+    any change alters N and thereby every IDF weight and row norm, publishing
+    still rebuilds the IDF vector, the matrix, its term-document transpose and
+    the dense stack for the whole corpus, which is O(nnz) per publish. tagger, if
+    given, maps a response to its tags when an entry is added or its
+    response changes.
+    """
+    def __init__(self, retrieval_index='auto', retrieval_mode='tfidf', embedder=None, hybrid_weight=0.5,
+                 tagger=None):
+        if retrieval_mode not in RETRIEVAL_MODES:
+            raise ValueError(f"Unknown retrieval mode: {retrieval_mode}")
+        self.retrieval_index = retrieval_index
+        self.retrieval_mode = retrieval_mode
+        self.embedder = embedder or (HashedEmbedder() if retrieval_mode != 'tfidf' else None)
+        self.hybrid_weight = hybrid_weight
+        self.tagger = tagger
+        self.vocabulary = {}
+        self.document_frequency = []
+        self.entries = {}
+        self.index = None
+        self.version = 0
+        self._dirty = True
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def memory_usage(self):
+        """Estimated heap bytes of the per-entry term counts; texts are shared with the published index."""
+        with self._lock:
+            entry_size = sys.getsizeof(next(iter(self.entries.values()))) if self.entries else 0
+            return (sys.getsizeof(self.entries) + sys.getsizeof(self.document_frequency) +
+                    sum(entry_size + entry.columns.nbytes + entry.counts.nbytes +
+                        (entry.vector.nbytes if entry.vector is not None else 0)
+                        for entry in self.entries.values()))
+
+    def upsert(self, entry_id, kind, text, response, source='file'):
+        """Add or replace an entry; returns True if anything changed."""
+        with self._lock:
+            current = self.entries.get(entry_id)
+            if current is not None:
+                if current.text == text and current.response == response and current.kind == kind:
+                    current.source = source
+                    return False
+                if current.text == text:
+                    # Same terms, so the statistics and embedding are unchanged
+                    current.kind = kind
+                    if current.response != response:
+                        current.tags = self._tag(response)
+                    current.response = response
+                    current.source = source
+                    self._dirty = True
+                    return True
+                self._forget_terms(current)
+
+            columns, counts = self._analyze(text)
+            # Reassigning an existing key keeps the entry's position in the corpus
+            tags = current.tags if current is not None and current.response == response else self._tag(response)
+            self.entries[entry_id] = KnowledgeEntry(entry_id, kind, text, response, source, columns, counts, tags)
+            self._dirty = True
+            return True
+
+    def remove(self, entry_id):
+        """Remove an entry; returns True if it existed."""
+        with self._lock:
+            entry = self.entries.pop(entry_id, None)
+            if entry is None:
+                return False
+            self._forget_terms(entry)
+            self._dirty = True
+            return True
+
+    def sync(self, entries, source='file'):
+        """Make the entries from one source match the given list of (id, kind, text, response).
+
+        Only entries that were added, changed or dropped are touched; entries
+        from other sources (e.g. each documentation file) are left alone.
+        """
+        with self._lock:
+            seen = set()
+            added = updated = removed = 0
+            for entry_id, kind, text, response in entries:
+                seen.add(entry_id)
+                existed = entry_id in self.entries
+                if self.upsert(entry_id, kind, text, response, source=source):
+                    if existed:
+                        updated += 1
+                    else:
+                        added += 1
+            for entry_id in [entry.id for entry in self.entries.values() if entry.source == source and entry.id not in seen]:
+                self.remove(entry_id)
+                removed += 1
+            return {'added': added, 'updated': updated, 'removed': removed}
+
+    def publish(self):
+        """Return the current snapshot, building a new one first if entries changed."""
+        with self._lock:
+            if not self._dirty and self.index is not None:
+                return self.index
+            entries = list(self.entries.values())
+            idf = self._idf(len(entries))
+            matrix = self._matrix(entries, idf)
+            self.version += 1
+            self.index = KnowledgeIndex(
+                self.version,
+                [entry.id for entry in entries],
+                [entry.kind for entry in entries],
+                [entry.text for entry in entries],
+                [entry.response for entry in entries],
+                self.vocabulary, idf, matrix, self.retrieval_index,
+                retrieval_mode=self.retrieval_mode, embedder=self.embedder,
+                dense_vectors=self._dense_vectors(entries), hybrid_weight=self.hybrid_weight,
+                tags=[entry.tags for entry in entries]
+            )
+            self._dirty = False
+            logger.info("Published knowledge base version %s with %s entries", self.version, len(entries))
+            return self.index
+
+    def retag(self):
+        """Recompute every entry's tags, e.g. after the tagger's keyword tables changed."""
+        with self._lock:
+            for entry in self.entries.values():
+                entry.tags = self._tag(entry.response)
+
+    def _tag(self, response):
+        return self.tagger(response) if self.tagger is not None else None
+
+    def _dense_vectors(self, entries):
+        """Contiguous float32 embedding matrix, encoding only entries added or changed since the last publish."""
+        if self.embedder is None:
+            return None
+        missing = [entry for entry in entries if entry.vector is None]
+        if missing:
+            for entry, vector in zip(missing, self.embedder.encode([entry.text for entry in missing])):
+                entry.vector = vector
+        if not entries:
+            return np.empty((0, self.embedder.dim), dtype=np.float32)
+        return np.stack([entry.vector for entry in entries])
+
+    def _analyze(self, text):
+        """Term columns and counts for a text, registering new terms and document frequencies."""
+        counts = Counter(TOKEN_RE.findall(text.lower()))
+        columns = np.empty(len(counts), dtype=np.int32)
+        values = np.empty(len(counts), dtype=np.float64)
+        for i, (term, count) in enumerate(counts.items()):
+            column = self.vocabulary.get(term)
+            if column is None:
+                column = len(self.document_frequency)
+                self.document_frequency.append(0)
+                self.vocabulary[term] = column
+            self.document_frequency[column] += 1
+            columns[i] = column
+            values[i] = count
+        return columns, values
+
+    def _forget_terms(self, entry):
+        for column in entry.columns.tolist():
+            self.document_frequency[column] -= 1
+
+    def _idf(self, n_documents):
+        """Smoothed IDF per column; zero marks terms no entry contains anymore."""
+        document_frequency = np.array(self.document_frequency, dtype=np.float64)
+        idf = np.zeros(len(document_frequency))
+        present = document_frequency > 0
+        idf[present] = np.log((1 + n_documents) / (1 + document_frequency[present])) + 1
+        return idf
+
+    def _matrix(self, entries, idf):
+        """L2-normalized TF-IDF matrix assembled from the stored term counts."""
+        indptr = np.zeros(len(entries) + 1, dtype=np.int64)
+        if entries:
+            np.cumsum([len(entry.columns) for entry in entries], out=indptr[1:])
+            indices = np.concatenate([entry.columns for entry in entries])
+            data = np.concatenate([entry.counts for entry in entries])
+        else:
+            indices = np.empty(0, dtype=np.int32)
+            data = np.empty(0, dtype=np.float64)
+        matrix = sp.csr_matrix((data * idf[indices], indices, indptr), shape=(len(entries), len(idf)))
+        return l2_normalize_rows(matrix)
+
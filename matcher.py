@@ -0,0 +1,127 @@
+import re
+
+# Words are runs of letters/digits, so "don't" tokenizes as "don" "t" both in
+# patterns and in input, and a pattern can never match inside a longer word
+WORD_RE = re.compile(r'\w+')
+
+
+class MatchResult:
+    """Every label matched in one message, with the character spans that matched."""
+    __slots__ = ('spans',)
+
+    def __init__(self):
+        self.spans = {}
+
+    def add(self, label, start, end):
+        self.spans.setdefault(label, []).append((start, end))
+
+    def has(self, label):
+        """Check if any pattern with this label matched."""
+        return label in self.spans
+
+    def count(self, label):
+        """Number of times patterns with this label matched."""
+        return len(self.spans.get(label, ()))
+
+    def first(self, labels):
+        """Return the first label from an ordered list that matched, or None."""
+        for label in labels:
+            if label in self.spans:
+                return label
+        return None
+
+    def __contains__(self, label):
+        return label in self.spans
+
+    def __repr__(self):
+        return f"MatchResult({self.spans!r})"
+
+
+class KeywordMatcher:
+    """Aho-Corasick automaton over words for matching many phrase patterns in one pass.
+
+    Patterns are phrases of one or more words and only match on whole-word
+    boundaries, so "hi" matches "hi there" but not "this". A trailing plural
+    "s" on the last word is accepted ("app" matches "apps"). Matching walks the
+    input's words once, so its cost depends on the input length and the number
+    of matches, not on how many patterns are registered.
+    """
+    def __init__(self, allow_plurals=True):
+        self.allow_plurals = allow_plurals
+        self._goto = [{}]
+        self._fail = [0]
+        self._output = [[]]
+        self._built = False
+
+    def add(self, pattern, label):
+        """Register a phrase pattern under a label."""
+        words = WORD_RE.findall(pattern.lower())
+        if not words:
+            return
+        self._add_words(words, label)
+        if self.allow_plurals and not words[-1].endswith('s'):
+            self._add_words(words[:-1] + [words[-1] + 's'], label)
+        self._built = False
+
+    def add_group(self, label, patterns):
+        """Register several phrase patterns under the same label."""
+        for pattern in patterns:
+            self.add(pattern, label)
+
+    def _add_words(self, words, label):
+        node = 0
+        for word in words:
+            next_node = self._goto[node].get(word)
+            if next_node is None:
+                next_node = len(self._goto)
+                self._goto[node][word] = next_node
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append([])
+            node = next_node
+        output = (label, len(words))
+        if output not in self._output[node]:
+            self._output[node].append(output)
+
+    def build(self):
+        """Compute failure links; called automatically before the first match."""
+        queue = list(self._goto[0].values())
+        for node in queue:
+            self._fail[node] = 0
+        head = 0
+        while head < len(queue):
+            node = queue[head]
+            head += 1
+            for word, child in self._goto[node].items():
+                queue.append(child)
+                fallback = self._fail[node]
+                while fallback and word not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[child] = self._goto[fallback].get(word, 0)
+                self._output[child].extend(
+                    output for output in self._output[self._fail[child]]
+                    if output not in self._output[child]
+                )
+        self._built = True
+        return self
+
+    def match(self, text, lowered=False):
+        """Return a MatchResult with every label whose patterns occur in text.
+
+        Pass lowered=True when text is already lowercase to skip the copy.
+        """
+        if not self._built:
+            self.build()
+        goto, fail, outputs = self._goto, self._fail, self._output
+        result = MatchResult()
+        starts = []
+        node = 0
+        for word_match in WORD_RE.finditer(text if lowered else text.lower()):
+            word = word_match.group()
+            starts.append(word_match.start())
+            while node and word not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(word, 0)
+            for label, length in outputs[node]:
+                result.add(label, starts[-length], word_match.end())
+        return result
@@ -0,0 +1,180 @@
+import threading
+from collections import Counter
+from time import perf_counter_ns
+
+# Histogram bucket upper bounds in seconds, from 1us up to 1s
+DEFAULT_BUCKETS = (
+    1e-6, 2.5e-6, 5e-6, 1e-5, 2.5e-5, 5e-5, 1e-4, 2.5e-4, 5e-4,
+    1e-3, 2.5e-3, 5e-3, 1e-2, 2.5e-2, 5e-2, 0.1, 0.25, 0.5, 1.0
+)
+
+# Observations are buffered and bucketed in vectorized batches of this size
+FOLD_SIZE = 4096
+
+
+class Histogram:
+    """Latency histogram kept in integer nanoseconds; rendered in seconds.
+
+    Observing only appends to a buffer; buffered values are bucketed with
+    one searchsorted/bincount per FOLD_SIZE values or when read. Not
+    synchronized itself; Metrics updates and reads it under its own lock.
+    """
+    __slots__ = ('buckets', 'bounds_ns', 'counts', 'sum_ns', 'count', 'pending')
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.bounds_ns = [int(bound * 1e9) for bound in self.buckets]
+        # One slot per bucket plus the +Inf overflow; not cumulative until rendered
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum_ns = 0
+        self.count = 0
+        self.pending = []
+
+    def observe_ns(self, value_ns):
+        pending = self.pending
+        pending.append(value_ns)
+        if len(pending) >= FOLD_SIZE:
+            self.fold()
+
+    def fold(self):
+        """Bucket the buffered observations."""
+        if not self.pending:
+            return
+        # Imported here so enabling metrics doesn't load numpy at startup
+        import numpy as np
+        values = np.array(self.pending, dtype=np.int64)
+        self.pending = []
+        # side='left' puts a value equal to a bound in that bound's bucket (le semantics)
+        slots = np.searchsorted(self.bounds_ns, values, side='left')
+        for slot, count in enumerate(np.bincount(slots, minlength=len(self.counts)).tolist()):
+            self.counts[slot] += count
+        self.sum_ns += int(values.sum())
+        self.count += len(values)
+
+    def snapshot(self):
+        """Return (cumulative bucket counts including +Inf, sum in seconds, count)."""
+        self.fold()
+        cumulative = []
+        total = 0
+        for count in self.counts:
+            total += count
+            cumulative.append(total)
+        return cumulative, self.sum_ns / 1e9, self.count
+
+
+class StageTimer:
+    """Times consecutive stages of one request: each lap() closes the stage since the previous one.
+
+    Laps only read the clock and append to a list; the histograms are
+    updated once per request in finish(), under a single lock.
+    """
+    __slots__ = ('metrics', 'started', 'laps', 'branch')
+
+    def __init__(self, metrics):
+        self.metrics = metrics
+        self.started = perf_counter_ns()
+        self.laps = []
+        # Pipeline branch that produced the answer, set once it is known
+        self.branch = None
+
+    def lap(self, stage):
+        self.laps.append((stage, perf_counter_ns()))
+
+    def finish(self):
+        """Record the stages, the whole request and the branch that produced the answer."""
+        self.metrics.record(self.started, self.laps, perf_counter_ns(), self.branch)
+
+
+class Metrics:
+    """Per-stage latency histograms and answer-branch counters for the response pipeline.
+
+    A chatbot without a Metrics object skips all of this; with one, each
+    stage costs a clock read and a list append, and recording a request's
+    laps appends each one to its histogram's buffer, which is bucketed in
+    one vectorized pass per FOLD_SIZE values.
+    """
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.stages = {}
+        self.requests = Histogram(buckets)
+        self.branches = Counter()
+        self._lock = threading.Lock()
+
+    def timer(self):
+        """Start timing one request."""
+        return StageTimer(self)
+
+    def record(self, started, laps, finished, branch):
+        """Add one request's stage laps, total time and answer branch."""
+        stages = self.stages
+        with self._lock:
+            previous = started
+            for stage, timestamp in laps:
+                histogram = stages.get(stage)
+                if histogram is None:
+                    histogram = stages[stage] = Histogram(self.buckets)
+                # Inlined observe_ns; this loop runs for every stage of every request
+                pending = histogram.pending
+                pending.append(timestamp - previous)
+                if len(pending) >= FOLD_SIZE:
+                    histogram.fold()
+                previous = timestamp
+            self.requests.observe_ns(finished - started)
+            if branch is not None:
+                self.branches[branch] += 1
+
+    def render(self, caches=None, gauges=None, counters=None):
+        """Prometheus text exposition of the metrics.
+
+        caches maps a cache name to its ResponseCache.stats(); gauges and
+        counters map extra metric names to (help text, value).
+        """
+        lines = []
+        with self._lock:
+            stages = {name: histogram.snapshot() for name, histogram in self.stages.items()}
+            requests = self.requests.snapshot()
+            branches = sorted(self.branches.items())
+
+        lines.append('# HELP aphator_stage_seconds Time spent in each response pipeline stage.')
+        lines.append('# TYPE aphator_stage_seconds histogram')
+        for name in sorted(stages):
+            self._render_histogram(lines, 'aphator_stage_seconds', stages[name], f'stage="{name}"')
+
+        lines.append('# HELP aphator_response_seconds Time to produce a response, end to end.')
+        lines.append('# TYPE aphator_response_seconds histogram')
+        self._render_histogram(lines, 'aphator_response_seconds', requests, '')
+
+        lines.append('# HELP aphator_responses_total Responses by the pipeline branch that produced them.')
+        lines.append('# TYPE aphator_responses_total counter')
+        for branch, count in branches:
+            lines.append(f'aphator_responses_total{{branch="{branch}"}} {count}')
+
+        if caches:
+            for metric, key, kind, help_text in (
+                ('aphator_cache_hits_total', 'hits', 'counter', 'Cache lookups that found an entry.'),
+                ('aphator_cache_misses_total', 'misses', 'counter', 'Cache lookups that found nothing.'),
+                ('aphator_cache_evictions_total', 'evictions', 'counter', 'Entries evicted to make room.'),
+                ('aphator_cache_hit_ratio', 'hit_ratio', 'gauge', 'Share of cache lookups that hit.'),
+                ('aphator_cache_entries', 'size', 'gauge', 'Entries currently cached.'),
+            ):
+                lines.append(f'# HELP {metric} {help_text}')
+                lines.append(f'# TYPE {metric} {kind}')
+                for cache, stats in sorted(caches.items()):
+                    lines.append(f'{metric}{{cache="{cache}"}} {stats[key]}')
+
+        for kind, metrics in (('gauge', gauges), ('counter', counters)):
+            for metric, (help_text, value) in sorted((metrics or {}).items()):
+                lines.append(f'# HELP {metric} {help_text}')
+                lines.append(f'# TYPE {metric} {kind}')
+                lines.append(f'{metric} {value}')
+        return '\n'.join(lines) + '\n'
+
+    def _render_histogram(self, lines, metric, snapshot, labels):
+        cumulative, total, count = snapshot
+        separator = ',' if labels else ''
+        for bound, value in zip(self.buckets, cumulative):
+            lines.append(f'{metric}_bucket{{{labels}{separator}le="{bound:g}"}} {value}')
+        lines.append(f'{metric}_bucket{{{labels}{separator}le="+Inf"}} {cumulative[-1]}')
+        suffix = f'{{{labels}}}' if labels else ''
+        lines.append(f'{metric}_sum{suffix} {total:.9f}')
+        lines.append(f'{metric}_count{suffix} {count}')
@@ -0,0 +1,201 @@
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict, defaultdict
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_VERSION = 1
+
+
+class ResponseCache:
+    """Size-bounded response cache with TTL, LRU or LFU eviction and hit/miss counters.
+
+    Expiry times are wall-clock timestamps so a snapshot written by one worker
+    can be warm-loaded by another.
+    """
+    def __init__(self, max_size=5000, ttl=None, policy='lru'):
+        if policy not in ('lru', 'lfu'):
+            raise ValueError(f"Unknown cache policy: {policy}")
+        self.max_size = max_size
+        self.ttl = ttl
+        self.policy = policy
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()          # key -> [value, expires_at, frequency]
+        self._frequencies = defaultdict(OrderedDict)  # frequency -> keys in LRU order (LFU only)
+        self._min_frequency = 0
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """Return the cached value for key, counting the lookup as a hit or miss."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            if entry[1] is not None and entry[1] < time.time():
+                self._remove(key)
+                self.misses += 1
+                return default
+            self._touch(key, entry)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key, value, ttl=None):
+        """Store value under key, evicting another entry if the cache is full."""
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = time.time() + ttl if ttl else None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                entry[0] = value
+                entry[1] = expires_at
+                self._touch(key, entry)
+                return
+            if self.max_size <= 0:
+                return
+            if len(self._entries) >= self.max_size:
+                self._evict()
+            self._insert(key, value, expires_at, 1)
+
+    def peek(self, key, default=None):
+        """Return the live value for key without counting a lookup or refreshing its recency."""
+        entry = self._entries.get(key)
+        if entry is None or (entry[1] is not None and entry[1] < time.time()):
+            return default
+        return entry[0]
+
+    def __contains__(self, key):
+        entry = self._entries.get(key)
+        return entry is not None and (entry[1] is None or entry[1] >= time.time())
+
+    def __len__(self):
+        return len(self._entries)
+
+    def clear(self):
+        """Drop every entry but keep the counters."""
+        with self._lock:
+            self._entries.clear()
+            self._frequencies.clear()
+            self._min_frequency = 0
+
+    def stats(self):
+        """Return size and hit/miss counters."""
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self._entries),
+            'max_size': self.max_size,
+            'policy': self.policy,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_ratio': self.hits / lookups if lookups else 0.0
+        }
+
+    def save_snapshot(self, path):
+        """Atomically write the live entries to a JSON snapshot file."""
+        now = time.time()
+        with self._lock:
+            entries = [
+                [key, value, expires_at, frequency]
+                for key, (value, expires_at, frequency) in self._entries.items()
+                if expires_at is None or expires_at >= now
+            ]
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump({'version': SNAPSHOT_VERSION, 'policy': self.policy, 'entries': entries}, f)
+        os.replace(tmp_path, path)
+        logger.info("Saved %s cache entries to %s", len(entries), path)
+
+    def load_snapshot(self, path):
+        """Warm the cache from a snapshot file; returns the number of entries loaded."""
+        if not os.path.exists(path):
+            return 0
+        try:
+            with open(path, 'r') as f:
+                snapshot = json.load(f)
+        except Exception as e:
+            logger.error("Error loading cache snapshot %s: %s", path, e)
+            return 0
+        if snapshot.get('version') != SNAPSHOT_VERSION:
+            logger.warning("Ignoring cache snapshot %s with unsupported version", path)
+            return 0
+
+        now = time.time()
+        loaded = 0
+        with self._lock:
+            # Entries were written oldest first, so replaying them keeps recency order
+            for key, value, expires_at, frequency in snapshot.get('entries', []):
+                if expires_at is not None and expires_at < now:
+                    continue
+                if key in self._entries:
+                    continue
+                if len(self._entries) >= self.max_size:
+                    self._evict()
+                self._insert(key, value, expires_at, frequency)
+                loaded += 1
+        logger.info("Warm-loaded %s cache entries from %s", loaded, path)
+        return loaded
+
+    def start_autosave(self, path, interval=300):
+        """Snapshot the cache to path every interval seconds from a daemon thread."""
+        def autosave():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.save_snapshot(path)
+                except Exception as e:
+                    logger.error("Error saving cache snapshot %s: %s", path, e)
+
+        thread = threading.Thread(target=autosave, name='response-cache-autosave', daemon=True)
+        thread.start()
+        return thread
+
+    def _insert(self, key, value, expires_at, frequency):
+        self._entries[key] = [value, expires_at, frequency]
+        if self.policy == 'lfu':
+            self._frequencies[frequency][key] = None
+            if len(self._entries) == 1 or frequency < self._min_frequency:
+                self._min_frequency = frequency
+
+    def _touch(self, key, entry):
+        """Record an access for the eviction policy."""
+        if self.policy == 'lru':
+            self._entries.move_to_end(key)
+            return
+        frequency = entry[2]
+        bucket = self._frequencies[frequency]
+        del bucket[key]
+        if not bucket:
+            del self._frequencies[frequency]
+            if self._min_frequency == frequency:
+                self._min_frequency = frequency + 1
+        entry[2] = frequency + 1
+        self._frequencies[frequency + 1][key] = None
+
+    def _remove(self, key):
+        entry = self._entries.pop(key)
+        if self.policy == 'lfu':
+            bucket = self._frequencies[entry[2]]
+            del bucket[key]
+            if not bucket:
+                del self._frequencies[entry[2]]
+                if self._frequencies and self._min_frequency == entry[2]:
+                    self._min_frequency = min(self._frequencies)
+
+    def _evict(self):
+        """Drop one entry chosen by the eviction policy. Caller holds the lock."""
+        if not self._entries:
+            return
+        if self.policy == 'lru':
+            key = next(iter(self._entries))
+        else:
+            if self._min_frequency not in self._frequencies:
+                self._min_frequency = min(self._frequencies)
+            key = next(iter(self._frequencies[self._min_frequency]))
+        self._remove(key)
+        self.evictions += 1
@@ -0,0 +1,61 @@
+import hashlib
+import json
+from collections import namedtuple
+
+
+class ResponseTags(namedtuple('ResponseTags', ['topic', 'intent', 'labels'])):
+    """What a response text mentions, matched once when the response is indexed or loaded.
+
+    topic is the first topic it mentions (used for engagement prompts and by
+    follow-up rules), intent the first intent category its wording matches,
+    and labels every keyword automaton label found in it, which includes the
+    rule keyword groups follow-up rules look for in the previous answer.
+    """
+    __slots__ = ()
+
+    def to_json(self):
+        return [self.topic, self.intent, sorted(self.labels)]
+
+    @classmethod
+    def from_json(cls, value):
+        return cls(value[0], value[1], frozenset(value[2]))
+
+
+class ResponseTagger:
+    """Computes ResponseTags with the chatbot's keyword automaton.
+
+    Equal tags are shared, so a large corpus holds far fewer tag objects
+    than entries.
+    """
+    def __init__(self, matcher, topic_labels, intent_labels):
+        self.matcher = matcher
+        self.topic_labels = topic_labels
+        self.intent_labels = intent_labels
+        self._interned = {}
+
+    def __call__(self, text):
+        """Tags for a response text."""
+        return self._tags(frozenset(self.matcher.match(text).spans))
+
+    def combine(self, tags, other):
+        """Tags of two texts shown together, e.g. an answer and its engagement prompt."""
+        if tags is None or other is None:
+            return tags if other is None else other
+        return self._tags(tags.labels | other.labels)
+
+    def from_json(self, value):
+        """Shared tags for a value written by ResponseTags.to_json."""
+        return self.intern(ResponseTags.from_json(value))
+
+    def intern(self, tags):
+        return self._interned.setdefault(tags, tags)
+
+    def _tags(self, labels):
+        topic = next((label for label in self.topic_labels if label in labels), None)
+        intent = next((label for label in self.intent_labels if label in labels), None)
+        return self.intern(ResponseTags(topic and topic[len('topic:'):], intent and intent[len('intent:'):], labels))
+
+
+def tag_signature(*tables):
+    """Digest of the keyword tables tags were computed with, to detect stale stored tags."""
+    return hashlib.sha256(json.dumps(tables, sort_keys=True).encode('utf-8')).hexdigest()
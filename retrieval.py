@@ -0,0 +1,74 @@
+import numpy as np
+import scipy.sparse as sp
+
+
+def l2_normalize_rows(matrix):
+    """Return a CSR copy of a sparse matrix with every non-empty row scaled to unit length."""
+    matrix = sp.csr_matrix(matrix, dtype=np.float64, copy=True)
+    norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+    norms[norms == 0.0] = 1.0
+    matrix.data /= np.repeat(norms, np.diff(matrix.indptr))
+    return matrix
+
+
+def top_k(scores, k):
+    """Indices of the k highest scores, best first; ties go to the lower index like argmax."""
+    count = scores.shape[0]
+    if count == 0:
+        return np.empty(0, dtype=np.intp)
+    if k == 1:
+        return np.array([scores.argmax()])
+    k = min(k, count)
+    if k < count:
+        candidates = np.argpartition(-scores, k - 1)[:k]
+        # argpartition may pick any of several tied scores at the boundary;
+        # include them all so the lowest indices win, as with argmax
+        boundary = scores[candidates].min()
+        candidates = np.union1d(candidates, np.flatnonzero(scores == boundary))
+    else:
+        candidates = np.arange(count)
+    order = np.lexsort((candidates, -scores[candidates]))
+    return candidates[order][:k]
+
+
+class RetrievalEngine:
+    """Cosine-similarity search over a fixed corpus matrix.
+
+    The corpus is L2-normalized once and stored term-major (the transpose, in
+    CSR form), so scoring a query is a single sparse dot product that only
+    touches the rows of the terms the query contains. Query vectors are
+    expected to be L2-normalized already, as TfidfVectorizer.transform returns.
+    A prebuilt term_doc (e.g. memory-mapped from an index artifact) is used as is.
+    """
+    def __init__(self, matrix, term_doc=None):
+        if term_doc is None:
+            term_doc = l2_normalize_rows(matrix).T.tocsr()
+        self.shape = (term_doc.shape[1], term_doc.shape[0])
+        self.term_doc = term_doc
+
+    def __len__(self):
+        return self.shape[0]
+
+    def scores(self, query_vectors):
+        """Dense (queries x documents) cosine similarity matrix."""
+        return (sp.csr_matrix(query_vectors) @ self.term_doc).toarray()
+
+    def search(self, query_vector, k=1):
+        """Top-k (index, score) pairs for one query, best first."""
+        scores = self.scores(query_vector)[0]
+        return [(int(index), float(scores[index])) for index in top_k(scores, k)]
+
+    def search_batch(self, query_vectors, k=1):
+        """Top-k (index, score) pairs for every row of a query matrix."""
+        scores = self.scores(query_vectors)
+        return [
+            [(int(index), float(row[index])) for index in top_k(row, k)]
+            for row in scores
+        ]
+
+
+def build_index(matrix, kind='auto', term_doc=None):
+    """Build the retrieval structure for a corpus matrix: 'matrix' or 'auto' (the same engine)."""
+    if kind in ('auto', 'matrix'):
+        return RetrievalEngine(matrix, term_doc=term_doc)
+    raise ValueError(f"Unknown retrieval index: {kind}")
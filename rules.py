@@ -0,0 +1,218 @@
+import json
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Rules are evaluated in two passes around the TF-IDF retrieval step
+STAGES = ('before_retrieval', 'after_retrieval')
+
+
+class RuleFacts:
+    """What is known about a message when rules are evaluated.
+
+    previous_tags are the ResponseTags of the previous bot response, tagged
+    when that response was indexed or loaded; used_previous records whether
+    any rule looked at them, i.e. whether the outcome depended on the
+    conversation so far.
+    """
+    __slots__ = ('matches', 'intent', 'sentiment', 'has_text_data', 'used_previous', '_previous_tags')
+
+    def __init__(self, matches, intent, sentiment, has_text_data, previous_tags=None):
+        self.matches = matches
+        self.intent = intent
+        self.sentiment = sentiment
+        self.has_text_data = has_text_data
+        self._previous_tags = previous_tags
+        self.used_previous = False
+
+    @property
+    def previous_tags(self):
+        """ResponseTags of the previous bot response, or None at the start of a conversation."""
+        self.used_previous = True
+        return self._previous_tags
+
+    @property
+    def previous_topic(self):
+        """First topic mentioned in the previous bot response, or None."""
+        previous = self.previous_tags
+        return previous.topic if previous is not None else None
+
+
+class Rule:
+    """A single declarative response rule loaded from rules.json."""
+    __slots__ = ('id', 'stage', 'order', 'all', 'intent', 'sentiment', 'previous_all', 'previous_topic',
+                 'requires_text_data', 'response', 'engagement_topic', 'branch')
+
+    def __init__(self, data, order):
+        self.id = data['id']
+        self.stage = data.get('stage', 'before_retrieval')
+        if self.stage not in STAGES:
+            raise ValueError(f"Rule {self.id} has unknown stage {self.stage}")
+        self.order = order
+        self.all = tuple(data.get('all', ()))
+        self.intent = data.get('intent')
+        self.sentiment = data.get('sentiment')
+        self.previous_all = tuple(data.get('previous_all', ()))
+        self.previous_topic = data.get('previous_topic')
+        self.requires_text_data = data.get('requires_text_data', False)
+        self.response = data['response']
+        self.engagement_topic = data.get('engagement_topic')
+        
+        # Pipeline branch this rule reports when it answers
+        if self.previous_all or self.previous_topic:
+            self.branch = 'follow_up'
+        elif self.intent:
+            self.branch = 'intent'
+        else:
+            self.branch = 'rule'
+
+    def triggers(self):
+        """Labels that must all be present in the message for this rule to fire."""
+        triggers = list(self.all)
+        if self.intent:
+            triggers.append(f"intent:{self.intent}")
+        if self.sentiment and self.sentiment != 'neutral':
+            triggers.append(f"sentiment:{self.sentiment}")
+        return triggers
+
+    def applies(self, facts):
+        """Check every condition of the rule against the message facts."""
+        if self.requires_text_data and not facts.has_text_data:
+            return False
+        matches = facts.matches
+        if not all(label in matches for label in self.all):
+            return False
+        if self.intent and facts.intent != self.intent:
+            return False
+        if self.sentiment and facts.sentiment != self.sentiment:
+            return False
+        if self.previous_all or self.previous_topic:
+            previous = facts.previous_tags
+            if previous is None:
+                return False
+            if not all(label in previous.labels for label in self.previous_all):
+                return False
+            if self.previous_topic and previous.topic != self.previous_topic:
+                return False
+        return True
+
+
+class CompiledRules:
+    """Rules indexed by trigger label so a message only evaluates rules it can satisfy."""
+    def __init__(self, document, version):
+        self.version = version
+        self.keyword_groups = document.get('keyword_groups', {})
+        self.rules = [Rule(data, order) for order, data in enumerate(document.get('rules', []))]
+        self.index = {stage: {} for stage in STAGES}
+        self.untriggered = {stage: [] for stage in STAGES}
+
+        for rule in self.rules:
+            triggers = rule.triggers()
+            if not triggers:
+                self.untriggered[rule.stage].append(rule)
+                continue
+            # Every trigger is required, so indexing under one of them is enough;
+            # pick the one anchoring the fewest rules to keep candidate lists short
+            stage_index = self.index[rule.stage]
+            anchor = min(triggers, key=lambda label: len(stage_index.get(label, ())))
+            stage_index.setdefault(anchor, []).append(rule)
+
+    def candidates(self, stage, matches):
+        """Rules whose anchor label appears in the message, in table order."""
+        stage_index = self.index[stage]
+        candidates = list(self.untriggered[stage])
+        for label in matches.spans:
+            rules = stage_index.get(label)
+            if rules:
+                candidates.extend(rules)
+        candidates.sort(key=lambda rule: rule.order)
+        return candidates
+
+
+class RuleEngine:
+    """Loads rules.json, hot-reloads it when the file changes, and evaluates rules."""
+    def __init__(self, path, check_interval=2.0):
+        self.path = str(path)
+        self.check_interval = check_interval
+        self.evaluations = 0
+        self.requests = 0
+        self._mtime = None
+        self._last_check = 0.0
+        self._lock = threading.Lock()
+        self.compiled = CompiledRules({}, version=0)
+        self.load()
+
+    @property
+    def version(self):
+        return self.compiled.version
+
+    @property
+    def mtime(self):
+        """Modification time of the rule file the current rules were loaded from."""
+        return self._mtime
+    
+    @property
+    def keyword_groups(self):
+        return self.compiled.keyword_groups
+
+    def load(self):
+        """(Re)load the rule file, keeping the current rules if it is missing or invalid."""
+        if not os.path.exists(self.path):
+            # e.g. a tenant without rules of its own; the file is picked up once it appears
+            logger.info("No rule file at %s", self.path)
+            return False
+        try:
+            mtime = os.path.getmtime(self.path)
+            with open(self.path, 'r') as f:
+                document = json.load(f)
+            compiled = CompiledRules(document, version=self.compiled.version + 1)
+        except Exception as e:
+            logger.error("Error loading rules from %s: %s", self.path, e)
+            return False
+        # Readers pick up the new table with a single reference swap
+        self.compiled = compiled
+        self._mtime = mtime
+        logger.info("Loaded %s rules from %s", len(compiled.rules), self.path)
+        return True
+
+    def reload_if_changed(self):
+        """Reload the rule file if it changed on disk; returns True when new rules were loaded."""
+        now = time.monotonic()
+        if now - self._last_check < self.check_interval:
+            return False
+        with self._lock:
+            if now - self._last_check < self.check_interval:
+                return False
+            self._last_check = now
+            try:
+                mtime = os.path.getmtime(self.path)
+            except OSError:
+                return False
+            if mtime == self._mtime:
+                return False
+            return self.load()
+
+    def evaluate(self, stage, facts):
+        """Return (first matching rule or None, number of rules evaluated)."""
+        evaluated = 0
+        matched = None
+        for rule in self.compiled.candidates(stage, facts.matches):
+            evaluated += 1
+            if rule.applies(facts):
+                matched = rule
+                break
+        self.evaluations += evaluated
+        return matched, evaluated
+
+    def stats(self):
+        """Return rule counts and evaluation totals."""
+        return {
+            'version': self.version,
+            'rules': len(self.compiled.rules),
+            'requests': self.requests,
+            'evaluations': self.evaluations,
+            'evaluations_per_request': self.evaluations / self.requests if self.requests else 0.0
+        }
@@ -0,0 +1,167 @@
+import atexit
+import logging
+import multiprocessing
+import os
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+# The analyzing chatbot of the current worker process
+_worker_bot = None
+
+
+def _init_worker(index_artifact, snapshot_id, settings):
+    global _worker_bot
+    from chatbot import AphatorChatbot
+    from response_cache import ResponseCache
+    # Workers only analyze messages, so they carry no sessions or caches of their own
+    _worker_bot = AphatorChatbot(
+        learned_cache=ResponseCache(max_size=0),
+        response_memo=ResponseCache(max_size=0),
+        index_artifact=index_artifact,
+        **settings
+    )
+    # A worker that rebuilt its index (artifact stale, unreadable or built from other
+    # data) would answer from another corpus; fail instead, so the pool is never used
+    if _worker_bot.index.snapshot_id != snapshot_id:
+        raise RuntimeError(f"Scoring worker could not map index artifact {index_artifact} "
+                           f"of snapshot {snapshot_id}")
+
+
+def _analyze(user_input):
+    return _worker_bot.analyze(user_input)
+
+
+def _analyze_batch(messages):
+    return [_worker_bot.analyze(user_input) for user_input in messages]
+
+
+class ScoringPool:
+    """Runs message normalization, intent detection and retrieval in worker processes.
+
+    Workers memory-map the same index artifact, so the read-only index is
+    shared through the page cache rather than copied per process. Sessions,
+    learned responses and the response memo stay in the front process, which
+    only receives a MessageAnalysis back per message. If the chatbot's index
+    was not loaded from an artifact, a temporary one is written for the pool.
+    Each time the chatbot publishes a new snapshot, refresh() writes it out
+    and replaces the workers once a new set has started on it.
+    """
+    def __init__(self, chatbot, processes=None, batch_chunk_size=64):
+        self.processes = processes or os.cpu_count() or 1
+        self.batch_chunk_size = batch_chunk_size
+        self._temporary_artifact = None
+        self._generation = 0
+        self._lock = threading.Lock()
+
+        index_artifact = chatbot.index_artifact
+        if not index_artifact or chatbot.knowledge is not None:
+            # The index was built or updated in this process; publish it for the workers
+            index_artifact = self._temporary_artifact = self._write_artifact(chatbot)
+        self._executor = self._start(chatbot, index_artifact)
+        atexit.register(self.close)
+        logger.info("Started scoring pool with %s processes", self.processes)
+
+    def warm_up(self):
+        """Start every worker process now instead of on the first messages."""
+        self._warm_up(self._executor)
+
+    def refresh(self, chatbot):
+        """Move the workers to the chatbot's current snapshot.
+
+        The new workers are started in the background; until they are up,
+        the old ones keep answering and the front process redoes retrieval
+        for the analyses they return against the older snapshot. If the new
+        workers fail to start, the old ones are kept.
+        """
+        index_artifact = self._write_artifact(chatbot)
+        executor = self._start(chatbot, index_artifact)
+        with self._lock:
+            self._generation += 1
+            generation = self._generation
+
+        def swap():
+            try:
+                self._warm_up(executor)
+                started = True
+            except Exception as e:
+                logger.error("Error starting refreshed scoring workers: %s", e)
+                started = False
+            with self._lock:
+                current = started and generation == self._generation
+                if current:
+                    old_executor, self._executor = self._executor, executor
+                    old_artifact, self._temporary_artifact = self._temporary_artifact, index_artifact
+            if not current:
+                # The workers failed, or a later refresh superseded this one before they were up
+                old_executor, old_artifact = executor, index_artifact
+            old_executor.shutdown(wait=False)
+            self._remove(old_artifact)
+            if current:
+                logger.info("Scoring pool moved to index version %s", chatbot.index.version)
+
+        threading.Thread(target=swap, name='scoring-pool-refresh', daemon=True).start()
+
+    def analyze(self, user_input):
+        """MessageAnalysis for one message, computed in a worker process."""
+        return self._submit(_analyze, user_input).result()
+
+    def analyze_batch(self, messages):
+        """MessageAnalysis for every message, spread over the workers in chunks."""
+        chunks = [messages[i:i + self.batch_chunk_size] for i in range(0, len(messages), self.batch_chunk_size)]
+        analyses = []
+        for future in [self._submit(_analyze_batch, chunk) for chunk in chunks]:
+            analyses.extend(future.result())
+        return analyses
+
+    def close(self):
+        """Stop the worker processes and remove the temporary index artifact."""
+        self._executor.shutdown(wait=True, cancel_futures=True)
+        self._remove(self._temporary_artifact)
+        self._temporary_artifact = None
+
+    def _submit(self, fn, *args):
+        executor = self._executor
+        try:
+            return executor.submit(fn, *args)
+        except RuntimeError:
+            # A refresh shut this pool down after it was read; its replacement is in place
+            return self._executor.submit(fn, *args)
+
+    def _write_artifact(self, chatbot):
+        fd, index_artifact = tempfile.mkstemp(prefix='aphator-index-', suffix='.aphidx')
+        os.close(fd)
+        chatbot.build_index_artifact(index_artifact)
+        return index_artifact
+
+    def _start(self, chatbot, index_artifact):
+        # Workers are built with the chatbot's own corpus and retrieval settings, so the
+        # artifact's source hash and embedder match and it is mapped, not rebuilt
+        settings = {
+            'data_file': chatbot.data_file,
+            'text_data_file': chatbot.text_data_file,
+            'builtin_entries': chatbot.builtin_entries,
+            'rules_path': chatbot.rules.path,
+            'retrieval_index': chatbot.retrieval_index,
+            'retrieval_mode': chatbot.retrieval_mode,
+            'embedder': chatbot.embedder
+        }
+        # spawn keeps workers from inheriting the front process's threads and locks
+        return ProcessPoolExecutor(
+            max_workers=self.processes,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=_init_worker,
+            initargs=(index_artifact, chatbot.ensure_index().snapshot_id, settings)
+        )
+
+    def _warm_up(self, executor):
+        list(executor.map(_analyze, ['hello'] * self.processes))
+
+    def _remove(self, path):
+        if path:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
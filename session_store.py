@@ -0,0 +1,183 @@
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+class SqliteSessionBackend:
+    """Shared session backend so contexts survive worker restarts.
+
+    Every gunicorn worker on a host can point at the same database file; WAL
+    mode lets readers and the single writer proceed without blocking each other.
+    """
+    def __init__(self, path):
+        self.path = str(path)
+        self._local = threading.local()
+        conn = self._connection()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            "id TEXT PRIMARY KEY, data TEXT NOT NULL, updated REAL NOT NULL)"
+        )
+        conn.commit()
+
+    def _connection(self):
+        """Return the connection owned by the calling thread."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5.0)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def load(self, session_id):
+        """Return (stored state, time it was written) for a session, or (None, None)."""
+        row = self._connection().execute(
+            "SELECT data, updated FROM sessions WHERE id = ?", (session_id,)
+        ).fetchone()
+        return (json.loads(row[0]), row[1]) if row else (None, None)
+
+    def updated(self, session_id):
+        """Return when a session was last written, or None if it is not stored."""
+        row = self._connection().execute(
+            "SELECT updated FROM sessions WHERE id = ?", (session_id,)
+        ).fetchone()
+        return row[0] if row else None
+
+    def save(self, session_id, state):
+        """Insert or replace the stored state for a session; returns the time it was written."""
+        updated = time.time()
+        conn = self._connection()
+        conn.execute(
+            "INSERT OR REPLACE INTO sessions (id, data, updated) VALUES (?, ?, ?)",
+            (session_id, json.dumps(state, separators=(',', ':')), updated)
+        )
+        conn.commit()
+        return updated
+
+    def delete(self, session_id):
+        """Remove a session from the backend."""
+        conn = self._connection()
+        conn.execute("DELETE FROM sessions WHERE id = ?", (session_id,))
+        conn.commit()
+
+    def purge(self, older_than):
+        """Drop every session last written before the given timestamp."""
+        conn = self._connection()
+        conn.execute("DELETE FROM sessions WHERE updated < ?", (older_than,))
+        conn.commit()
+
+
+class SessionStore:
+    """Bounded, TTL-evicting map from session id to conversation context.
+
+    The in-process map is the hot tier. When a backend is configured every
+    saved context is written through to it, and a context missing locally
+    (new worker, evicted entry) is restored from it on first access. A
+    locally held context is also reloaded when the backend has a newer write,
+    i.e. another worker answered in the same session since.
+    """
+    def __init__(self, context_factory, context_loader=None, max_sessions=10000, ttl=1800, backend=None):
+        self.context_factory = context_factory
+        self.context_loader = context_loader
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self.backend = backend
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+        self._last_purge = time.monotonic()
+
+    def get(self, session_id):
+        """Return the context for a session, creating or restoring it if needed."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is not None:
+                context, last_access, updated = entry
+                if now - last_access <= self.ttl:
+                    self._sessions[session_id] = (context, now, updated)
+                    self._sessions.move_to_end(session_id)
+                    if self.backend is None:
+                        return context
+                else:
+                    del self._sessions[session_id]
+                    entry = None
+
+        if entry is not None and not self._changed_elsewhere(session_id, updated):
+            return context
+
+        context, updated = self._restore(session_id)
+        with self._lock:
+            self._sessions[session_id] = (context, now, updated)
+            self._sessions.move_to_end(session_id)
+            self._evict(now)
+            purge_due = self.backend is not None and now - self._last_purge > self.ttl
+            if purge_due:
+                self._last_purge = now
+
+        if purge_due:
+            try:
+                self.backend.purge(time.time() - self.ttl)
+            except Exception as e:
+                logger.error("Error purging expired sessions: %s", e)
+        return context
+
+    def save(self, session_id, context):
+        """Persist a context to the backend, if one is configured."""
+        if self.backend is None:
+            return
+        try:
+            updated = self.backend.save(session_id, context.to_dict())
+        except Exception as e:
+            logger.error("Error saving session %s: %s", session_id, e)
+            return
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is not None and entry[0] is context:
+                self._sessions[session_id] = (context, entry[1], updated)
+
+    def discard(self, session_id):
+        """Forget a session locally and in the backend."""
+        with self._lock:
+            self._sessions.pop(session_id, None)
+        if self.backend is not None:
+            self.backend.delete(session_id)
+
+    def _changed_elsewhere(self, session_id, updated):
+        """Whether the backend holds a newer write of a session than the local copy."""
+        try:
+            stored = self.backend.updated(session_id)
+        except Exception as e:
+            logger.error("Error checking session %s: %s", session_id, e)
+            return False
+        return stored is not None and (updated is None or stored > updated)
+
+    def _restore(self, session_id):
+        """Load (context, time it was written) from the backend, falling back to a fresh context."""
+        if self.backend is not None and self.context_loader is not None:
+            try:
+                state, updated = self.backend.load(session_id)
+                if state is not None:
+                    return self.context_loader(state), updated
+            except Exception as e:
+                logger.error("Error restoring session %s: %s", session_id, e)
+        return self.context_factory(), None
+
+    def _evict(self, now):
+        """Drop expired sessions and trim to capacity. Caller holds the lock."""
+        # Entries are kept in access order, so expired ones are at the front
+        while self._sessions:
+            oldest_id, (_, last_access, _) = next(iter(self._sessions.items()))
+            if now - last_access <= self.ttl and len(self._sessions) <= self.max_sessions:
+                break
+            del self._sessions[oldest_id]
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def __contains__(self, session_id):
+        return session_id in self._sessions
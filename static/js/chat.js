@@ -64,7 +64,15 @@ document.addEventListener('DOMContentLoaded', function() {
         // Show typing indicator
         showTypingIndicator();
         
-        // Send message to backend
+        // Stream the response when the browser supports it, otherwise fetch it whole
+        if (window.ReadableStream && window.TextDecoder) {
+            streamMessage(message);
+        } else {
+            fetchMessage(message);
+        }
+    }
+    
+    function fetchMessage(message) {
         fetch('/api/chat', {
             method: 'POST',
             headers: {
@@ -82,14 +90,11 @@ document.addEventListener('DOMContentLoaded', function() {
             // Hide typing indicator
             hideTypingIndicator();
             
-            // Add bot response after a slight delay to simulate typing
-            setTimeout(() => {
-                if (data.error) {
-                    addBotMessage("Sorry, I encountered an error. Please try again.");
-                } else {
-                    addBotMessage(data.response);
-                }
-            }, 500);
+            if (data.error) {
+                addBotMessage("Sorry, I encountered an error. Please try again.");
+            } else {
+                addBotMessage(data.response);
+            }
         })
         .catch(error => {
             console.error('Error:', error);
@@ -98,6 +103,92 @@ document.addEventListener('DOMContentLoaded', function() {
         });
     }
     
+    function streamMessage(message) {
+        // Server-Sent Events over a POST body: "chunk" events carry the next
+        // sentence, "done" the full response, "error" a failure. The server
+        // composes the whole response first, so chunks arrive back to back
+        let messageElement = null;
+        let received = '';
+        
+        function appendText(text) {
+            if (!messageElement) {
+                hideTypingIndicator();
+                messageElement = addBotMessage('');
+            }
+            received += text;
+            messageElement.querySelector('.message-content').textContent = received;
+            scrollToBottom();
+        }
+        
+        function handleEvent(block) {
+            let event = 'message';
+            let data = '';
+            block.split('\n').forEach(line => {
+                if (line.startsWith('event: ')) {
+                    event = line.slice(7);
+                } else if (line.startsWith('data: ')) {
+                    data += line.slice(6);
+                }
+            });
+            if (!data) return;
+            const payload = JSON.parse(data);
+            if (event === 'chunk') {
+                appendText(payload.text);
+            } else if (event === 'done' && payload.response !== received) {
+                // Make sure the final text is complete even if a chunk was missed
+                received = '';
+                appendText(payload.response);
+            } else if (event === 'error' && !received) {
+                appendText("Sorry, I encountered an error. Please try again.");
+            }
+        }
+        
+        fetch('/api/chat/stream', {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json',
+                'Accept': 'text/event-stream'
+            },
+            body: JSON.stringify({ message: message })
+        })
+        .then(response => {
+            if (!response.ok || !response.body) {
+                throw new Error('Network response was not ok');
+            }
+            const reader = response.body.getReader();
+            const decoder = new TextDecoder();
+            let buffer = '';
+            
+            function read() {
+                return reader.read().then(({ done, value }) => {
+                    if (done) {
+                        if (buffer.trim()) handleEvent(buffer);
+                        if (!messageElement) {
+                            hideTypingIndicator();
+                            addBotMessage("Sorry, I encountered an error. Please try again.");
+                        }
+                        return;
+                    }
+                    buffer += decoder.decode(value, { stream: true });
+                    let boundary;
+                    while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+                        handleEvent(buffer.slice(0, boundary));
+                        buffer = buffer.slice(boundary + 2);
+                    }
+                    return read();
+                });
+            }
+            return read();
+        })
+        .catch(error => {
+            console.error('Error:', error);
+            hideTypingIndicator();
+            if (!messageElement) {
+                addBotMessage("Sorry, I'm having trouble connecting to the server. Please try again later.");
+            }
+        });
+    }
+    
     function addUserMessage(message) {
         const time = new Date().toLocaleTimeString([], { hour: '2-digit', minute: '2-digit' });
         const messageElement = createMessageElement('user-message', message, time);
@@ -110,6 +201,7 @@ document.addEventListener('DOMContentLoaded', function() {
         const messageElement = createMessageElement('bot-message', message, time);
         chatBox.appendChild(messageElement);
         scrollToBottom();
+        return messageElement;
     }
     
     function createMessageElement(className, message, time) {
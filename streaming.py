@@ -0,0 +1,32 @@
+import json
+import re
+
+# A sentence runs up to terminal punctuation followed by whitespace, or up to
+# a line break; trailing whitespace stays with it so the chunks join back
+# into the original text exactly
+SENTENCE_RE = re.compile(r'.+?(?:[.!?]+(?=\s|$)|\n+|$)\s*', re.S)
+
+# Sent before any work is done so clients and proxies see the connection is
+# open; it carries no part of the answer
+SSE_PREAMBLE = ': stream open\n\n'
+
+
+def response_chunks(text):
+    """Split a response into sentence-sized chunks for streaming."""
+    return SENTENCE_RE.findall(text)
+
+
+def sse_event(event, data):
+    """Format one Server-Sent Event with a JSON payload."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def sse_response_events(text):
+    """SSE events for a complete response: one chunk event per sentence, then done.
+
+    The response is composed whole before the first chunk, so the chunks go
+    out back to back; they don't bring the answer any sooner than /api/chat.
+    """
+    for chunk in response_chunks(text):
+        yield sse_event('chunk', {'text': chunk})
+    yield sse_event('done', {'response': text})
@@ -0,0 +1,183 @@
+import atexit
+import copy
+import json
+import logging
+import random
+import sys
+import threading
+import time
+from collections import deque
+
+# Attributes every LogRecord has; anything else was passed with extra= and is emitted as a field
+STANDARD_ATTRIBUTES = frozenset(logging.makeLogRecord({}).__dict__) | {'message', 'asctime'}
+
+LOG_FORMATS = ('json', 'text')
+TEXT_FORMAT = '%(asctime)s %(levelname)s %(name)s: %(message)s'
+
+
+def extra_fields(record):
+    """The fields a record was given with extra=."""
+    return {key: value for key, value in record.__dict__.items()
+            if key not in STANDARD_ATTRIBUTES and not key.startswith('_')}
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record: time, level, logger, message and any extra= fields."""
+    def format(self, record):
+        entry = {
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(record.created)) + f'.{int(record.msecs):03d}Z',
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage()
+        }
+        entry.update(extra_fields(record))
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """The classic one-line format, followed by any extra= fields as key=value pairs."""
+    def __init__(self):
+        super().__init__(TEXT_FORMAT)
+
+    def format(self, record):
+        line = super().format(record)
+        fields = extra_fields(record)
+        if fields:
+            line += ' ' + ' '.join(f'{key}={value}' for key, value in fields.items())
+        return line
+
+
+class LevelSampler(logging.Filter):
+    """Keep a fraction of records per level; levels without a rate are always kept.
+
+    rates maps level names or numbers to a keep probability, e.g.
+    {'DEBUG': 0.01, 'INFO': 0.1}. Warnings and errors are never sampled
+    unless a rate is given for them explicitly.
+    """
+    def __init__(self, rates):
+        super().__init__()
+        self.rates = {logging.getLevelName(level) if isinstance(level, str) else level: float(rate)
+                      for level, rate in rates.items()}
+
+    def filter(self, record):
+        rate = self.rates.get(record.levelno)
+        return rate is None or rate >= 1.0 or random.random() < rate
+
+
+class AsyncQueueHandler(logging.Handler):
+    """Hand records to a background writer thread without blocking the caller.
+
+    Emitting merges the message with its args, as QueueHandler.prepare does,
+    so later changes to mutable args don't show up in the log, and appends
+    the record to a bounded deque; the writer wakes every flush_interval
+    seconds, formats everything queued since and writes it with a single
+    write and flush. When max_queued records are waiting, new ones are
+    dropped and counted in `dropped`.
+    """
+    def __init__(self, stream, formatter, max_queued=10000, flush_interval=0.05):
+        super().__init__()
+        self.stream = stream
+        self.setFormatter(formatter)
+        self.max_queued = max_queued
+        self.flush_interval = flush_interval
+        self.dropped = 0
+        self._pending = deque()
+        self._stopping = threading.Event()
+        self._thread = None
+
+    def emit(self, record):
+        # Handler.handle already holds the handler lock around emit; this only copies the
+        # record and appends it, so the lock is held briefly and the write happens elsewhere
+        if len(self._pending) >= self.max_queued:
+            self.dropped += 1
+            return
+        try:
+            record = self.prepare(record)
+        except Exception:
+            self.handleError(record)
+            return
+        self._pending.append(record)
+
+    def prepare(self, record):
+        """A copy of the record with its message already formatted from msg % args."""
+        message = record.getMessage()
+        record = copy.copy(record)
+        record.message = message
+        record.msg = message
+        record.args = None
+        return record
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='log-writer', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Write out the queued records and stop the writer thread."""
+        if self._thread is not None:
+            self._stopping.set()
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while not self._stopping.wait(self.flush_interval):
+            self._write_pending()
+        self._write_pending()
+
+    def _write_pending(self):
+        pending = self._pending
+        lines = []
+        while pending:
+            record = pending.popleft()
+            try:
+                lines.append(self.format(record))
+            except Exception:
+                self.handleError(record)
+        if lines:
+            try:
+                self.stream.write('\n'.join(lines) + '\n')
+                self.stream.flush()
+            except Exception:
+                self.handleError(None)
+
+
+def parse_sample_rates(spec):
+    """Parse "DEBUG=0.01,INFO=0.5" into {'DEBUG': 0.01, 'INFO': 0.5}."""
+    rates = {}
+    for item in (spec or '').split(','):
+        if not item.strip():
+            continue
+        level, _, rate = item.partition('=')
+        level = level.strip().upper()
+        if not isinstance(logging.getLevelName(level), int):
+            raise ValueError(f"Unknown log level in sample rates: {level}")
+        rates[level] = float(rate)
+    return rates
+
+
+def configure_logging(level='INFO', log_format='json', sample_rates=None, queue_size=10000, stream=None,
+                      flush_interval=0.05):
+    """Route the root logger through a bounded queue to a background writer; returns the handler.
+
+    level is the root log level; log_format 'json' writes structured records
+    and 'text' the classic one-line format. The writer is flushed at exit.
+    """
+    if log_format not in LOG_FORMATS:
+        raise ValueError(f"log_format must be one of {LOG_FORMATS}")
+    handler = AsyncQueueHandler(stream or sys.stderr, JsonFormatter() if log_format == 'json' else TextFormatter(),
+                                max_queued=queue_size, flush_interval=flush_interval)
+    if sample_rates:
+        handler.addFilter(LevelSampler(sample_rates))
+
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+        if isinstance(existing, AsyncQueueHandler):
+            existing.stop()
+    root.addHandler(handler)
+    root.setLevel(level.upper() if isinstance(level, str) else level)
+
+    handler.start()
+    atexit.register(handler.stop)
+    return handler
@@ -0,0 +1,171 @@
+import logging
+import os
+import re
+import sys
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+# Tenant names appear in URLs and directory names
+TENANT_NAME_RE = re.compile(r'^[a-z0-9][a-z0-9_-]{0,63}$')
+
+# Files in a tenant directory; only company_data.json is required
+TENANT_DATA_FILE = 'company_data.json'
+TENANT_TEXT_DATA_FILE = os.path.join('data', 'companydata.txt')
+TENANT_RULES_FILE = 'rules.json'
+TENANT_INDEX_ARTIFACT = 'index.aphidx'
+
+
+def tenant_paths(directory):
+    """Keyword arguments pointing an AphatorChatbot at one tenant's files.
+
+    A tenant is answered from its own files only: without a rules.json it
+    has no rules (one added later is hot-reloaded), and Aphator's builtin
+    entries are left out of its index. index.aphidx is used when present
+    and up to date. Its transcripts are recorded under the directory's name.
+    """
+    directory = Path(directory)
+    return {
+        'tenant': directory.name,
+        'data_file': directory / TENANT_DATA_FILE,
+        'text_data_file': directory / TENANT_TEXT_DATA_FILE,
+        'rules_path': directory / TENANT_RULES_FILE,
+        'index_artifact': directory / TENANT_INDEX_ARTIFACT,
+        'builtin_entries': False
+    }
+
+
+def default_chatbot_factory(name, directory):
+    from chatbot import AphatorChatbot
+    return AphatorChatbot(**tenant_paths(directory))
+
+
+class TenantRegistry:
+    """Per-tenant chatbots loaded on first use and evicted least recently used.
+
+    Every subdirectory of root with a company_data.json is a tenant. A
+    tenant's chatbot (index, caches and sessions) is built by
+    chatbot_factory(name, directory) the first time it is asked for. After
+    each load, the least recently used tenants are evicted until at most
+    max_loaded are held and their estimated heap memory fits memory_budget
+    bytes; memory-mapped index data is reported but not counted, since the
+    OS can reclaim it. An evicted tenant is simply loaded again when it is
+    next used, so only its in-memory sessions and caches are lost.
+    """
+    def __init__(self, root, chatbot_factory=None, max_loaded=None, memory_budget=None):
+        self.root = Path(root)
+        self.chatbot_factory = chatbot_factory or default_chatbot_factory
+        self.max_loaded = max_loaded
+        self.memory_budget = memory_budget
+        self.loads = 0
+        self.evictions = 0
+        self._loaded = OrderedDict()
+        self._loading = {}
+        self._lock = threading.Lock()
+
+    def directory(self, name):
+        """The tenant's directory, or None if there is no such tenant."""
+        if not TENANT_NAME_RE.match(name):
+            return None
+        directory = self.root / name
+        return directory if (directory / TENANT_DATA_FILE).is_file() else None
+
+    def names(self):
+        """Names of every tenant under root, loaded or not."""
+        if not self.root.is_dir():
+            return []
+        return sorted(path.name for path in self.root.iterdir() if self.directory(path.name) is not None)
+
+    def __contains__(self, name):
+        return name in self._loaded or self.directory(name) is not None
+
+    def get(self, name):
+        """Return the tenant's chatbot, loading it first if needed; KeyError for unknown tenants."""
+        with self._lock:
+            chatbot = self._loaded.get(name)
+            if chatbot is not None:
+                self._loaded.move_to_end(name)
+                return chatbot
+        directory = self.directory(name)
+        if directory is None:
+            raise KeyError(name)
+        with self._lock:
+            # One lock per tenant, so a slow load doesn't hold up requests for other tenants
+            loading = self._loading.setdefault(name, threading.Lock())
+
+        with loading:
+            with self._lock:
+                chatbot = self._loaded.get(name)
+                if chatbot is not None:
+                    self._loaded.move_to_end(name)
+                    return chatbot
+            chatbot = self.chatbot_factory(name, directory)
+            with self._lock:
+                self._loaded[name] = chatbot
+                self.loads += 1
+            logger.info("Loaded tenant %s from %s", name, directory)
+
+        self._enforce_limits(keep=name)
+        return chatbot
+
+    def evict(self, name):
+        """Drop a loaded tenant; returns True if it was loaded."""
+        with self._lock:
+            chatbot = self._loaded.pop(name, None)
+            if chatbot is None:
+                return False
+            self.evictions += 1
+        logger.info("Evicted tenant %s", name)
+        return True
+
+    def _enforce_limits(self, keep):
+        """Evict least recently used tenants, never `keep`, until the limits are met."""
+        while True:
+            with self._lock:
+                loaded = list(self._loaded.items())
+            if len(loaded) <= 1:
+                return
+            over_count = self.max_loaded is not None and len(loaded) > self.max_loaded
+            over_budget = False
+            if not over_count and self.memory_budget is not None:
+                total = sum(chatbot.memory_usage()['heap_bytes'] for _, chatbot in loaded)
+                over_budget = total > self.memory_budget
+            if not (over_count or over_budget):
+                return
+            victim = next((name for name, _ in loaded if name != keep), None)
+            if victim is None or not self.evict(victim):
+                return
+
+    def report(self):
+        """Loaded state and estimated memory of every tenant, plus registry totals."""
+        with self._lock:
+            loaded = list(self._loaded.items())
+        tenants = {name: {'loaded': False} for name in self.names()}
+        heap_bytes = mapped_bytes = 0
+        for name, chatbot in loaded:
+            usage = chatbot.memory_usage()
+            heap_bytes += usage['heap_bytes']
+            mapped_bytes += usage['mapped_bytes']
+            tenants[name] = dict(usage, loaded=True)
+        return {
+            'tenants': tenants,
+            'loaded': len(loaded),
+            'heap_bytes': heap_bytes,
+            'mapped_bytes': mapped_bytes,
+            'memory_budget': self.memory_budget,
+            'max_loaded': self.max_loaded,
+            'loads': self.loads,
+            'evictions': self.evictions
+        }
+
+
+if __name__ == '__main__':
+    # Prebuild every tenant's index artifact: python tenants.py <tenants dir>
+    logging.basicConfig(level=logging.INFO)
+    registry = TenantRegistry(sys.argv[1] if len(sys.argv) > 1 else os.environ.get('TENANTS_DIR', 'tenants'))
+    for tenant in registry.names():
+        chatbot = registry.get(tenant)
+        chatbot.build_index_artifact(registry.directory(tenant) / TENANT_INDEX_ARTIFACT)
+        registry.evict(tenant)
@@ -0,0 +1,75 @@
+import re
+
+from matcher import WORD_RE
+
+# Punctuation is deleted rather than split on for retrieval queries, so "don't"
+# is looked up as "dont" while the matcher and key terms see "don" "t"
+PUNCTUATION_RE = re.compile(r'[^\w\s]')
+
+# Common English stopwords
+STOPWORDS = {
+    'i', 'me', 'my', 'myself', 'we', 'our', 'ours', 'ourselves', 'you', "you're", "you've", "you'll",
+    "you'd", 'your', 'yours', 'yourself', 'yourselves', 'he', 'him', 'his', 'himself', 'she', "she's",
+    'her', 'hers', 'herself', 'it', "it's", 'its', 'itself', 'they', 'them', 'their', 'theirs',
+    'themselves', 'what', 'which', 'who', 'whom', 'this', 'that', "that'll", 'these', 'those', 'am',
+    'is', 'are', 'was', 'were', 'be', 'been', 'being', 'have', 'has', 'had', 'having', 'do', 'does',
+    'did', 'doing', 'a', 'an', 'the', 'and', 'but', 'if', 'or', 'because', 'as', 'until', 'while',
+    'of', 'at', 'by', 'for', 'with', 'about', 'against', 'between', 'into', 'through', 'during',
+    'before', 'after', 'above', 'below', 'to', 'from', 'up', 'down', 'in', 'out', 'on', 'off', 'over',
+    'under', 'again', 'further', 'then', 'once', 'here', 'there', 'when', 'where', 'why', 'how', 'all',
+    'any', 'both', 'each', 'few', 'more', 'most', 'other', 'some', 'such', 'no', 'nor', 'not', 'only',
+    'own', 'same', 'so', 'than', 'too', 'very', 's', 't', 'can', 'will', 'just', 'don', "don't",
+    'should', "should've", 'now', 'd', 'll', 'm', 'o', 're', 've', 'y', 'ain', 'aren', "aren't",
+    'couldn', "couldn't", 'didn', "didn't", 'doesn', "doesn't", 'hadn', "hadn't", 'hasn', "hasn't",
+    'haven', "haven't", 'isn', "isn't", 'ma', 'mightn', "mightn't", 'mustn', "mustn't", 'needn', "needn't",
+    'shan', "shan't", 'shouldn', "shouldn't", 'wasn', "wasn't", 'weren', "weren't", 'won', "won't",
+    'wouldn', "wouldn't"
+}
+
+
+def simple_tokenize(text):
+    """Lowercase words of a text, split on whitespace and punctuation"""
+    return WORD_RE.findall(text.lower())
+
+
+def normalize_text(text):
+    """Normalize a message for memoization: lowercase words separated by single spaces"""
+    return ' '.join(WORD_RE.findall(text.lower()))
+
+
+class ParsedMessage:
+    """One user message, lowercased and tokenized once and shared by every pipeline stage.
+
+    tokens are the lowercase words the keyword matcher also walks; key_terms
+    the content words used for learned-response patterns and interests;
+    query the stopword-filtered text handed to retrieval.
+    """
+    __slots__ = ('text', 'lowered', 'tokens', 'key_terms', 'query', '_token_set')
+
+    def __init__(self, text, stop_words=STOPWORDS):
+        self.text = text
+        self.lowered = text.lower()
+        self.tokens = WORD_RE.findall(self.lowered)
+        self.key_terms = [token for token in self.tokens if len(token) > 3 and token not in stop_words]
+        # Only messages with punctuation tokenize differently for retrieval
+        if PUNCTUATION_RE.search(self.lowered):
+            query_tokens = PUNCTUATION_RE.sub('', self.lowered).split()
+        else:
+            query_tokens = self.tokens
+        self.query = ' '.join([token for token in query_tokens if token not in stop_words])
+        self._token_set = None
+
+    @property
+    def normalized(self):
+        """Memoization key: the words separated by single spaces."""
+        return ' '.join(self.tokens)
+
+    @property
+    def token_set(self):
+        """The distinct words of the message."""
+        if self._token_set is None:
+            self._token_set = frozenset(self.tokens)
+        return self._token_set
+
+    def __repr__(self):
+        return f"ParsedMessage({self.text!r})"
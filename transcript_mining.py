@@ -0,0 +1,246 @@
+import argparse
+import heapq
+import json
+import logging
+import os
+import time
+
+import numpy as np
+
+from embeddings import HashedEmbedder
+from text_processing import ParsedMessage
+from transcripts import iter_transcripts
+
+logger = logging.getLogger(__name__)
+
+# Answers that didn't come from the knowledge base: fallbacks and generic intent replies
+UNANSWERED_BRANCHES = frozenset({'fallback', 'intent'})
+
+# Answers from retrieval, which are mined when the best match is only just above the threshold
+RETRIEVAL_BRANCHES = frozenset({'tfidf', 'dense', 'hybrid', 'learned'})
+
+# Retrieval answers scoring below the chatbot's threshold plus this margin count as weak
+LOW_SIMILARITY_MARGIN = 0.1
+
+
+def faq_question(text):
+    """A logged message tidied up as an FAQ question."""
+    text = ' '.join(text.split())
+    if not text:
+        return text
+    text = text[0].upper() + text[1:]
+    return text if text[-1] in '?.!' else text + '?'
+
+
+class QueryCluster:
+    """Distinct queries whose embeddings are close to the cluster's leader, the most frequent one."""
+    __slots__ = ('total', 'queries', 'examples', 'vector')
+
+    def __init__(self, example, count, vector):
+        self.total = count
+        self.queries = 1
+        self.examples = [example]
+        self.vector = vector * count
+
+    def add(self, example, count, vector, max_examples):
+        self.total += count
+        self.queries += 1
+        self.vector += vector * count
+        if len(self.examples) < max_examples:
+            self.examples.append(example)
+
+
+class TranscriptMiner:
+    """Turns logged exchanges into candidate FAQ entries for company_data.json.
+
+    Only exchanges recorded for the chatbot's tenant (None for the default
+    chatbot) are mined. They are streamed in chunks of chunk_size. Messages
+    answered by a fallback or a generic intent reply are kept, as are
+    retrieval answers whose best match against the chatbot's current index,
+    rescored in one batch per chunk, falls below low_similarity. Messages
+    without a content word are ignored; the rest are counted by
+    their normalized text in a table of at most max_unique entries; when it
+    fills up, only the most frequent half is kept, so memory stays bounded
+    for any amount of traffic. candidates() embeds the most frequent queries
+    with HashedEmbedder and groups them by cosine similarity, chunk by chunk
+    with one matrix product against the cluster centroids.
+    """
+    def __init__(self, chatbot, low_similarity=None, cluster_similarity=0.5, chunk_size=20000, max_unique=200000,
+                 embedder=None):
+        self.chatbot = chatbot
+        if low_similarity is None:
+            low_similarity = chatbot.retrieval_threshold + LOW_SIMILARITY_MARGIN
+        self.low_similarity = low_similarity
+        self.cluster_similarity = cluster_similarity
+        self.chunk_size = chunk_size
+        self.max_unique = max_unique
+        self.embedder = embedder or HashedEmbedder()
+        # normalized text -> [count, first message seen with it]
+        self.counts = {}
+        self.scanned = 0
+        self.unanswered = 0
+        self.weak_matches = 0
+        self.pruned = 0
+
+    def add_exchanges(self, exchanges):
+        """Stream exchanges (dicts with user and branch, as iter_transcripts yields) into the counts."""
+        chunk = []
+        tenant = self.chatbot.tenant
+        for exchange in exchanges:
+            if exchange.get('tenant') != tenant:
+                continue
+            self.scanned += 1
+            branch = exchange.get('branch')
+            if branch in UNANSWERED_BRANCHES or branch in RETRIEVAL_BRANCHES:
+                chunk.append((exchange['user'], branch))
+                if len(chunk) >= self.chunk_size:
+                    self._add_chunk(chunk)
+                    chunk = []
+        if chunk:
+            self._add_chunk(chunk)
+        return self
+
+    def _add_chunk(self, chunk):
+        parsed = {}
+        for text, _ in chunk:
+            if text not in parsed:
+                parsed[text] = ParsedMessage(text)
+
+        # Rescore each distinct retrieval-answered message once, in one batch
+        answered = list({text for text, branch in chunk if branch in RETRIEVAL_BRANCHES})
+        weak = set()
+        if answered:
+            matches = self.chatbot.best_matches(answered)
+            weak = {text for text, match in zip(answered, matches) if match is None or match.score < self.low_similarity}
+
+        counts = self.counts
+        for text, branch in chunk:
+            if branch in UNANSWERED_BRANCHES:
+                self.unanswered += 1
+            elif text in weak:
+                self.weak_matches += 1
+            else:
+                continue
+            # Without a content word ("ok", "lol", "how are you") there is no question to answer
+            if not parsed[text].key_terms:
+                continue
+            key = parsed[text].normalized
+            entry = counts.get(key)
+            if entry is None:
+                counts[key] = [1, text]
+            else:
+                entry[0] += 1
+        if len(counts) > self.max_unique:
+            self._prune()
+
+    def _prune(self):
+        """Keep the most frequent half of the count table; rare queries can't lead a cluster anyway."""
+        keep = heapq.nlargest(self.max_unique // 2, self.counts.items(), key=lambda item: item[1][0])
+        self.pruned += len(self.counts) - len(keep)
+        self.counts = dict(keep)
+
+    def clusters(self, min_count=2, max_queries=20000, max_examples=5):
+        """QueryClusters of the max_queries most frequent queries seen min_count times, largest first."""
+        items = sorted(((count, key, text) for key, (count, text) in self.counts.items() if count >= min_count),
+                       reverse=True)[:max_queries]
+        clusters = []
+        centroids = np.zeros((0, self.embedder.dim), dtype=np.float32)
+        for start in range(0, len(items), 4096):
+            batch = items[start:start + 4096]
+            vectors = self.embedder.encode([key for _, key, _ in batch])
+            # Queries close to an existing centroid join it; the rest found new clusters in frequency order
+            if len(clusters):
+                similarities = vectors @ centroids.T
+                best = similarities.argmax(axis=1)
+                joined = similarities[np.arange(len(batch)), best] >= self.cluster_similarity
+            else:
+                best = np.zeros(len(batch), dtype=np.intp)
+                joined = np.zeros(len(batch), dtype=bool)
+            for position in np.flatnonzero(joined):
+                count, _, text = batch[position]
+                clusters[best[position]].add(text, count, vectors[position], max_examples)
+
+            leftover = np.flatnonzero(~joined)
+            if len(leftover):
+                within = vectors[leftover] @ vectors[leftover].T
+                assigned = np.zeros(len(leftover), dtype=bool)
+                for row in range(len(leftover)):
+                    if assigned[row]:
+                        continue
+                    members = np.flatnonzero(~assigned & (within[row] >= self.cluster_similarity))
+                    assigned[members] = True
+                    count, _, text = batch[leftover[row]]
+                    cluster = QueryCluster(text, count, vectors[leftover[row]])
+                    for member in members:
+                        if member != row:
+                            count, _, text = batch[leftover[member]]
+                            cluster.add(text, count, vectors[leftover[member]], max_examples)
+                    clusters.append(cluster)
+            centroids = np.array([cluster.vector for cluster in clusters], dtype=np.float32)
+            norms = np.linalg.norm(centroids, axis=1, keepdims=True)
+            norms[norms == 0.0] = 1.0
+            centroids /= norms
+        clusters.sort(key=lambda cluster: cluster.total, reverse=True)
+        return clusters
+
+    def candidates(self, top=50, min_count=2):
+        """Report with the top clusters as FAQ entries to review, answer and add to company_data.json."""
+        clusters = self.clusters(min_count=min_count)[:top]
+        nearest = self.chatbot.best_matches([cluster.examples[0] for cluster in clusters])
+        candidates = []
+        for cluster, match in zip(clusters, nearest):
+            candidates.append({
+                'question': faq_question(cluster.examples[0]),
+                'answer': '',
+                'frequency': cluster.total,
+                'distinct_queries': cluster.queries,
+                'examples': cluster.examples,
+                'nearest_entry': match.entry_id if match is not None else None,
+                'nearest_score': round(match.score, 3) if match is not None else None
+            })
+        return {
+            'exchanges_scanned': self.scanned,
+            'unanswered': self.unanswered,
+            'weak_matches': self.weak_matches,
+            'distinct_queries': len(self.counts),
+            'pruned_queries': self.pruned,
+            'low_similarity': round(self.low_similarity, 3),
+            'candidates': candidates
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mine transcripts for questions the knowledge base doesn't answer.")
+    parser.add_argument('directory', nargs='?', default=os.environ.get('TRANSCRIPT_DIR', 'transcripts'))
+    parser.add_argument('--days', type=float, default=7, help='only exchanges from the last N days (0 for all)')
+    parser.add_argument('--top', type=int, default=50)
+    parser.add_argument('--min-count', type=int, default=3)
+    parser.add_argument('--output', help='write the report here instead of stdout')
+    parser.add_argument('--tenant', help="mine this tenant's exchanges against its own data in TENANTS_DIR")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    from chatbot import AphatorChatbot, DEFAULT_INDEX_ARTIFACT
+    if args.tenant:
+        from tenants import tenant_paths
+        chatbot = AphatorChatbot(retrieval_mode=os.environ.get('RETRIEVAL_MODE', 'tfidf'),
+                                 **tenant_paths(os.path.join(os.environ.get('TENANTS_DIR', 'tenants'), args.tenant)))
+    else:
+        chatbot = AphatorChatbot(index_artifact=os.environ.get('INDEX_ARTIFACT', str(DEFAULT_INDEX_ARTIFACT)),
+                                 retrieval_mode=os.environ.get('RETRIEVAL_MODE', 'tfidf'))
+    since = time.time() - args.days * 86400 if args.days else None
+    started = time.perf_counter()
+    miner = TranscriptMiner(chatbot).add_exchanges(iter_transcripts(args.directory, since=since))
+    report = miner.candidates(top=args.top, min_count=args.min_count)
+    logger.info("Mined %s exchanges into %s candidates in %.1fs", miner.scanned, len(report['candidates']),
+                time.perf_counter() - started)
+    output = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,203 @@
+import atexit
+import gzip
+import json
+import logging
+import os
+import shutil
+import sys
+import threading
+import time
+from collections import Counter, deque
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+# Segment files: transcripts-<UTC start time>-<pid>-<sequence>.jsonl while being
+# written, .jsonl.gz once rotated; names sort in time order
+SEGMENT_PREFIX = 'transcripts-'
+ACTIVE_SUFFIX = '.jsonl'
+CLOSED_SUFFIX = '.jsonl.gz'
+
+
+class TranscriptLog:
+    """Append-only conversation transcripts in rotating, compressed JSONL segments.
+
+    append() only puts the exchange on a bounded deque, so answering a
+    message never waits on the disk. A writer thread wakes every
+    flush_interval seconds and writes everything queued since with one write
+    to the active segment. A segment is closed once it exceeds segment_bytes
+    or is segment_seconds old; closed segments are gzip-compressed. Each
+    process writes its own segments, so several workers can share one
+    directory. When max_queued exchanges are waiting, new ones are dropped
+    and counted in `dropped`.
+    """
+    def __init__(self, directory, segment_bytes=64 * 1024 * 1024, segment_seconds=3600, flush_interval=0.5,
+                 max_queued=100000, compress=True):
+        self.directory = Path(directory)
+        self.segment_bytes = segment_bytes
+        self.segment_seconds = segment_seconds
+        self.flush_interval = flush_interval
+        self.max_queued = max_queued
+        self.compress = compress
+        self.written = 0
+        self.dropped = 0
+        self.segments = 0
+        self._pending = deque()
+        self._stopping = threading.Event()
+        self._thread = None
+        self._file = None
+        self._path = None
+        self._opened = 0.0
+        self._sequence = 0
+
+    def append(self, session_id, user_input, bot_response, branch=None, timestamp=None, tenant=None):
+        """Queue one exchange for writing; tenant is None for the default chatbot."""
+        # deque.append is atomic, so request threads never wait on a lock here
+        if len(self._pending) >= self.max_queued:
+            self.dropped += 1
+            return
+        self._pending.append((timestamp or time.time(), session_id, user_input, bot_response, branch, tenant))
+
+    def start(self):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        if self.compress:
+            self._compress_orphans()
+        self._thread = threading.Thread(target=self._run, name='transcript-writer', daemon=True)
+        self._thread.start()
+        atexit.register(self.stop)
+        return self
+
+    def stop(self):
+        """Write out the queued exchanges, close the active segment and stop the writer thread."""
+        if self._thread is not None:
+            self._stopping.set()
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while not self._stopping.wait(self.flush_interval):
+            self._write_pending()
+        self._write_pending()
+        self._rotate()
+
+    def _write_pending(self, batch_size=5000):
+        pending = self._pending
+        while True:
+            lines = []
+            while pending and len(lines) < batch_size:
+                timestamp, session_id, user_input, bot_response, branch, tenant = pending.popleft()
+                record = {'ts': round(timestamp, 3), 'session': session_id, 'user': user_input,
+                          'bot': bot_response, 'branch': branch}
+                if tenant is not None:
+                    record['tenant'] = tenant
+                lines.append(json.dumps(record, ensure_ascii=False))
+            try:
+                # Rotation is checked between batches, so a backlog still produces bounded segments
+                if self._file is not None and (self._file.tell() >= self.segment_bytes or
+                                               time.time() - self._opened >= self.segment_seconds):
+                    self._rotate()
+                if not lines:
+                    return
+                if self._file is None:
+                    self._open_segment()
+                self._file.write('\n'.join(lines) + '\n')
+                self._file.flush()
+                self.written += len(lines)
+            except Exception as e:
+                self.dropped += len(lines)
+                logger.error("Error writing transcripts to %s: %s", self.directory, e)
+                return
+
+    def _open_segment(self):
+        self._sequence += 1
+        name = f"{SEGMENT_PREFIX}{time.strftime('%Y%m%dT%H%M%S', time.gmtime())}-{os.getpid()}-{self._sequence:04d}"
+        self._path = self.directory / (name + ACTIVE_SUFFIX)
+        self._file = open(self._path, 'a', encoding='utf-8')
+        self._opened = time.time()
+
+    def _rotate(self):
+        """Close the active segment and compress it."""
+        if self._file is None:
+            return
+        self._file.close()
+        self._file = None
+        self.segments += 1
+        if self.compress:
+            compress_segment(self._path)
+
+    def _compress_orphans(self):
+        """Compress active segments left behind by processes that exited without closing them."""
+        for path in segment_paths(self.directory):
+            if not path.name.endswith(ACTIVE_SUFFIX):
+                continue
+            try:
+                pid = int(path.name[:-len(ACTIVE_SUFFIX)].split('-')[-2])
+                os.kill(pid, 0)
+            except ProcessLookupError:
+                compress_segment(path)
+            except (ValueError, IndexError, OSError):
+                continue
+
+
+def compress_segment(path):
+    """Gzip a closed segment in place of the original."""
+    try:
+        with open(path, 'rb') as source, gzip.open(f"{path}.gz.tmp", 'wb') as target:
+            shutil.copyfileobj(source, target)
+        # The reader never sees a half-written .gz
+        os.replace(f"{path}.gz.tmp", f"{path}.gz")
+        os.remove(path)
+    except OSError as e:
+        logger.error("Error compressing transcript segment %s: %s", path, e)
+
+
+def segment_paths(directory):
+    """Transcript segment files in time order, compressed or still being written."""
+    directory = Path(directory)
+    if not directory.is_dir():
+        return []
+    paths = [path for path in directory.iterdir()
+             if path.name.startswith(SEGMENT_PREFIX) and path.name.endswith((ACTIVE_SUFFIX, CLOSED_SUFFIX))]
+    names = {path.name for path in paths}
+    # A segment caught between compression and removal of the original is read once, from the .gz
+    return sorted(path for path in paths if not (path.name.endswith(ACTIVE_SUFFIX) and path.name + '.gz' in names))
+
+
+def iter_transcripts(directory, since=None, until=None):
+    """Stream exchanges as dicts (ts, session, user, bot, branch, and tenant if any) from every segment, oldest first.
+
+    Segments are read line by line, so memory stays bounded however many
+    exchanges there are. since and until are Unix timestamps; a line cut
+    short by a crash is skipped.
+    """
+    for path in segment_paths(directory):
+        opener = gzip.open if path.name.endswith(CLOSED_SUFFIX) else open
+        try:
+            with opener(path, 'rt', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        exchange = json.loads(line)
+                    except ValueError:
+                        continue
+                    if since is not None and exchange['ts'] < since:
+                        continue
+                    if until is not None and exchange['ts'] >= until:
+                        continue
+                    yield exchange
+        except (OSError, EOFError) as e:
+            logger.error("Error reading transcript segment %s: %s", path, e)
+
+
+if __name__ == '__main__':
+    # Summary of a transcript directory: python transcripts.py <directory>
+    logging.basicConfig(level=logging.INFO)
+    branches = Counter()
+    tenants = Counter()
+    first = last = None
+    for exchange in iter_transcripts(sys.argv[1] if len(sys.argv) > 1 else os.environ.get('TRANSCRIPT_DIR', 'transcripts')):
+        branches[exchange.get('branch')] += 1
+        tenants[exchange.get('tenant')] += 1
+        first = exchange['ts'] if first is None else min(first, exchange['ts'])
+        last = exchange['ts'] if last is None else max(last, exchange['ts'])
+    print(json.dumps({'exchanges': sum(branches.values()), 'first': first, 'last': last, 'branches': dict(branches),
+                      'tenants': {name or 'default': count for name, count in tenants.items()}}))